@@ -0,0 +1,14 @@
+"""
+Benchmarks for ClinicMGR. Run from the repository root, e.g.
+
+    python -m benchmarks.bench_search_index
+
+Importing this package configures Kivy so main.py can be imported without a display.
+"""
+import os
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_FILELOG", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+os.environ.setdefault("KIVY_GL_BACKEND", "mock")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
@@ -0,0 +1,57 @@
+"""
+Cost of the cold tier. N synthetic patients, most of them last seen years ago, are
+loaded once so the cold ones move to the archive; the store is then reopened and its
+load, searches over hot plus archived patients (which read the candidate segments),
+first pages (the UI thread's share; segments are scanned on another thread) and the
+first segment scan are timed, along with reading an archived patient's full record.
+The scaling suite runs with archiving off, so this is where archive regressions show.
+
+    python -m benchmarks.bench_archive [--records 5000]
+"""
+import argparse
+import os
+import resource
+import tempfile
+import threading
+
+from benchmarks.dataset import generate_patients
+from benchmarks.run_suite import REPEAT, timed_ms
+
+QUERIES = (("name", ""), ("name", "khan"), ("disease", "diab"), ("mob no.", "98765"),
+           ("date", "2016-01-01..2016-12-31"), ("fuzzy name", "mohd khan"))
+
+def wait_for_scans():
+    for thread in threading.enumerate():
+        if thread.name == "archive-scan":
+            thread.join()
+
+def main_bench(n):
+    os.chdir(tempfile.mkdtemp(prefix="clinicmgr-archive-"))
+    import storage
+    storage.PatientJournal().write_snapshot(generate_patients(n), seq=0, next_id=n + 1)
+    repository = storage.create_repository()
+    archive_ms, _ = timed_ms(repository.load)
+    repository.close()
+
+    repository = storage.create_repository()
+    load_ms, _ = timed_ms(repository.load)
+    print(f"{n} records, {repository.archive.count()} archived: first load (archiving) {archive_ms:.0f} ms, "
+          f"reopen {load_ms:.0f} ms")
+    for field, text in QUERIES:
+        search_ms, found = timed_ms(lambda: repository.search(field, text), REPEAT)
+        page_ms, _ = timed_ms(lambda: repository.cursor(field, text).fetch(storage.RECORDS_PAGE_SIZE), REPEAT)
+        wait_for_scans()
+        jobs = getattr(repository.cursor(field, text), "jobs", [])
+        scan_ms, _ = timed_ms(jobs[0], REPEAT) if jobs else (0.0, None)
+        print(f"  {field + ':' + text:<36} search {search_ms:8.2f} ms ({len(found)} found), "
+              f"first page {page_ms:6.2f} ms, first of {len(jobs)} scans {scan_ms:7.2f} ms")
+    archived = next(iter(repository.archive.segment_of))
+    get_ms, _ = timed_ms(lambda: repository.get(archived), REPEAT)
+    print(f"  archived get(): {get_ms:.2f} ms")
+    repository.close()
+    print(f"  peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=5000)
+    main_bench(parser.parse_args().records)
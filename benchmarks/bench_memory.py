@@ -0,0 +1,43 @@
+"""
+Memory held by N loaded records as the plain dicts json.load() returns versus the
+compact Patient store.
+
+    python -m benchmarks.bench_memory [--records 100000]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from benchmarks.dataset import generate_patients
+import storage
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+def main_bench(n):
+    text = json.dumps(generate_patients(n))
+    dicts, dict_bytes, dict_peak, dict_s = measure(lambda: json.loads(text))
+    compact, compact_bytes, compact_peak, compact_s = measure(
+        lambda: [storage.Patient.from_dict(d) for d in json.loads(text)])
+    # to_dict() nests the visits; compare against the same normalized shape
+    assert [p.to_dict() for p in compact[:1000]] == [storage.normalize_record(dict(d)) for d in dicts[:1000]]
+    for label, held, peak, seconds in (("dict", dict_bytes, dict_peak, dict_s),
+                                       ("Patient", compact_bytes, compact_peak, compact_s)):
+        print(f"{label:<8} {n} records: {held / 2**20:7.1f} MiB held ({held / n:5.0f} B/record), "
+              f"peak {peak / 2**20:7.1f} MiB, {seconds * 1000:6.0f} ms")
+    print(f"saving: {(1 - compact_bytes / dict_bytes) * 100:.0f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+    main_bench(args.records)
@@ -0,0 +1,50 @@
+"""
+Query latency of PatientSearchIndex against the old per-keystroke linear scan.
+
+    python -m benchmarks.bench_search_index [--records 100000]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.dataset import generate_patients
+import storage
+
+QUERIES = {
+    "name": ["m", "mo", "moh", "khan", "mohammed khan", "zzz"],
+    "date": ["2", "20", "2021", "2021-06", "2021-06-15"],
+    "diseases": ["d", "di", "dia", "diabetes", "hyperten"],
+    "mobile_no": ["9", "98", "987", "98765", "9876543"],
+}
+
+def linear_scan(patients, field, text):
+    return [p for p in patients if text in p.get(field, "").lower()]
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+def main_bench(n, repeat):
+    patients = generate_patients(n)
+    index = storage.PatientSearchIndex()
+    start = time.perf_counter()
+    index.build(patients)
+    print(f"{n} records, index build {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'field':<10} {'query':<16} {'hits':>7} {'scan ms':>9} {'index ms':>9}")
+    for field, queries in QUERIES.items():
+        for text in queries:
+            scan_ms, expected = timed(lambda: linear_scan(patients, field, text), repeat)
+            index_ms, found = timed(lambda: index.search(field, text), repeat)
+            assert found == expected, (field, text)
+            print(f"{field:<10} {text:<16} {len(found):>7} {scan_ms:>9.2f} {index_ms:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main_bench(args.records, args.repeat)
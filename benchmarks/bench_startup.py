@@ -0,0 +1,72 @@
+"""
+Time to first frame and time until every record is loaded, for a data directory with
+N synthetic patients (default 50,000). Exits with status 1 when the first frame, i.e.
+the Home screen becoming interactive, takes longer than the budget.
+
+    python -m benchmarks.bench_startup [--records 50000] [--no-summary] [--budget-ms 1500]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.dataset import generate_patients
+
+STARTUP_BUDGET_MS = 1500  # Time to the Home screen's first frame, from the start of main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def prepare(directory, n, summary=True):
+    import storage
+    os.chdir(directory)
+    storage.PatientJournal().write_snapshot(generate_patients(n), seq=0)
+    # Most synthetic patients were last seen years ago; load once so their one-time move to
+    # the archive is not timed, and startup is measured on the store as the app leaves it
+    repository = storage.create_repository()
+    repository.load()
+    repository.close()
+    if not summary:
+        os.remove(storage.SUMMARY_FILE)
+
+def run(directory):
+    """Starts the app on the data in directory and returns (first frame ms, loaded ms)."""
+    # main.py is found through the working directory, which is about to change
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.chdir(directory)
+    import main
+    from kivy.clock import Clock
+
+    app = main.PatientManagementApp()
+    def wait_for_load(dt):
+        if app.loaded_ms is not None:
+            Clock.unschedule(wait_for_load)
+            app.stop()
+    Clock.schedule_interval(wait_for_load, 0.05)
+    app.run()
+    return app.first_frame_ms, app.loaded_ms
+
+def run_fresh(directory):
+    # A new interpreter, so main.py and Kivy are imported from scratch after APP_START
+    command = [sys.executable, "-c", "import json; from benchmarks.bench_startup import run; "
+               f"print(json.dumps(run({directory!r})))"]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000)
+    parser.add_argument("--no-summary", action="store_true", help="measure without the summary file")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help="fail when the first frame takes longer (0 disables the check)")
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp(prefix="clinicmgr-bench-")
+    prepare(directory, args.records, summary=not args.no_summary)
+    first_frame_ms, loaded_ms = run_fresh(directory)
+    print(f"{args.records} records: first frame {first_frame_ms:.0f} ms, all records loaded {loaded_ms:.0f} ms")
+    if args.budget_ms and first_frame_ms > args.budget_ms:
+        print(f"FAIL: first frame exceeds the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+    if args.budget_ms:
+        print(f"OK: within the {args.budget_ms:.0f} ms budget")
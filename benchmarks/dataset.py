@@ -0,0 +1,41 @@
+"""Synthetic patient records in the exact PatientMedicalForm.get_patient_data() schema."""
+import random
+from datetime import date, timedelta
+
+FIRST_NAMES = ["Mohammed", "Mohd", "Ahmed", "Aisha", "Fatima", "Ravi", "Priya", "Anil", "Sunita",
+               "Rahul", "Neha", "Vikram", "Pooja", "Arjun", "Kavita", "Imran", "Sana", "John", "Mary", "Ali"]
+LAST_NAMES = ["Khan", "Sharma", "Patel", "Singh", "Gupta", "Reddy", "Iyer", "Shaikh", "Das", "Nair",
+              "Joshi", "Mehta", "Ansari", "Verma", "Rao", "Pillai", "Kapoor", "Qureshi", "Bose", "Malik"]
+DISEASES = ["diabetes", "hypertension", "asthma", "migraine", "arthritis", "thyroid", "anemia",
+            "gastritis", "bronchitis", "eczema", "malaria", "typhoid", "dengue", "flu", ""]
+MEDICINES = ["metformin 500mg", "amlodipine 5mg", "paracetamol 650mg", "salbutamol inhaler",
+             "pantoprazole 40mg", "thyroxine 50mcg", "iron tablets", "azithromycin 500mg"]
+
+def make_patient(i, rng, start=date(2015, 1, 1), days=365 * 10):
+    visit = start + timedelta(days=rng.randrange(days))
+    surgery = "Yes" if rng.random() < 0.1 else "No"
+    return {
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "mobile_no": str(rng.randrange(6000000000, 9999999999)),
+        "date": visit.strftime("%Y-%m-%d"),
+        "adress": f"{rng.randrange(1, 999)} Street {rng.randrange(1, 200)}, Block {rng.choice('ABCDEF')}",
+        "gender": rng.choice(["Male", "Female", "Other"]),
+        "weight": f"{rng.uniform(35, 110):.1f}",
+        "systolic_bp": str(rng.randrange(95, 180)),
+        "diastolic_bp": str(rng.randrange(60, 115)),
+        "pulse_rate": str(rng.randrange(55, 110)),
+        "surgery": surgery,
+        "surgery_description": "appendectomy" if surgery == "Yes" else "",
+        "medical_history": rng.choice(["", "No known allergies", "Smoker, 10 years", "Family history of diabetes"]),
+        "diseases": ", ".join(d for d in rng.sample(DISEASES, rng.randrange(1, 3)) if d),
+        "medicines": ", ".join(rng.sample(MEDICINES, rng.randrange(1, 3))),
+        "extra": "",
+        "other_illnesses": "",
+        "other_medicines": "",
+        "next_appointment_date": (visit + timedelta(days=rng.choice([7, 14, 30]))).strftime("%Y-%m-%d"),
+        "id": str(i + 1),
+    }
+
+def generate_patients(n, seed=1234):
+    rng = random.Random(seed)
+    return [make_patient(i, rng) for i in range(n)]
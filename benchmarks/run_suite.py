@@ -0,0 +1,177 @@
+"""
+Scaling benchmark for storage, search and the records list. Each dataset size runs in
+its own subprocess so peak memory is measured per size. Results are written as JSON
+and can be compared with an earlier run.
+
+    python -m benchmarks.run_suite [--sizes 1000,10000,100000,1000000] [--storage journal]
+                                   [--output results.json] [--compare old.json]
+
+Runs headless: benchmarks/__init__.py selects Kivy's mock GL backend and SDL's dummy
+video driver. Where SDL cannot create a window that way, run under xvfb-run instead.
+The records list is rendered in a second subprocess per size, after the storage
+metrics are in, so a window that cannot be created only costs the rendering metrics
+(recorded as render_skipped).
+
+Archiving is off, so every size measures the hot tier whatever the dataset's dates;
+benchmarks/bench_archive.py measures the archive.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.dataset import generate_patients
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+SEARCHES = {
+    "name": ("m", "khan", "mohammed khan"),
+    "date": ("2021", "2021-06-15", "2021-01-01..2021-03-31"),
+    "disease": ("diab", "hypertension"),
+    "mob no.": ("98", "98765"),
+    "fuzzy name": ("mohd khan", "jhon smith"),
+}
+REPEAT = 5
+WRITES = 100
+
+def timed_ms(fn, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+def measure(n, storage):
+    """Runs in the worker subprocess; returns a dict of metrics for one dataset size."""
+    directory = tempfile.mkdtemp(prefix="clinicmgr-suite-")
+    os.chdir(directory)
+    import storage as storage_module
+    metrics = {}
+    storage_module.PatientJournal().write_snapshot(generate_patients(n), seq=0, next_id=n + 1)
+
+    repository = storage_module.create_repository(storage, archive_after_days=None)
+    metrics["load_ms"], _ = timed_ms(repository.load)
+    if storage != "sqlite":
+        patients = list(repository.patients.values())
+        metrics["save_snapshot_ms"], _ = timed_ms(
+            lambda: repository.journal.write_snapshot(patients, next_id=repository.next_id))
+    sample = generate_patients(WRITES, seed=99)
+    start = time.perf_counter()
+    new_ids = [repository.insert(record) for record in sample]
+    repository.flush()
+    metrics["insert_ms"] = (time.perf_counter() - start) * 1000 / WRITES
+    start = time.perf_counter()
+    for patient_id in new_ids:
+        repository.delete(patient_id)
+    repository.flush()
+    metrics["delete_ms"] = (time.perf_counter() - start) * 1000 / WRITES
+
+    results = {}
+    for field, queries in SEARCHES.items():
+        for text in queries:
+            ms, results[(field, text)] = timed_ms(lambda: repository.search(field, text), REPEAT)
+            metrics[f"search_ms[{field}:{text}]"] = ms
+    metrics["search_ms[all]"], _ = timed_ms(lambda: repository.search("name", ""), REPEAT)
+    # What opening the Records screen costs: count plus the first page from a cursor
+    for field, text in (("name", ""), ("name", "m"), ("date", "2021-01-01..2021-03-31")):
+        metrics[f"first_page_ms[{field}:{text}]"], _ = timed_ms(
+            lambda: repository.cursor(field, text).fetch(storage_module.RECORDS_PAGE_SIZE), REPEAT)
+    repository.close()
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+def measure_rendering(n):
+    """Runs in the rendering subprocess: shows all n patients, newest first, in a RecordsScreen."""
+    from storage import Patient, normalize_record
+    records = [Patient.from_dict(normalize_record(r)) for r in generate_patients(n)]
+    records.sort(key=lambda p: p.get("date"), reverse=True)
+    import main
+    from kivy.base import EventLoop
+    from kivy.clock import Clock
+    EventLoop.ensure_window()
+    screen = main.RecordsScreen(name="records")
+    EventLoop.window.add_widget(screen)
+    def render():
+        screen.show_records(records)
+        Clock.tick()
+    render_ms, _ = timed_ms(render, REPEAT)
+    rows = len(screen.records_view.layout_manager.children)
+    EventLoop.window.remove_widget(screen)
+    return {"render_ms": render_ms, "row_widgets": rows}
+
+def render_worker(n):
+    # Creating a window can raise SystemExit, or exit the process outright, without a display
+    try:
+        metrics = measure_rendering(n)
+    except BaseException as e:
+        metrics = {"render_skipped": f"{type(e).__name__}: {e}"}
+    print(json.dumps(metrics))
+
+def run_worker(n, storage):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-m", "benchmarks.run_suite", "--worker", str(n), "--storage", storage]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=root).stdout
+    metrics = json.loads(output.strip().splitlines()[-1])
+    command = [sys.executable, "-m", "benchmarks.run_suite", "--render-worker", str(n)]
+    rendering = subprocess.run(command, capture_output=True, text=True, cwd=root)
+    try:
+        metrics.update(json.loads(rendering.stdout.strip().splitlines()[-1]))
+    except (IndexError, ValueError):
+        metrics["render_skipped"] = f"exit status {rendering.returncode}"
+    return metrics
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current, previous):
+    old = {(r["records"], r["storage"]): r["metrics"] for r in previous["results"]}
+    for result in current["results"]:
+        before = old.get((result["records"], result["storage"]))
+        if not before:
+            continue
+        print(f"\n{result['records']} records ({result['storage']}) vs {previous.get('revision')}:")
+        for key, value in result["metrics"].items():
+            if isinstance(value, (int, float)) and isinstance(before.get(key), (int, float)) and before[key]:
+                print(f"  {key:<40} {before[key]:10.2f} -> {value:10.2f}  ({value / before[key]:5.2f}x)")
+
+def main_suite(args):
+    report = {"revision": git_revision(), "python": platform.python_version(),
+              "platform": platform.platform(), "results": []}
+    for n in args.sizes:
+        metrics = run_worker(n, args.storage)
+        report["results"].append({"records": n, "storage": args.storage, "metrics": metrics})
+        print(f"{n:>8} records: " + ", ".join(
+            f"{k}={v:.1f}" for k, v in metrics.items() if isinstance(v, float) and "[" not in k))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=list(DEFAULT_SIZES))
+    parser.add_argument("--storage", choices=("journal", "snapshot", "sqlite"), default="journal")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--render-worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.storage)))
+    elif args.render_worker:
+        render_worker(args.render_worker)
+    else:
+        main_suite(args)
@@ -7,6 +7,8 @@ package.domain = org.yourname
 # Source directory and included file extensions
 source.dir = .
 source.include_exts = py,png,jpg,kv,ttf,db
+# Development-only code that must not ship in the APK
+source.exclude_dirs = benchmarks,tests
 
 # Application version
 version = 0.1
@@ -1,6 +1,15 @@
-import json
-import os
-from datetime import datetime
+import time
+APP_START = time.perf_counter()  # Taken before Kivy is imported, for time-to-first-frame
+
+import gc
+import threading
+import weakref
+from datetime import datetime, timedelta
+
+from storage import (APPOINTMENT_PERIODS, EXPORT_FILE, FUZZY_NAME_FIELD, PATIENT_FORM_SCHEMA, RECORDS_PAGE_SIZE,
+                     SEARCH_FIELDS, SUMMARY_FIELDS, IncrementalSearch, ListCursor, PatientExporter, PatientImporter,
+                     appointment_range, create_repository, parse_appointment_date, perf, vital_trends,
+                     vitals_report)
 
 import kivy
 from kivy.metrics import sp
@@ -13,7 +22,7 @@ Window.size = (360, 640)
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.anchorlayout import AnchorLayout
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.popup import Popup
 from kivy.uix.spinner import Spinner
 from kivy.uix.screenmanager import ScreenManager, Screen
@@ -21,39 +30,69 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.graphics import Color, Rectangle
+# ScrollView, RecycleView, RecycleBoxLayout and ProgressBar are imported where they are
+# first used: only the Home screen is built before the first frame.
+from kivy.properties import ObjectProperty
+from kivy.uix.widget import Widget
 from kivy.clock import Clock
-from kivy.core.text import Label as CoreLabel
+from kivy.logger import Logger
 
 # ---------- THEME COLORS ----------
 PRIMARY_COLOR = (0.2, 0.6, 0.8, 1)       # Blue for buttons/highlights
 BACKGROUND_COLOR = (0.95, 0.95, 0.95, 1)  # Light grey background
 TEXT_COLOR = (0.1, 0.1, 0.1, 1)           # Dark text
 
-# ---------- Responsive Label ----------
+# ---------- UI THREAD ----------
+SEARCH_DEBOUNCE = 0.3  # Typing pause (seconds) before the records list refreshes
+LOADING_REFRESH_INTERVAL = 0.5  # Seconds between records list refreshes while records load without summaries
+
+def call_soon(callback):
+    """Runs callback on the UI thread on the next frame; handed to storage for its callbacks."""
+    Clock.schedule_once(lambda dt: callback(), 0)
+
+# ---------- FONT SCALING ----------
 BASELINE_WIDTH = 900.0  # Baseline for scaling text
 
+class FontScaler:
+    """
+    Scales the text of every responsive widget with the window width. Widgets are held
+    by weak reference, so rows and popups that are thrown away are not kept alive; the
+    scale is computed once per resize and applied to all widgets in one pass per frame.
+    """
+    def __init__(self):
+        self.widgets = weakref.WeakSet()
+        self.scale = None
+        self._apply_trigger = Clock.create_trigger(self.apply)
+        Window.bind(size=self.on_window_resize)
+    def register(self, widget):
+        self.widgets.add(widget)
+        widget.font_size = self.font_size(widget.base_font_size)
+    def font_size(self, base_font_size):
+        if self.scale is None:
+            self.scale = sp(Window.width / BASELINE_WIDTH)
+        return base_font_size * self.scale
+    def on_window_resize(self, window, size):
+        self.scale = None
+        self._apply_trigger()
+    def apply(self, *args):
+        for widget in list(self.widgets):
+            widget.font_size = self.font_size(widget.base_font_size)
+
+font_scaler = FontScaler()
+
+# ---------- Responsive Label ----------
 class ResponsiveLabel(Label):
     def __init__(self, base_font_size=16, **kwargs):
         super().__init__(**kwargs)
         self.base_font_size = base_font_size
-        Clock.schedule_once(lambda dt: self.update_font(), 0)
-        Window.bind(size=self.on_window_resize)
-    def on_window_resize(self, window, size):
-        self.update_font()
-    def update_font(self, *args):
-        self.font_size = sp(self.base_font_size * Window.width / BASELINE_WIDTH)
+        font_scaler.register(self)
 
 # ---------- Responsive Spinner ----------
 class ResponsiveSpinner(Spinner):
     def __init__(self, base_font_size=16, **kwargs):
         super().__init__(**kwargs)
         self.base_font_size = base_font_size
-        Clock.schedule_once(lambda dt: self.update_font(), 0)
-        Window.bind(size=self.on_window_resize)
-    def on_window_resize(self, window, size):
-        self.update_font()
-    def update_font(self, *args):
-        self.font_size = sp(self.base_font_size * Window.width / BASELINE_WIDTH)
+        font_scaler.register(self)
 
 # ---------- STYLED BOX ----------
 class StyledBox(BoxLayout):
@@ -69,21 +108,24 @@ class StyledBox(BoxLayout):
 
 # ---------- AUTO-EXPANDING TEXTINPUT ----------
 class AutoExpandingTextInput(TextInput):
+    """
+    Grows with its content. The height comes from minimum_height, which TextInput keeps
+    from its own wrapped lines, so typing does not render the text a second time.
+    Updates are coalesced to at most one per frame.
+    """
     def __init__(self, min_height=100, **kwargs):
         kwargs.setdefault("size_hint_y", None)
         kwargs.setdefault("multiline", True)
         self.min_height = min_height
         super().__init__(**kwargs)
-        Clock.schedule_once(lambda dt: self.update_height(), 0)
-        self.bind(text=self.update_height, width=self.update_height)
+        self._update_height_trigger = Clock.create_trigger(self.update_height)
+        self._update_height_trigger()
+        self.bind(minimum_height=self._update_height_trigger, width=self._update_height_trigger)
     def update_height(self, *args):
-        core_label = CoreLabel(text=self.text or " ", font_size=self.font_size, width=self.width, multiline=True)
-        core_label.refresh()
-        if core_label.texture:
-            new_height = core_label.texture.size[1] + 20
-        else:
-            new_height = self.min_height
-        self.height = max(self.min_height, new_height)
+        with perf.timer("textinput.update_height"):
+            # Text height plus 20px, as when this was measured with a rendered CoreLabel
+            text_height = self.minimum_height - self.padding[1] - self.padding[3]
+            self.height = max(self.min_height, text_height + 20)
 
 # ---------- SINGLE FIELD ----------
 class SingleField(BoxLayout):
@@ -137,188 +179,232 @@ class FormCard(BoxLayout):
 
 # ---------- PATIENT MEDICAL FORM (Add Patient) ----------
 class PatientMedicalForm(BoxLayout):
-    def __init__(self, **kwargs):
+    """One SingleField per PATIENT_FORM_SCHEMA entry, available as self.fields[key]."""
+    def __init__(self, readonly=False, **kwargs):
         super().__init__(**kwargs)
         self.orientation = "vertical"
         self.spacing = 15
         self.size_hint_y = None
         self.bind(minimum_height=self.setter("height"))
-        # 1. Name
-        self.field_name = SingleField("Name:", multiline=False)
-        self.add_widget(self.field_name)
-        # 2. Mobile No (only numbers)
-        self.field_mobile = SingleField("Mobile No:", multiline=False, input_filter='int')
-        self.add_widget(self.field_mobile)
-        # 3. Date (auto-filled, read-only)
-        self.field_date = SingleField("Date:", multiline=False)
-        self.field_date.input_widget.text = datetime.now().strftime("%Y-%m-%d")
-        self.field_date.input_widget.readonly = True
-        self.add_widget(self.field_date)
-        # 4. Adress
-        self.field_adress = SingleField("Adress:", multiline=True, height_for_multiline=100)
-        self.add_widget(self.field_adress)
-        # 5. Gender (dropdown)
-        self.field_gender = SingleField("Gender:", spinner_values=["Male", "Female", "Other"])
-        self.add_widget(self.field_gender)
-        # 6. Weight
-        self.field_weight = SingleField("Weight:", multiline=False, input_filter='float')
-        self.add_widget(self.field_weight)
-        # 7. Systolic BP
-        self.field_systolic = SingleField("Systolic BP:", multiline=False, input_filter='int')
-        self.add_widget(self.field_systolic)
-        # 8. Diastolic BP
-        self.field_diastolic = SingleField("Diastolic BP:", multiline=False, input_filter='int')
-        self.add_widget(self.field_diastolic)
-        # 9. Pulse Rate
-        self.field_pulse = SingleField("Pulse Rate:", multiline=False, input_filter='int')
-        self.add_widget(self.field_pulse)
-        # 10. Surgery (dropdown, default "No")
-        self.field_surgery = SingleField("Surgery:", spinner_values=["No", "Yes"])
-        self.field_surgery.input_widget.text = "No"
-        self.add_widget(self.field_surgery)
-        # 11. Surgery Description (always visible)
-        self.field_surgery_desc = SingleField("Surgery Description:", multiline=True, height_for_multiline=100)
-        # Bind surgery spinner changes
-        self.field_surgery.input_widget.bind(text=self.on_surgery_change)
-        # Call once to set initial state (default "No" makes it read-only and clears text)
-        self.on_surgery_change(self.field_surgery.input_widget, self.field_surgery.input_widget.text)
-        self.add_widget(self.field_surgery_desc)
-        # 12. Medical History
-        self.field_medical_history = SingleField("Medical History:", multiline=True, height_for_multiline=200)
-        self.add_widget(self.field_medical_history)
-        # 13. Diseases
-        self.field_diseases = SingleField("Diseases:", multiline=True, height_for_multiline=100)
-        self.add_widget(self.field_diseases)
-        # 14. Medicines
-        self.field_medicines = SingleField("Medicines:", multiline=True, height_for_multiline=100)
-        self.add_widget(self.field_medicines)
-        # 15. Extra
-        self.field_extra = SingleField("Extra:", multiline=True, height_for_multiline=200)
-        self.add_widget(self.field_extra)
-        # 16. Other Illnesses
-        self.field_other_illnesses = SingleField("Other Illnesses:", multiline=False)
-        self.add_widget(self.field_other_illnesses)
-        # 17. Other Medicines
-        self.field_other_medicines = SingleField("Other Medicines:", multiline=True, height_for_multiline=100)
-        self.add_widget(self.field_other_medicines)
-        # 18. Next Appointment Date
-        self.field_next_appointment = SingleField("Next Appointment Date:", multiline=False)
-        self.add_widget(self.field_next_appointment)
+        self.readonly = readonly
+        self.fields = {}
+        for spec in PATIENT_FORM_SCHEMA:
+            field = SingleField(spec.label, multiline=spec.multiline, input_filter=spec.input_filter,
+                                spinner_values=spec.choices, height_for_multiline=spec.height,
+                                readonly=readonly or spec.readonly)
+            self.fields[spec.key] = field
+            self.add_widget(field)
+        if not readonly:
+            # Surgery Description is only editable when Surgery is "Yes"
+            self.fields["surgery"].input_widget.bind(text=self.on_surgery_change)
+        self.clear_fields()
 
     def on_surgery_change(self, instance, value):
+        surgery_desc = self.fields["surgery_description"]
         if value.strip().lower() == "yes":
-            self.field_surgery_desc.input_widget.readonly = False
+            surgery_desc.input_widget.readonly = False
         else:
-            self.field_surgery_desc.input_widget.text = ""
-            self.field_surgery_desc.input_widget.readonly = True
-        if self.field_surgery_desc.parent:
-            self.field_surgery_desc.parent.do_layout()
+            surgery_desc.input_widget.text = ""
+            surgery_desc.input_widget.readonly = True
+        if surgery_desc.parent:
+            surgery_desc.parent.do_layout()
 
     def clear_fields(self):
-        self.field_name.input_widget.text = ""
-        self.field_mobile.input_widget.text = ""
-        self.field_date.input_widget.text = datetime.now().strftime("%Y-%m-%d")
-        self.field_adress.input_widget.text = ""
-        self.field_gender.input_widget.text = "Male"
-        self.field_weight.input_widget.text = ""
-        self.field_systolic.input_widget.text = ""
-        self.field_diastolic.input_widget.text = ""
-        self.field_pulse.input_widget.text = ""
-        self.field_surgery.input_widget.text = "No"
-        self.field_surgery_desc.input_widget.text = ""
-        self.field_surgery_desc.input_widget.readonly = True
-        self.field_medical_history.input_widget.text = ""
-        self.field_diseases.input_widget.text = ""
-        self.field_medicines.input_widget.text = ""
-        self.field_extra.input_widget.text = ""
-        self.field_other_illnesses.input_widget.text = ""
-        self.field_other_medicines.input_widget.text = ""
-        self.field_next_appointment.input_widget.text = ""
+        for spec in PATIENT_FORM_SCHEMA:
+            default = spec.default() if callable(spec.default) else spec.default
+            self.fields[spec.key].input_widget.text = default
+        if not self.readonly:
+            self.fields["surgery_description"].input_widget.readonly = True
 
     def get_patient_data(self):
-        return {
-            "name": self.field_name.input_widget.text,
-            "mobile_no": self.field_mobile.input_widget.text,
-            "date": self.field_date.input_widget.text,
-            "adress": self.field_adress.input_widget.text,
-            "gender": self.field_gender.input_widget.text,
-            "weight": self.field_weight.input_widget.text,
-            "systolic_bp": self.field_systolic.input_widget.text,
-            "diastolic_bp": self.field_diastolic.input_widget.text,
-            "pulse_rate": self.field_pulse.input_widget.text,
-            "surgery": self.field_surgery.input_widget.text,
-            "surgery_description": self.field_surgery_desc.input_widget.text,
-            "medical_history": self.field_medical_history.input_widget.text,
-            "diseases": self.field_diseases.input_widget.text,
-            "medicines": self.field_medicines.input_widget.text,
-            "extra": self.field_extra.input_widget.text,
-            "other_illnesses": self.field_other_illnesses.input_widget.text,
-            "other_medicines": self.field_other_medicines.input_widget.text,
-            "next_appointment_date": self.field_next_appointment.input_widget.text
-        }
+        return {spec.key: self.fields[spec.key].input_widget.text for spec in PATIENT_FORM_SCHEMA}
+
+    def set_patient_data(self, patient_data):
+        for spec in PATIENT_FORM_SCHEMA:
+            self.fields[spec.key].input_widget.text = patient_data.get(spec.key, "") or ""
 
 # ---------- PATIENT MEDICAL FORM VIEW (Read-only) ----------
-class PatientMedicalFormView(BoxLayout):
-    def __init__(self, patient_data, **kwargs):
+class PatientMedicalFormView(PatientMedicalForm):
+    def __init__(self, patient_data=None, **kwargs):
+        super().__init__(readonly=True, **kwargs)
+        if patient_data is not None:
+            self.set_patient_data(patient_data)
+
+# ---------- PATIENT DETAIL POPUP ----------
+def visit_summary(visit):
+    """One visit timeline entry: the date, then the visit's non-empty fields."""
+    lines = [visit.get("date", "") or "Undated visit"]
+    for spec in PATIENT_FORM_SCHEMA:
+        if spec.per_visit and spec.key != "date" and visit.get(spec.key):
+            lines.append(f"{spec.label} {visit.get(spec.key)}")
+    return "\n".join(lines)
+
+def trend_summary(visits):
+    """One line per vital_trends() entry, e.g. "Weight: 70 -> 74 (+4, 3 readings)"."""
+    labels = {spec.key: spec.label for spec in PATIENT_FORM_SCHEMA}
+    return "\n".join(f"{labels[field]} {row['first']:g} -> {row['last']:g} ({row['change']:+g}, {row['readings']} readings)"
+                     for field, row in vital_trends(visits).items())
+
+class PatientDetailPopup(Popup):
+    """
+    The read-only patient view, built once and reused: showing another patient only
+    rebinds the field texts. The form shows the latest visit; the full visit timeline
+    is read from storage only when asked for.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault("size_hint", (0.9, 0.9))
         super().__init__(**kwargs)
-        self.orientation = "vertical"
-        self.spacing = 15
-        self.size_hint_y = None
-        self.bind(minimum_height=self.setter("height"))
-        self.field_name = SingleField("Name:", multiline=False, readonly=True)
-        self.field_name.input_widget.text = patient_data.get("name", "")
-        self.add_widget(self.field_name)
-        self.field_mobile = SingleField("Mobile No:", multiline=False, input_filter='int', readonly=True)
-        self.field_mobile.input_widget.text = patient_data.get("mobile_no", "")
-        self.add_widget(self.field_mobile)
-        self.field_date = SingleField("Date:", multiline=False, readonly=True)
-        self.field_date.input_widget.text = patient_data.get("date", "")
-        self.add_widget(self.field_date)
-        self.field_adress = SingleField("Adress:", multiline=True, height_for_multiline=100, readonly=True)
-        self.field_adress.input_widget.text = patient_data.get("adress", "")
-        self.add_widget(self.field_adress)
-        self.field_gender = SingleField("Gender:", spinner_values=["Male", "Female", "Other"], readonly=True)
-        self.field_gender.input_widget.text = patient_data.get("gender", "")
-        self.add_widget(self.field_gender)
-        self.field_weight = SingleField("Weight:", multiline=False, input_filter='float', readonly=True)
-        self.field_weight.input_widget.text = patient_data.get("weight", "")
-        self.add_widget(self.field_weight)
-        self.field_systolic = SingleField("Systolic BP:", multiline=False, input_filter='int', readonly=True)
-        self.field_systolic.input_widget.text = patient_data.get("systolic_bp", "")
-        self.add_widget(self.field_systolic)
-        self.field_diastolic = SingleField("Diastolic BP:", multiline=False, input_filter='int', readonly=True)
-        self.field_diastolic.input_widget.text = patient_data.get("diastolic_bp", "")
-        self.add_widget(self.field_diastolic)
-        self.field_pulse = SingleField("Pulse Rate:", multiline=False, input_filter='int', readonly=True)
-        self.field_pulse.input_widget.text = patient_data.get("pulse_rate", "")
-        self.add_widget(self.field_pulse)
-        self.field_surgery = SingleField("Surgery:", spinner_values=["No", "Yes"], readonly=True)
-        self.field_surgery.input_widget.text = patient_data.get("surgery", "")
-        self.add_widget(self.field_surgery)
-        self.field_surgery_desc = SingleField("Surgery Description:", multiline=True, height_for_multiline=100, readonly=True)
-        self.field_surgery_desc.input_widget.text = patient_data.get("surgery_description", "")
-        self.add_widget(self.field_surgery_desc)
-        self.field_medical_history = SingleField("Medical History:", multiline=True, height_for_multiline=200, readonly=True)
-        self.field_medical_history.input_widget.text = patient_data.get("medical_history", "")
-        self.add_widget(self.field_medical_history)
-        self.field_diseases = SingleField("Diseases:", multiline=True, height_for_multiline=100, readonly=True)
-        self.field_diseases.input_widget.text = patient_data.get("diseases", "")
-        self.add_widget(self.field_diseases)
-        self.field_medicines = SingleField("Medicines:", multiline=True, height_for_multiline=100, readonly=True)
-        self.field_medicines.input_widget.text = patient_data.get("medicines", "")
-        self.add_widget(self.field_medicines)
-        self.field_extra = SingleField("Extra:", multiline=True, height_for_multiline=200, readonly=True)
-        self.field_extra.input_widget.text = patient_data.get("extra", "")
-        self.add_widget(self.field_extra)
-        self.field_other_illnesses = SingleField("Other Illnesses:", multiline=False, readonly=True)
-        self.field_other_illnesses.input_widget.text = patient_data.get("other_illnesses", "")
-        self.add_widget(self.field_other_illnesses)
-        self.field_other_medicines = SingleField("Other Medicines:", multiline=True, height_for_multiline=100, readonly=True)
-        self.field_other_medicines.input_widget.text = patient_data.get("other_medicines", "")
-        self.add_widget(self.field_other_medicines)
-        self.field_next_appointment = SingleField("Next Appointment Date:", multiline=False, readonly=True)
-        self.field_next_appointment.input_widget.text = patient_data.get("next_appointment_date", "")
-        self.add_widget(self.field_next_appointment)
+        self.patient_data = None
+        content = BoxLayout(orientation="vertical", spacing=10, padding=10)
+        form_card = FormCard()
+        self.view_form = PatientMedicalFormView()
+        form_card.add_widget(self.view_form)
+        self.timeline = BoxLayout(orientation="vertical", spacing=10, size_hint_y=None)
+        self.timeline.bind(minimum_height=self.timeline.setter("height"))
+        form_card.add_widget(self.timeline)
+        from kivy.uix.scrollview import ScrollView
+        self.scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False, do_scroll_y=True)
+        self.scroll.add_widget(form_card)
+        content.add_widget(self.scroll)
+        buttons_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5)
+        self.history_btn = Button(text="Visit history", background_normal="", background_color=PRIMARY_COLOR,
+                                  color=(1,1,1,1), font_size=sp(16))
+        self.history_btn.bind(on_press=self.show_visits)
+        close_btn = Button(text="Close", background_normal="", background_color=PRIMARY_COLOR,
+                           color=(1,1,1,1), font_size=sp(16))
+        close_btn.bind(on_press=self.dismiss)
+        buttons_layout.add_widget(self.history_btn)
+        buttons_layout.add_widget(close_btn)
+        content.add_widget(buttons_layout)
+        self.content = content
+    def show(self, patient_data):
+        self.patient_data = patient_data
+        self.title = f"Patient: {patient_data.get('name', '')}"
+        self.view_form.set_patient_data(patient_data)
+        self.timeline.clear_widgets()
+        visit_count = getattr(patient_data, "visit_count", 1)
+        self.history_btn.text = f"Visit history ({visit_count})"
+        self.history_btn.disabled = visit_count < 2
+        self.scroll.scroll_y = 1
+        self.open()
+    def show_visits(self, instance):
+        self.timeline.clear_widgets()
+        visits = App.get_running_app().repository.visits(self.patient_data.get("id"))
+        entries = [visit_summary(visit) for visit in visits]
+        trends = trend_summary(visits)
+        if trends:
+            entries.insert(0, trends)
+        self.timeline.add_widget(ResponsiveLabel(text="Visits", base_font_size=18, color=PRIMARY_COLOR,
+                                                 size_hint_y=None, height=30, bold=True))
+        for text in entries:
+            entry = Label(text=text, color=TEXT_COLOR, font_size=sp(14),
+                          halign="left", valign="top", size_hint_y=None)
+            entry.bind(width=lambda inst, w: setattr(inst, "text_size", (w, None)),
+                       texture_size=lambda inst, size: setattr(inst, "height", size[1]))
+            self.timeline.add_widget(entry)
+        self.history_btn.disabled = True
+
+# ---------- IMPORT / EXPORT POPUP ----------
+class ImportExportPopup(Popup):
+    """File path, progress and status for one bulk import or export at a time."""
+    def __init__(self, **kwargs):
+        kwargs.setdefault("size_hint", (0.9, 0.5))
+        super().__init__(title="Import / Export", auto_dismiss=False, **kwargs)
+        self.task = None
+        content = BoxLayout(orientation="vertical", spacing=10, padding=10)
+        content.add_widget(ResponsiveLabel(text="File (.csv or .jsonl):", base_font_size=16,
+                                           size_hint_y=None, height=30))
+        self.path_input = TextInput(text=EXPORT_FILE, multiline=False, font_size=sp(16),
+                                    size_hint_y=None, height=40)
+        content.add_widget(self.path_input)
+        from kivy.uix.progressbar import ProgressBar
+        self.progress = ProgressBar(max=1, value=0, size_hint_y=None, height=20)
+        content.add_widget(self.progress)
+        self.status_label = ResponsiveLabel(text="", base_font_size=14)
+        self.status_label.bind(width=lambda inst, w: setattr(inst, "text_size", (w, None)))
+        content.add_widget(self.status_label)
+        buttons_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5)
+        self.import_btn = Button(text="Import", background_normal="", background_color=PRIMARY_COLOR,
+                                 color=(1,1,1,1), font_size=sp(16))
+        self.import_btn.bind(on_press=self.start_import)
+        self.export_btn = Button(text="Export", background_normal="", background_color=PRIMARY_COLOR,
+                                 color=(1,1,1,1), font_size=sp(16))
+        self.export_btn.bind(on_press=self.start_export)
+        self.close_btn = Button(text="Close", background_normal="", background_color=(1,0,0,1),
+                                color=(1,1,1,1), font_size=sp(16))
+        self.close_btn.bind(on_press=self.close)
+        for btn in (self.import_btn, self.export_btn, self.close_btn):
+            buttons_layout.add_widget(btn)
+        content.add_widget(buttons_layout)
+        self.content = content
+    def set_busy(self, busy):
+        self.import_btn.disabled = busy
+        self.export_btn.disabled = busy
+        self.close_btn.text = "Cancel" if busy else "Close"
+        self.progress.value = 0
+    def start_import(self, instance):
+        app = App.get_running_app()
+        if not app.check_storage_writable():
+            return
+        try:
+            self.task = PatientImporter(app.repository, self.path_input.text.strip(),
+                                        self.on_import_progress, self.on_import_done, call_soon=call_soon)
+        except ValueError as e:
+            self.status_label.text = str(e)
+            return
+        self.set_busy(True)
+        self.status_label.text = "Importing..."
+        self.task.start()
+    def on_import_progress(self, fraction, imported, skipped):
+        self.progress.value = fraction
+        self.status_label.text = f"Imported {imported}, skipped {skipped}..."
+    def on_import_done(self, imported, skipped, error):
+        rejected = "".join(f"\nLine {number}: {reason}" for number, reason in self.task.rejected)
+        self.task = None
+        self.set_busy(False)
+        self.progress.value = 0 if error else 1
+        status = f"Import failed after {imported} records: {error}" if error else f"Imported {imported} records"
+        self.status_label.text = f"{status}, skipped {skipped}.{rejected}"
+        App.get_running_app().update_patient_list()
+    def start_export(self, instance):
+        app = App.get_running_app()
+        try:
+            self.task = PatientExporter(app.repository, self.path_input.text.strip(),
+                                        self.on_export_progress, self.on_export_done, call_soon=call_soon)
+        except ValueError as e:
+            self.status_label.text = str(e)
+            return
+        self.set_busy(True)
+        self.status_label.text = "Exporting..."
+        self.task.start()
+    def on_export_progress(self, fraction, written):
+        self.progress.value = fraction
+        self.status_label.text = f"Exported {written} records..."
+    def on_export_done(self, written, error):
+        self.task = None
+        self.set_busy(False)
+        self.progress.value = 0 if error else 1
+        self.status_label.text = (f"Export failed: {error}" if error
+                                  else f"Exported {written} records to {self.path_input.text.strip()}.")
+    def close(self, instance):
+        if self.task is not None:
+            self.task.cancel()
+            return
+        self.dismiss()
+
+# ---------- SCREEN MANAGER ----------
+class LazyScreenManager(ScreenManager):
+    """
+    Builds a screen the first time it is shown. factories maps a screen name to a
+    callable returning the new screen; it is dropped once the screen exists.
+    """
+    def __init__(self, factories=None, **kwargs):
+        self.factories = dict(factories or {})
+        super().__init__(**kwargs)
+    def on_current(self, instance, value):
+        if value not in self.screen_names and value in self.factories:
+            self.add_widget(self.factories.pop(value)())
+        super().on_current(instance, value)
 
 # ---------- HOME SCREEN ----------
 class HomeScreen(Screen):
@@ -332,11 +418,14 @@ class HomeScreen(Screen):
         title_anchor = AnchorLayout(anchor_x="center", anchor_y="top", size_hint_y=None, height=80)
         title = ResponsiveLabel(text="Clinic Manager", base_font_size=28, color=PRIMARY_COLOR)
         title.bold = True
+        # Hidden entry to the diagnostics screen: tap the title five times within three seconds
+        self.title_taps = []
+        title.bind(on_touch_down=self.on_title_touch)
         title_anchor.add_widget(title)
         root_layout.add_widget(title_anchor)
         button_anchor = AnchorLayout(anchor_x="center", anchor_y="center")
         btn_layout = BoxLayout(orientation="vertical", spacing=10, size_hint=(None, None))
-        btn_layout.size = (200, 120)
+        btn_layout.size = (200, 220)
         btn1 = Button(text="Add Patient", size_hint=(1, None), height=40,
                       background_normal="", background_color=PRIMARY_COLOR,
                       color=(1,1,1,1), font_size=sp(18))
@@ -345,8 +434,18 @@ class HomeScreen(Screen):
                       background_normal="", background_color=PRIMARY_COLOR,
                       color=(1,1,1,1), font_size=sp(18))
         btn2.bind(on_press=self.go_to_records)
+        btn3 = Button(text="Appointments", size_hint=(1, None), height=40,
+                      background_normal="", background_color=PRIMARY_COLOR,
+                      color=(1,1,1,1), font_size=sp(18))
+        btn3.bind(on_press=self.go_to_appointments)
+        btn4 = Button(text="Reports", size_hint=(1, None), height=40,
+                      background_normal="", background_color=PRIMARY_COLOR,
+                      color=(1,1,1,1), font_size=sp(18))
+        btn4.bind(on_press=self.go_to_reports)
         btn_layout.add_widget(btn1)
         btn_layout.add_widget(btn2)
+        btn_layout.add_widget(btn3)
+        btn_layout.add_widget(btn4)
         button_anchor.add_widget(btn_layout)
         root_layout.add_widget(button_anchor)
         self.add_widget(root_layout)
@@ -357,6 +456,19 @@ class HomeScreen(Screen):
         self.manager.current = "main"
     def go_to_records(self, instance):
         self.manager.current = "records"
+    def go_to_appointments(self, instance):
+        self.manager.current = "appointments"
+    def go_to_reports(self, instance):
+        self.manager.current = "reports"
+    def on_title_touch(self, instance, touch):
+        if not instance.collide_point(*touch.pos):
+            return False
+        now = time.perf_counter()
+        self.title_taps = [t for t in self.title_taps if now - t < 3] + [now]
+        if len(self.title_taps) >= 5:
+            self.title_taps = []
+            self.manager.current = "diagnostics"
+        return False
 
 # ---------- MAIN SCREEN (Add Patient) ----------
 class MainScreen(Screen):
@@ -376,6 +488,7 @@ class MainScreen(Screen):
         form_card = FormCard()
         self.form = PatientMedicalForm()
         form_card.add_widget(self.form)
+        from kivy.uix.scrollview import ScrollView
         scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False, do_scroll_y=True)
         scroll.add_widget(form_card)
         layout.add_widget(scroll)
@@ -400,12 +513,27 @@ class MainScreen(Screen):
         if not data["name"]:
             app.show_error("Patient name is required")
             return
-        data["id"] = str(len(app.patients) + 1)
-        app.patients.append(data)
-        app.save_patients_to_file()
+        appointment = parse_appointment_date(data["next_appointment_date"])
+        if appointment is None:
+            app.show_error("Next appointment date must be YYYY-MM-DD or DD/MM/YYYY")
+            return
+        data["next_appointment_date"] = appointment
+        if not app.check_storage_writable():
+            return
+        # Archived patients are looked for on another thread, then called back here
+        app.repository.match_patient(data, lambda existing: self.save_matched(existing, data))
+    def save_matched(self, existing, data):
+        app = App.get_running_app()
+        if existing is not None:
+            app.confirm_returning_patient(existing, data, self.on_saved)
+            return
+        app.repository.insert(data)
+        self.on_saved("Patient information saved successfully!")
+    def on_saved(self, message):
+        app = App.get_running_app()
         app.update_patient_list()
         self.form.clear_fields()
-        app.show_message("Patient information saved successfully!")
+        app.show_message(message)
     def go_to_records(self, instance):
         self.manager.current = "records"
     def exit_to_home(self, instance):
@@ -423,14 +551,31 @@ class RecordsScreen(Screen):
         self.search_input = TextInput(multiline=False, font_size=sp(16))
         self.search_input.bind(text=self.on_search)
         search_layout.add_widget(self.search_input)
-        self.search_type = ResponsiveSpinner(text="Name", values=("Name", "Date", "Disease", "Mob No."), size_hint_x=0.3, base_font_size=16)
+        self.search_type = ResponsiveSpinner(text="Name", values=("Name", "Fuzzy Name", "Date", "Disease", "Mob No."), size_hint_x=0.3, base_font_size=16)
+        self.search_type.bind(text=self.on_search)
+        self._search_trigger = Clock.create_trigger(self.run_search, SEARCH_DEBOUNCE)
         search_layout.add_widget(self.search_type)
         layout.add_widget(search_layout)
-        self.records_container = BoxLayout(orientation="vertical", spacing=5, size_hint_y=None)
-        self.records_container.bind(minimum_height=self.records_container.setter("height"))
-        scroll_view = ScrollView(size_hint=(1, 1))
-        scroll_view.add_widget(self.records_container)
-        layout.add_widget(scroll_view)
+        self.empty_label = ResponsiveLabel(text="No patients found.", base_font_size=16,
+                                           size_hint_y=None, height=0, opacity=0)
+        layout.add_widget(self.empty_label)
+        self.total = 0
+        self.more = False
+        self.loading = False
+        self.resetting_scroll = False
+        self.count_label = ResponsiveLabel(text="", base_font_size=14, size_hint_y=None, height=24, color=TEXT_COLOR)
+        layout.add_widget(self.count_label)
+        # Only the visible rows exist as widgets; they are rebound as the list scrolls
+        from kivy.uix.recycleview import RecycleView
+        from kivy.uix.recycleboxlayout import RecycleBoxLayout
+        self.records_view = RecycleView(size_hint=(1, 1), do_scroll_x=False)
+        self.records_view.viewclass = PatientRecord
+        self.records_layout = RecycleBoxLayout(orientation="vertical", spacing=5, size_hint_y=None,
+                                               default_size=(None, 40), default_size_hint=(1, None))
+        self.records_layout.bind(minimum_height=self.records_layout.setter("height"))
+        self.records_view.add_widget(self.records_layout)
+        self.records_view.bind(scroll_y=self.on_records_scroll)
+        layout.add_widget(self.records_view)
         bottom_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5, padding=5)
         back_btn = Button(text="Back", background_normal="", background_color=(1,0,0,1),
                           color=(1,1,1,1), font_size=sp(16))
@@ -438,29 +583,230 @@ class RecordsScreen(Screen):
         add_patient_btn = Button(text="Add Patient", background_normal="", background_color=PRIMARY_COLOR,
                                  color=(1,1,1,1), font_size=sp(16))
         add_patient_btn.bind(on_press=self.go_to_add_patient)
+        transfer_btn = Button(text="Import/Export", background_normal="", background_color=PRIMARY_COLOR,
+                              color=(1,1,1,1), font_size=sp(16))
+        transfer_btn.bind(on_press=self.open_import_export)
         bottom_layout.add_widget(back_btn)
         bottom_layout.add_widget(add_patient_btn)
+        bottom_layout.add_widget(transfer_btn)
         layout.add_widget(bottom_layout)
+        self.import_export_popup = None
         self.add_widget(layout)
     def on_pre_enter(self):
         App.get_running_app().update_patient_list()
+    def show_records(self, records, total=None, has_patients=True, more=False, loading=False):
+        """
+        Replaces the list with records, the first page of total results. more means
+        archive segments not scanned yet may add to total.
+        """
+        self.empty_label.height = 0 if has_patients else 40
+        self.empty_label.opacity = 0 if has_patients else 1
+        self.total = len(records) if total is None else total
+        self.more = more
+        self.loading = loading
+        self.records_view.data = [{"patient_data": p} for p in records]
+        # The layout still has the old list's height, so this scroll must not fetch a page
+        self.resetting_scroll = True
+        self.records_view.scroll_y = 1
+        self.resetting_scroll = False
+        self.update_count()
+    def append_records(self, records, total=None, more=False):
+        if total is not None:
+            self.total = total
+        self.more = more
+        self.records_view.data.extend([{"patient_data": p} for p in records])
+        self.update_count()
+    def update_count(self):
+        shown = len(self.records_view.data)
+        if self.loading:
+            self.count_label.text = f"Loading records... {self.total} found so far" if self.total else "Loading records..."
+            return
+        total = f"{self.total}+" if self.more else str(self.total)
+        self.count_label.text = (f"{total} patients" if shown >= self.total and not self.more
+                                 else f"Showing {shown} of {total} patients")
+    def on_records_scroll(self, instance, scroll_y):
+        if self.resetting_scroll:
+            return
+        # Fetch the next page once less than one screen of rows is left below the view
+        below = scroll_y * max(0, self.records_layout.height - instance.height)
+        if below < instance.height and (len(instance.data) < self.total or self.more):
+            App.get_running_app().load_more_records()
     def on_search(self, instance, value):
+        # Restart the countdown on every keystroke so only the pause refreshes the list
+        self._search_trigger.cancel()
+        self._search_trigger()
+    def run_search(self, dt):
         App.get_running_app().update_patient_list()
     def go_to_add_patient(self, instance):
         self.manager.current = "main"
+    def open_import_export(self, instance):
+        if self.import_export_popup is None:
+            self.import_export_popup = ImportExportPopup()
+        self.import_export_popup.open()
+    def go_back(self, instance):
+        self.manager.current = "home"
+
+# ---------- APPOINTMENTS SCREEN ----------
+class AppointmentsScreen(Screen):
+    """Patients due for their next appointment in the chosen period, soonest first."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = StyledBox(orientation="vertical", padding=10, spacing=10)
+        title = ResponsiveLabel(text="Appointments", base_font_size=20, size_hint_y=None, height=40, color=PRIMARY_COLOR)
+        layout.add_widget(title)
+        period_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5, padding=5)
+        period_layout.add_widget(Label(text="Due:", size_hint_x=0.3, color=TEXT_COLOR, font_size=sp(16)))
+        self.period = ResponsiveSpinner(text="Today", values=APPOINTMENT_PERIODS, base_font_size=16)
+        self.period.bind(text=lambda instance, value: App.get_running_app().update_appointments())
+        period_layout.add_widget(self.period)
+        layout.add_widget(period_layout)
+        self.count_label = ResponsiveLabel(text="", base_font_size=14, size_hint_y=None, height=24, color=TEXT_COLOR)
+        layout.add_widget(self.count_label)
+        from kivy.uix.recycleview import RecycleView
+        from kivy.uix.recycleboxlayout import RecycleBoxLayout
+        self.appointments_view = RecycleView(size_hint=(1, 1), do_scroll_x=False)
+        self.appointments_view.viewclass = AppointmentRecord
+        appointments_layout = RecycleBoxLayout(orientation="vertical", spacing=5, size_hint_y=None,
+                                               default_size=(None, 40), default_size_hint=(1, None))
+        appointments_layout.bind(minimum_height=appointments_layout.setter("height"))
+        self.appointments_view.add_widget(appointments_layout)
+        layout.add_widget(self.appointments_view)
+        back_btn = Button(text="Back", size_hint_y=None, height=40, background_normal="",
+                          background_color=(1,0,0,1), color=(1,1,1,1), font_size=sp(16))
+        back_btn.bind(on_press=self.go_back)
+        layout.add_widget(back_btn)
+        self.add_widget(layout)
+    def on_pre_enter(self):
+        App.get_running_app().update_appointments()
+    def show_appointments(self, patients, loading=False):
+        self.appointments_view.data = [{"patient_data": p} for p in patients]
+        if loading:
+            self.count_label.text = "Loading records..."
+        else:
+            self.count_label.text = f"{len(patients)} due" if patients else "No appointments due."
+    def go_back(self, instance):
+        self.manager.current = "home"
+
+# ---------- REPORTS SCREEN ----------
+REPORT_PERIODS = {"Last 30 Days": 30, "Last 12 Months": 365, "All Time": None}
+
+class ReportsScreen(Screen):
+    """Blood pressure categories and vitals distributions over the visits of a period."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = StyledBox(orientation="vertical", padding=10, spacing=10)
+        title = ResponsiveLabel(text="Reports", base_font_size=20, size_hint_y=None, height=40, color=PRIMARY_COLOR)
+        layout.add_widget(title)
+        period_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5, padding=5)
+        period_layout.add_widget(Label(text="Visits:", size_hint_x=0.3, color=TEXT_COLOR, font_size=sp(16)))
+        self.period = ResponsiveSpinner(text="Last 30 Days", values=tuple(REPORT_PERIODS), base_font_size=16)
+        self.period.bind(text=lambda instance, value: self.refresh())
+        period_layout.add_widget(self.period)
+        layout.add_widget(period_layout)
+        self.report_label = Label(text="", color=TEXT_COLOR, font_size=sp(12), font_name="RobotoMono-Regular",
+                                  halign="left", valign="top", size_hint_y=None)
+        self.report_label.bind(width=lambda inst, w: setattr(inst, "text_size", (w, None)),
+                               texture_size=lambda inst, size: setattr(inst, "height", size[1]))
+        from kivy.uix.scrollview import ScrollView
+        scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False, do_scroll_y=True)
+        scroll.add_widget(self.report_label)
+        layout.add_widget(scroll)
+        back_btn = Button(text="Back", size_hint_y=None, height=40, background_normal="",
+                          background_color=(1,0,0,1), color=(1,1,1,1), font_size=sp(16))
+        back_btn.bind(on_press=self.go_back)
+        layout.add_widget(back_btn)
+        self.add_widget(layout)
+    def on_pre_enter(self):
+        self.refresh()
+    def refresh(self):
+        app = App.get_running_app()
+        if app.loading:
+            self.report_label.text = "Loading records..."
+            if self.refresh not in app.after_load:
+                app.after_load.append(self.refresh)
+            return
+        days = REPORT_PERIODS[self.period.text]
+        start = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+        with perf.timer("reports.build"):
+            self.report_label.text = vitals_report(app.repository.vitals(), start)
+    def go_back(self, instance):
+        self.manager.current = "home"
+
+# ---------- DIAGNOSTICS SCREEN ----------
+WIDGET_COUNT_INTERVAL = 30  # Seconds between counts of live widgets, which walk every Python object
+
+class DiagnosticsScreen(Screen):
+    """Hidden screen (five taps on the Home title) showing the performance timers."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.refresh_event = None
+        layout = StyledBox(orientation="vertical", padding=10, spacing=10)
+        title = ResponsiveLabel(text="Diagnostics", base_font_size=20, size_hint_y=None, height=40, color=PRIMARY_COLOR)
+        layout.add_widget(title)
+        self.stats_label = Label(text="", color=TEXT_COLOR, font_size=sp(12), font_name="RobotoMono-Regular",
+                                 halign="left", valign="top", size_hint_y=None)
+        self.stats_label.bind(width=lambda inst, w: setattr(inst, "text_size", (w, None)),
+                              texture_size=lambda inst, size: setattr(inst, "height", size[1]))
+        from kivy.uix.scrollview import ScrollView
+        scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False, do_scroll_y=True)
+        scroll.add_widget(self.stats_label)
+        layout.add_widget(scroll)
+        buttons_layout = BoxLayout(orientation="horizontal", size_hint_y=None, height=40, spacing=5)
+        self.toggle_btn = Button(background_normal="", background_color=PRIMARY_COLOR,
+                                 color=(1,1,1,1), font_size=sp(16))
+        self.toggle_btn.bind(on_press=self.toggle_timing)
+        reset_btn = Button(text="Reset", background_normal="", background_color=PRIMARY_COLOR,
+                           color=(1,1,1,1), font_size=sp(16))
+        reset_btn.bind(on_press=self.reset_timing)
+        export_btn = Button(text="Export", background_normal="", background_color=PRIMARY_COLOR,
+                            color=(1,1,1,1), font_size=sp(16))
+        export_btn.bind(on_press=self.export_timing)
+        back_btn = Button(text="Back", background_normal="", background_color=(1,0,0,1),
+                          color=(1,1,1,1), font_size=sp(16))
+        back_btn.bind(on_press=self.go_back)
+        for btn in (self.toggle_btn, reset_btn, export_btn, back_btn):
+            buttons_layout.add_widget(btn)
+        layout.add_widget(buttons_layout)
+        self.add_widget(layout)
+    def on_enter(self):
+        self.refresh(recount=True)
+        self.refresh_event = Clock.schedule_interval(self.refresh, 1)
+    def on_leave(self):
+        if self.refresh_event is not None:
+            self.refresh_event.cancel()
+            self.refresh_event = None
+    def refresh(self, *args, recount=False):
+        self.toggle_btn.text = "Disable timing" if perf.enabled else "Enable timing"
+        self.stats_label.text = App.get_running_app().diagnostics_report(recount)
+    def toggle_timing(self, instance):
+        perf.enabled = not perf.enabled
+        self.refresh()
+    def reset_timing(self, instance):
+        perf.reset()
+        self.refresh()
+    def export_timing(self, instance):
+        app = App.get_running_app()
+        try:
+            path = perf.export(app.diagnostics_report(recount=True))
+        except OSError as exc:
+            app.show_error(f"Could not export timings: {exc}")
+            return
+        app.show_message(f"Timings appended to {path}")
     def go_back(self, instance):
         self.manager.current = "home"
 
 # ---------- PATIENT RECORD ----------
-class PatientRecord(BoxLayout):
-    def __init__(self, patient_data, delete_callback, **kwargs):
+class PatientRecord(RecycleDataViewBehavior, BoxLayout):
+    """Recycled row of the records list; refresh_view_attrs rebinds it to another patient."""
+    patient_data = ObjectProperty(None, allownone=True)
+
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = "horizontal"
         self.size_hint_y = None
         self.height = 40
-        self.patient_data = patient_data
-        info = f"{patient_data.get('name', 'No Name')} - {patient_data.get('date', '')}"
-        self.add_widget(ResponsiveLabel(text=info, base_font_size=16, size_hint_x=0.7, color=(0,0,0,1)))
+        self.info_label = ResponsiveLabel(text="", base_font_size=16, size_hint_x=0.7, color=(0,0,0,1))
+        self.add_widget(self.info_label)
         view_btn = Button(text="View", size_hint_x=0.15,
                           background_normal="", background_color=PRIMARY_COLOR,
                           color=(1,1,1,1), font_size=sp(16))
@@ -469,64 +815,124 @@ class PatientRecord(BoxLayout):
         del_btn = Button(text="Delete", size_hint_x=0.15,
                          background_normal="", background_color=(0.8,0.2,0.2,1),
                          color=(1,1,1,1), font_size=sp(16))
-        del_btn.bind(on_press=lambda x: delete_callback(patient_data))
+        del_btn.bind(on_press=self.delete_record)
         self.add_widget(del_btn)
+    def refresh_view_attrs(self, rv, index, data):
+        self.info_label.text = self.row_text(data["patient_data"])
+        return super().refresh_view_attrs(rv, index, data)
+    def row_text(self, patient_data):
+        text = f"{patient_data.get('name', 'No Name')} - {patient_data.get('date', '')}"
+        visit_count = getattr(patient_data, "visit_count", 1)
+        return f"{text} ({visit_count} visits)" if visit_count > 1 else text
+    def delete_record(self, instance):
+        App.get_running_app().confirm_delete_patient(self.patient_data)
     def view_details(self, instance):
-        content = BoxLayout(orientation="vertical", spacing=10, padding=10)
-        form_card = FormCard()
-        view_form = PatientMedicalFormView(self.patient_data)
-        form_card.add_widget(view_form)
-        scroll = ScrollView(size_hint=(1, 1), do_scroll_x=False, do_scroll_y=True)
-        scroll.add_widget(form_card)
-        content.add_widget(scroll)
-        close_btn = Button(text="Close", size_hint_y=None, height=40,
-                           background_normal="", background_color=PRIMARY_COLOR,
-                           color=(1,1,1,1), font_size=sp(16))
-        content.add_widget(close_btn)
-        popup = Popup(title=f"Patient: {self.patient_data.get('name', '')}",
-                      content=content, size_hint=(0.9, 0.9))
-        close_btn.bind(on_press=popup.dismiss)
-        popup.open()
+        App.get_running_app().fetch_patient(self.patient_data, self.show_details)
+    def show_details(self, patient_data):
+        App.get_running_app().show_patient_details(patient_data)
+
+class AppointmentRecord(PatientRecord):
+    """Row of the appointments list: appointment date, name and mobile number."""
+    def row_text(self, patient_data):
+        return (f"{patient_data.get('next_appointment_date', '')} - {patient_data.get('name', 'No Name')}"
+                f" ({patient_data.get('mobile_no', '')})")
 
 # ---------- MAIN APP ----------
 class PatientManagementApp(App):
     def build(self):
-        self.patients = []
-        self.load_patients()
-        sm = ScreenManager()
+        self.repository = create_repository(on_persisted=self.on_persisted, call_soon=call_soon)
+        self.patient_search = IncrementalSearch(self.repository)
+        self.first_frame_ms = None
+        self.loaded_ms = None
+        self.storage_error = None
+        self.summaries = None
+        self.after_load = []
+        self.alive_widgets = None
+        self.alive_counted = 0
+        self.detail_popup = None
+        self.records_cursor = None
+        self.records_version = None
+        # Only Home is built before the first frame; the rest on first navigation
+        self.main_screen = None
+        self.records_screen = None
+        self.appointments_screen = None
+        sm = LazyScreenManager({"main": self.create_main_screen,
+                                "records": self.create_records_screen,
+                                "appointments": self.create_appointments_screen,
+                                "reports": lambda: ReportsScreen(name="reports"),
+                                "diagnostics": lambda: DiagnosticsScreen(name="diagnostics")})
         self.home_screen = HomeScreen(name="home")
-        self.main_screen = MainScreen(name="main")
-        self.records_screen = RecordsScreen(name="records")
         sm.add_widget(self.home_screen)
-        sm.add_widget(self.main_screen)
-        sm.add_widget(self.records_screen)
         sm.current = "home"
+        # Records load after the Home screen's first frame has been drawn
+        self.loading = True
+        Clock.schedule_once(self.on_first_frame, 0)
         return sm
+    def create_main_screen(self):
+        self.main_screen = MainScreen(name="main")
+        return self.main_screen
+    def create_records_screen(self):
+        self.records_screen = RecordsScreen(name="records")
+        return self.records_screen
+    def create_appointments_screen(self):
+        self.appointments_screen = AppointmentsScreen(name="appointments")
+        return self.appointments_screen
+    def on_first_frame(self, dt):
+        self.first_frame_ms = (time.perf_counter() - APP_START) * 1000
+        perf.record("startup.first_frame", self.first_frame_ms)
+        Logger.debug(f"Startup: first frame after {self.first_frame_ms:.0f} ms")
+        self.load_patients()
     def update_patient_list(self):
-        container = self.records_screen.records_container
-        container.clear_widgets()
-        if not self.patients:
-            container.add_widget(ResponsiveLabel(
-                text="No patients found.", base_font_size=16,
-                size_hint_y=None, height=40
-            ))
+        """Reopens the records cursor for the current search and shows its first page."""
+        screen = self.records_screen
+        if screen is None:
+            return  # Not built yet; it fills itself in on_pre_enter
+        search_text = screen.search_input.text
+        field = screen.search_type.text.lower()
+        self.records_version = None
+        if self.loading:
+            # The repository is not ready to query; refreshed again once loading finishes
+            self.loading_query = (field, search_text.lower())
+            self.loading_listed = len(self.loaded_records)
+            self.records_cursor = ListCursor(self.search_loading(*self.loading_query))
+            screen.show_records(self.records_cursor.fetch(), self.records_cursor.total, loading=True)
+            return
+        if not self.repository.count():
+            self.records_cursor = None
+            screen.show_records([], has_patients=False)
+            return
+        else:
+            with perf.timer("records.search"):
+                cursor = self.patient_search.cursor(field, search_text)
+            self.records_version = self.repository.version
+        self.records_cursor = cursor
+        cursor.on_ready = self.on_cursor_ready
+        with perf.timer("records.build"):
+            screen.show_records(cursor.fetch(), cursor.total, more=bool(cursor.pending))
+    def update_appointments(self):
+        screen = self.appointments_screen
+        if screen is None:
             return
-        search_text = self.records_screen.search_input.text.lower()
-        filtered = self.patients
-        if search_text:
-            field = self.records_screen.search_type.text.lower()
-            if field == "name":
-                filtered = [p for p in self.patients if search_text in p.get("name", "").lower()]
-            elif field == "date":
-                filtered = [p for p in self.patients if search_text in p.get("date", "").lower()]
-            elif field == "disease":
-                filtered = [p for p in self.patients if search_text in p.get("diseases", "").lower()]
-            elif field == "mob no.":
-                filtered = [p for p in self.patients if search_text in p.get("mobile_no", "").lower()]
-        filtered = sorted(filtered, key=lambda x: x.get("date", ""), reverse=True)
-        for p in filtered:
-            rec = PatientRecord(p, self.confirm_delete_patient, size_hint_y=None, height=40)
-            container.add_widget(rec)
+        if self.loading:
+            screen.show_appointments([], loading=True)  # Refreshed again once loading finishes
+            return
+        with perf.timer("appointments.query"):
+            patients = self.repository.appointments(*appointment_range(screen.period.text))
+        screen.show_appointments(patients)
+    def load_more_records(self):
+        cursor = self.records_cursor
+        if cursor is None:
+            return
+        if self.records_version is not None and self.records_version != self.repository.version:
+            self.update_patient_list()  # Records changed since the cursor was opened
+            return
+        with perf.timer("records.page"):
+            # An exhausted cursor returns no rows; the count still shows its final total
+            self.records_screen.append_records(cursor.fetch(), cursor.total, more=bool(cursor.pending))
+    def on_cursor_ready(self, cursor):
+        # An archive segment scan finished; fill the page that came up short
+        if cursor is self.records_cursor:
+            self.load_more_records()
     def confirm_delete_patient(self, patient_data):
         content = BoxLayout(orientation="vertical", padding=10, spacing=10)
         content.add_widget(ResponsiveLabel(
@@ -545,27 +951,201 @@ class PatientManagementApp(App):
         yes_btn.bind(on_press=lambda instance: self.delete_patient(patient_data, popup))
         no_btn.bind(on_press=popup.dismiss)
         popup.open()
+    def confirm_returning_patient(self, patient, data, on_saved):
+        content = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        message = ResponsiveLabel(
+            text=f"{patient.get('name', '')} ({patient.get('mobile_no', '')}) is already registered: "
+                 f"{patient.visit_count} visit(s), last on {patient.get('date', '')}. "
+                 "Add this as a new visit?",
+            base_font_size=16
+        )
+        message.bind(width=lambda inst, w: setattr(inst, "text_size", (w, None)))
+        content.add_widget(message)
+        btns = BoxLayout(orientation="horizontal", spacing=10, size_hint_y=None, height=40)
+        visit_btn = Button(text="Add visit", background_normal="", background_color=PRIMARY_COLOR,
+                           color=(1,1,1,1), font_size=sp(16))
+        new_btn = Button(text="New patient", background_normal="", background_color=PRIMARY_COLOR,
+                         color=(1,1,1,1), font_size=sp(16))
+        cancel_btn = Button(text="Cancel", background_normal="", background_color=(0.8,0.2,0.2,1),
+                            color=(1,1,1,1), font_size=sp(16))
+        btns.add_widget(visit_btn)
+        btns.add_widget(new_btn)
+        btns.add_widget(cancel_btn)
+        content.add_widget(btns)
+        popup = Popup(title="Returning Patient", content=content, size_hint=(0.9, 0.4))
+        visit_btn.bind(on_press=lambda instance: self.save_visit(popup, patient.id, data, on_saved))
+        new_btn.bind(on_press=lambda instance: self.save_visit(popup, None, data, on_saved))
+        cancel_btn.bind(on_press=popup.dismiss)
+        popup.open()
+    def save_visit(self, popup, patient_id, data, on_saved):
+        """Adds data as a visit of patient_id, or as a new patient when patient_id is None."""
+        popup.dismiss()
+        if patient_id is None:
+            self.repository.insert(data)
+            on_saved("Patient information saved successfully!")
+        else:
+            self.repository.add_visit(patient_id, data)
+            on_saved("Visit added to the existing patient.")
     def delete_patient(self, patient_data, popup=None):
         if popup:
             popup.dismiss()
-        for i, p in enumerate(self.patients):
-            if p.get("id") == patient_data.get("id"):
-                self.patients.pop(i)
-                break
-        self.save_patients_to_file()
+        if not self.check_storage_writable():
+            return
+        self.repository.delete(patient_data.get("id"))
         self.update_patient_list()
+        self.update_appointments()
         self.show_message("Patient record deleted.")
-    def save_patients_to_file(self):
-        with open("patients.json", "w") as f:
-            json.dump(self.patients, f)
     def load_patients(self):
+        """
+        Loads records on a background thread. The summary file comes first so the Records
+        screen can list patients at once; full records are then added one chunk per frame.
+        """
+        self.storage_error = None
+        self.loading = True
+        self.summaries = None
+        self.loaded_chunks = []
+        self.loaded_records = []
+        self.loading_refreshed = 0
+        self.after_load = []
+        self.load_started = time.perf_counter()
+        threading.Thread(target=self._load_in_background, name="loader", daemon=True).start()
+    def _load_in_background(self):
         try:
-            if os.path.exists("patients.json"):
-                with open("patients.json", "r") as f:
-                    self.patients = json.load(f)
+            try:
+                summaries = self.repository.read_summaries()
+            except Exception as e:
+                Logger.error("Storage: error loading patient summaries: %s", e)
+                summaries = None
+            if summaries is not None:
+                summaries.sort(key=lambda x: x.get("date", ""), reverse=True)
+                Clock.schedule_once(lambda dt: self.on_summaries_loaded(summaries), 0)
+            with perf.timer("storage.parse"):
+                for chunk in self.repository.load_chunks():
+                    # Each chunk is added on the next frame; the queue keeps them in order
+                    self.loaded_chunks.append(chunk)
+                    Clock.schedule_once(self.add_loaded_chunk, 0)
         except Exception as e:
-            print(f"Error loading patients: {e}")
-            self.patients = []
+            Logger.error("Storage: error loading patients: %s", e)
+            message = str(e)
+            Clock.schedule_once(lambda dt: self.on_load_failed(message), 0)
+            return
+        self.loaded_chunks.append(None)
+        Clock.schedule_once(self.add_loaded_chunk, 0)
+    def on_summaries_loaded(self, summaries):
+        if self.loading:
+            self.summaries = summaries
+            self.update_patient_list()
+    def add_loaded_chunk(self, dt):
+        if not self.loading:
+            return  # Loading failed part way
+        chunk = self.loaded_chunks.pop(0)
+        if chunk is None:
+            self.on_records_loaded()
+            return
+        self.repository.add_loaded(chunk)
+        self.loaded_records.extend(chunk)
+        now = time.perf_counter()
+        if self.summaries is None and now - self.loading_refreshed >= LOADING_REFRESH_INTERVAL:
+            self.loading_refreshed = now
+            self.list_loaded_records()
+    def list_loaded_records(self):
+        """Adds the matches among records loaded since the last refresh to the list, keeping its scroll position."""
+        cursor = self.records_cursor
+        if self.records_screen is None or cursor is None:
+            return
+        cursor.records.extend(self.search_loading(*self.loading_query, self.loaded_records[self.loading_listed:]))
+        self.loading_listed = len(self.loaded_records)
+        cursor.total = len(cursor.records)
+        if len(self.records_screen.records_view.data) < RECORDS_PAGE_SIZE and not cursor.exhausted:
+            self.load_more_records()
+        else:
+            self.records_screen.append_records([], cursor.total)
+    def on_records_loaded(self):
+        self.repository.finish_load()
+        self.loading = False
+        self.summaries = None
+        self.loaded_records = []
+        self.loaded_ms = (time.perf_counter() - APP_START) * 1000
+        perf.record("storage.load", (time.perf_counter() - self.load_started) * 1000)
+        Logger.debug(f"Startup: {self.repository.count()} records loaded after {self.loaded_ms:.0f} ms")
+        self.update_patient_list()
+        self.update_appointments()
+        callbacks, self.after_load = self.after_load, []
+        for callback in callbacks:
+            callback()
+    def on_load_failed(self, message):
+        # Starting over from an empty list would overwrite the unreadable file on the
+        # next save, so writes stay disabled until the file is repaired.
+        self.loading = False
+        self.summaries = None
+        self.loaded_records = []
+        self.storage_error = message
+        self.check_storage_writable()
+    def search_loading(self, field, text, records=None):
+        """
+        Matches of a search while loading: among the summaries if there are any, else
+        among records, by default every record loaded so far, in file order.
+        """
+        # Fuzzy keys are built as records load; until then fuzzy search matches substrings
+        key = "name" if field == FUZZY_NAME_FIELD else SEARCH_FIELDS.get(field)
+        if self.summaries is not None:
+            records = self.summaries
+            if text and key not in SUMMARY_FIELDS:
+                return []
+        elif records is None:
+            records = self.loaded_records
+        if not text:
+            return list(records)
+        return [p for p in records if text in str(p.get(key, "") or "").lower()]
+    def show_patient_details(self, patient_data):
+        with perf.timer("records.view_details"):
+            if self.detail_popup is None:
+                self.detail_popup = PatientDetailPopup()
+            self.detail_popup.show(patient_data)
+    def fetch_patient(self, patient_data, callback):
+        """Calls callback with the full record, once loaded, for a possibly summary-only row."""
+        if not patient_data.get("summary"):
+            callback(patient_data)
+        elif self.loading:
+            self.after_load.append(lambda: self.fetch_patient(patient_data, callback))
+        else:
+            # Archived patients are read from disk on another thread, then called back here
+            self.repository.fetch(patient_data.get("id"), lambda full: callback(full) if full is not None else None)
+    def check_storage_writable(self):
+        if self.loading:
+            self.show_error("Patient records are still loading. Please try again in a moment.")
+            return False
+        if self.storage_error is None:
+            return True
+        self.show_error(f"Could not load patient records ({self.storage_error}). "
+                        "Changes are disabled to protect the existing data.")
+        return False
+    def on_persisted(self, change_count, error):
+        if error is not None:
+            self.show_error(f"Could not save patient records: {error}")
+    def on_pause(self):
+        self.repository.flush()
+        return True
+    def on_stop(self):
+        self.repository.close()
+    def diagnostics_report(self, recount=False):
+        """The Diagnostics screen's text; live widgets are recounted only if recount or stale."""
+        window_widgets = sum(1 for root in Window.children for _ in root.walk(restrict=True))
+        now = time.perf_counter()
+        if recount or self.alive_widgets is None or now - self.alive_counted >= WIDGET_COUNT_INTERVAL:
+            self.alive_widgets = sum(1 for obj in gc.get_objects() if isinstance(obj, Widget))
+            self.alive_counted = now
+        lines = [f"Timing: {'on' if perf.enabled else 'off'} (last {perf.window} samples, ms)",
+                 perf.report(), "",
+                 f"Widgets in window: {window_widgets}",
+                 f"Widget objects alive: {self.alive_widgets} (counted {now - self.alive_counted:.0f} s ago)",
+                 f"Responsive widgets: {len(font_scaler.widgets)}",
+                 f"Patients: {'loading' if self.loading else self.repository.count()}"]
+        if self.first_frame_ms is not None:
+            lines.append(f"First frame: {self.first_frame_ms:.0f} ms")
+        if self.loaded_ms is not None:
+            lines.append(f"Records loaded: {self.loaded_ms:.0f} ms")
+        return "\n".join(lines)
     def show_message(self, message):
         content = BoxLayout(orientation="vertical", padding=10, spacing=10)
         content.add_widget(ResponsiveLabel(text=message, base_font_size=16))
@@ -0,0 +1,2696 @@
+"""
+Patient storage for ClinicMGR: the field schema, compact records, the JSON journal and
+archive, the SQLite backend, search indexes, vitals analytics and import/export. Nothing
+here imports Kivy; callbacks meant for the UI thread go through a call_soon function the
+app supplies, so tests and benchmarks can use this module on its own.
+"""
+import base64
+import csv
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque, namedtuple
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain, compress
+
+def call_now(callback):
+    """Default call_soon: runs callback at once, on the calling thread."""
+    callback()
+
+
+# ---------- STORAGE ----------
+PATIENTS_FILE = "patients.json"
+JOURNAL_FILE = "patients.journal"
+SUMMARY_FILE = "patients.summary.json"  # id, name, date and mobile only, read before the full file
+SQLITE_FILE = "patients.db"
+STORAGE_MODE = "journal"          # "journal" appends per change, "snapshot" rewrites the file, "sqlite" uses SQLITE_FILE
+JOURNAL_COMPACT_THRESHOLD = 500   # Journal entries before a background compaction
+LOAD_CHUNK_SIZE = 2000            # Records added to the in-memory indexes per frame during startup
+SUMMARY_FIELDS = ("id", "name", "date", "mobile_no")
+SNAPSHOT_FORMAT = 2               # patients.json layout: 2 = visits nested per patient, duplicates merged
+ARCHIVE_DIR = "archive"
+ARCHIVE_AFTER_DAYS = 730          # Patients whose latest visit is older move to the archive at startup
+ARCHIVE_MIN_PATIENTS = 500        # Fewer cold patients than this wait for a later startup
+ARCHIVE_SEGMENT_SIZE = 5000       # Patients per archive segment file
+ARCHIVE_CACHE_SEGMENTS = 2        # Decoded archive segments kept for lookups of archived patients
+
+# ---------- PATIENT FIELD SCHEMA ----------
+# One entry per form field, in display order. It drives the entry form, the read-only
+# view, clearing and get_patient_data(). A callable default is evaluated on each clear.
+# per_visit fields are stored with each visit; the rest once per patient.
+FieldSpec = namedtuple("FieldSpec", "key label multiline input_filter choices height readonly default per_visit",
+                       defaults=(False, None, None, 100, False, "", False))
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+APPOINTMENT_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")  # Accepted when typing an appointment date
+
+def parse_appointment_date(text):
+    """
+    An appointment date typed in any APPOINTMENT_DATE_FORMATS, as "YYYY-MM-DD".
+    Returns "" for a blank date and None for one that cannot be read.
+    """
+    text = str(text or "").strip()
+    if not text:
+        return ""
+    for date_format in APPOINTMENT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+APPOINTMENT_PERIODS = ("Today", "Tomorrow", "This Week", "Next 7 Days")
+
+def appointment_range(period, today=None):
+    """(start, end) "YYYY-MM-DD" dates of an APPOINTMENT_PERIODS entry; a week runs Monday to Sunday."""
+    today = today or datetime.now().date()
+    if period == "Tomorrow":
+        start = end = today + timedelta(days=1)
+    elif period == "This Week":
+        start = today - timedelta(days=today.weekday())
+        end = start + timedelta(days=6)
+    elif period == "Next 7 Days":
+        start, end = today, today + timedelta(days=6)
+    else:
+        start = end = today
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+PATIENT_FORM_SCHEMA = (
+    FieldSpec("name", "Name:"),
+    FieldSpec("mobile_no", "Mobile No:", input_filter="int"),
+    FieldSpec("date", "Date:", readonly=True, default=_today, per_visit=True),
+    FieldSpec("adress", "Adress:", multiline=True),
+    FieldSpec("gender", "Gender:", choices=("Male", "Female", "Other"), default="Male"),
+    FieldSpec("weight", "Weight:", input_filter="float", per_visit=True),
+    FieldSpec("systolic_bp", "Systolic BP:", input_filter="int", per_visit=True),
+    FieldSpec("diastolic_bp", "Diastolic BP:", input_filter="int", per_visit=True),
+    FieldSpec("pulse_rate", "Pulse Rate:", input_filter="int", per_visit=True),
+    FieldSpec("surgery", "Surgery:", choices=("No", "Yes"), default="No"),
+    FieldSpec("surgery_description", "Surgery Description:", multiline=True),
+    FieldSpec("medical_history", "Medical History:", multiline=True, height=200),
+    FieldSpec("diseases", "Diseases:", multiline=True),
+    FieldSpec("medicines", "Medicines:", multiline=True, per_visit=True),
+    FieldSpec("extra", "Extra:", multiline=True, height=200, per_visit=True),
+    FieldSpec("other_illnesses", "Other Illnesses:"),
+    FieldSpec("other_medicines", "Other Medicines:", multiline=True, per_visit=True),
+    FieldSpec("next_appointment_date", "Next Appointment Date:", per_visit=True),
+)
+# Record keys, in the order PatientMedicalForm.get_patient_data() returns them
+PATIENT_FIELDS = tuple(spec.key for spec in PATIENT_FORM_SCHEMA)
+VISIT_FIELDS = tuple(spec.key for spec in PATIENT_FORM_SCHEMA if spec.per_visit)
+PROFILE_FIELDS = tuple(spec.key for spec in PATIENT_FORM_SCHEMA if not spec.per_visit)
+# Profile values the form fills in by itself (spinner defaults), which say nothing new about a patient
+PROFILE_DEFAULTS = {spec.key: spec.default for spec in PATIENT_FORM_SCHEMA
+                    if not spec.per_visit and spec.default and not callable(spec.default)}
+# Records screen search_type (lowercased) -> record key
+SEARCH_FIELDS = {"name": "name", "date": "date", "disease": "diseases", "mob no.": "mobile_no"}
+FUZZY_NAME_FIELD = "fuzzy name"  # search_type ranking names by similarity instead of substring
+FUZZY_TOP_K = 100                 # Best fuzzy matches listed
+FUZZY_MIN_SCORE = 0.5             # Weaker fuzzy matches are left out
+RECORDS_PAGE_SIZE = 50  # Records fetched per page as the records list scrolls
+
+# ---------- PERFORMANCE INSTRUMENTATION ----------
+PERF_WINDOW = 256                 # Samples kept per timer
+PERF_LOG_FILE = "performance.log"
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+
+class _Timer:
+    __slots__ = ("stats", "name", "start")
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *args):
+        self.stats.record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+_NO_TIMER = _NoTimer()
+
+class PerfStats:
+    """
+    Rolling timings (ms) of the hot paths, keyed by name. Off by default; while off,
+    timer() hands back a shared no-op context manager, so instrumented code only pays
+    for one attribute check.
+    """
+    def __init__(self, window=PERF_WINDOW):
+        self.enabled = False
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NO_TIMER
+    def record(self, name, ms):
+        if not self.enabled:
+            return
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(ms)
+        self.counts[name] = self.counts.get(name, 0) + 1
+    def reset(self):
+        self.samples = {}
+        self.counts = {}
+    def summary(self):
+        result = {}
+        for name, samples in list(self.samples.items()):
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            last = len(ordered) - 1
+            result[name] = {"count": self.counts.get(name, 0), "p50": ordered[last // 2],
+                            "p95": ordered[int(last * 0.95)], "max": ordered[-1]}
+        return result
+    def report(self):
+        lines = [f"{'timer':<28}{'count':>7}{'p50':>9}{'p95':>9}{'max':>9}"]
+        for name, row in sorted(self.summary().items()):
+            lines.append(f"{name:<28}{row['count']:>7}{row['p50']:>9.2f}{row['p95']:>9.2f}{row['max']:>9.2f}")
+        return "\n".join(lines)
+    def export(self, extra="", path=PERF_LOG_FILE):
+        with open(path, "a") as f:
+            f.write(f"--- {datetime.now().isoformat(timespec='seconds')} ---\n")
+            f.write(self.report() + "\n")
+            if extra:
+                f.write(extra + "\n")
+        return path
+
+perf = PerfStats()
+
+# ---------- PATIENT ----------
+INTERNED_FIELDS = ("gender", "surgery", "date")  # Few distinct values, shared between records
+VITAL_FIELDS = {"weight": float, "systolic_bp": int, "diastolic_bp": int, "pulse_rate": int}
+
+def _compact_value(key, value):
+    kind = VITAL_FIELDS.get(key)
+    if kind is not None and value:
+        try:
+            number = kind(value)
+        except (TypeError, ValueError):
+            return value
+        # Only keep the number when it prints back as exactly the text that was entered
+        return number if str(number) == value else value
+    if key in INTERNED_FIELDS and type(value) is str:
+        return sys.intern(value)
+    return value
+
+class CompactRecord:
+    """
+    Base of the compact in-memory records: one slot per key instead of a dict.
+    Low-cardinality values are interned and vitals are kept as numbers. get() and []
+    return the same strings a dict would, so callers can use either.
+    """
+    __slots__ = ("_extra",)
+    KEYS = ()
+    KEY_SET = frozenset()
+    STORED_KEYS = frozenset()  # Keys handled by from_dict(); anything else goes to _extra
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for key in cls.KEYS:
+            setattr(record, key, _compact_value(key, data.get(key)))
+        # Keys this version does not know about are kept so they survive a rewrite
+        record._extra = None
+        if not data.keys() <= cls.STORED_KEYS:
+            record._extra = {k: v for k, v in data.items() if k not in cls.STORED_KEYS}
+        return record
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls.__new__(cls)
+        for key in cls.KEYS:
+            setattr(record, key, _compact_value(key, row[key]))
+        record._extra = None
+        return record
+
+    def get(self, key, default=None):
+        if key in VITAL_FIELDS and key in self.KEY_SET:
+            value = getattr(self, key)
+            return default if value is None else (value if type(value) is str else str(value))
+        if key in self.KEY_SET:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self._extra.get(key, default) if self._extra else default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def vital(self, key):
+        """The numeric value of a vital sign, or None when it is empty or not a number."""
+        value = getattr(self, key)
+        return None if value is None or type(value) is str else value
+
+    def to_dict(self):
+        data = {key: self.get(key) for key in self.KEYS if getattr(self, key) is not None}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+class Visit(CompactRecord):
+    """The per-visit fields of one visit: date, vitals, medicines, next appointment."""
+    __slots__ = VISIT_FIELDS
+    KEYS = VISIT_FIELDS
+    KEY_SET = frozenset(KEYS)
+    STORED_KEYS = KEY_SET
+
+class Patient(CompactRecord):
+    """
+    One patient: the profile fields plus their visits, oldest first. The per-visit keys
+    read through to the latest visit, so a patient still looks like the flat record the
+    form produces. Records stored before visits existed load as a single visit.
+    visits may hold only the latest visit (SQLite); visit_count is always the total.
+    """
+    __slots__ = ("id",) + PROFILE_FIELDS + ("visits", "visit_count")
+    KEYS = ("id",) + PROFILE_FIELDS
+    KEY_SET = frozenset(KEYS)
+    STORED_KEYS = KEY_SET | frozenset(VISIT_FIELDS) | {"visits"}
+
+    @classmethod
+    def from_dict(cls, data):
+        patient = super().from_dict(data)
+        visits = data.get("visits")
+        if visits is None:
+            visits = [{key: data[key] for key in VISIT_FIELDS if key in data}]
+        patient.visits = [Visit.from_dict(v) for v in visits]
+        patient.visit_count = len(patient.visits)
+        return patient
+
+    @classmethod
+    def from_row(cls, row):
+        patient = super().from_row(row)
+        patient.visits = [Visit.from_row(row)]
+        patient.visit_count = row["visit_count"]
+        return patient
+
+    def get(self, key, default=None):
+        if key in Visit.KEY_SET:
+            return self.visits[-1].get(key, default) if self.visits else default
+        return super().get(key, default)
+
+    def vital(self, key):
+        return self.visits[-1].vital(key) if self.visits else None
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["visits"] = [visit.to_dict() for visit in self.visits]
+        return data
+
+def patient_key(record):
+    """(mobile digits, normalised name) identifying a returning patient; None without both."""
+    mobile = "".join(ch for ch in str(record.get("mobile_no", "") or "") if ch.isdigit())
+    name = " ".join(str(record.get("name", "") or "").lower().split())
+    return (mobile, name) if mobile and name else None
+
+def normalize_record(record):
+    """Moves the visit fields of a flat stored record into a one-visit "visits" list, in place."""
+    if "visits" not in record:
+        record["visits"] = [{key: record.pop(key) for key in VISIT_FIELDS if key in record}]
+    return record
+
+def stored_value(record, key, default=""):
+    """record.get(key) for a stored record dict, reading visit fields from its latest visit."""
+    if key in VISIT_FIELDS and "visits" in record:
+        visits = record["visits"]
+        return visits[-1].get(key, default) if visits else default
+    return record.get(key, default)
+
+def _visit_date(visit):
+    return visit.get("date", "") or ""
+
+def update_profile(record, data, keys=PROFILE_FIELDS):
+    """
+    Copies the non-empty profile fields of data over record. A value equal to its
+    PROFILE_DEFAULTS entry only fills an empty field, so an untouched spinner does not
+    overwrite what is known; anything else entered is an edit and replaces the old value.
+    """
+    for key in keys:
+        value = data.get(key)
+        if value and (value != PROFILE_DEFAULTS.get(key) or not record.get(key)):
+            record[key] = value
+    return record
+
+def merge_visit(record, data):
+    """
+    Adds the visit fields of data (a flat get_patient_data() record) to the stored record
+    as a new visit, in date order, and applies its profile fields with update_profile().
+    """
+    normalize_record(record)
+    visit = {key: data.get(key, "") for key in VISIT_FIELDS}
+    visits = record["visits"]
+    i = bisect_right([_visit_date(v) for v in visits], _visit_date(visit))
+    visits.insert(i, visit)
+    return update_profile(record, data)
+
+def merge_duplicate_patients(records):
+    """
+    Folds stored records of the same patient (equal patient_key) into the first one as
+    visits. The profile fields are applied oldest first with update_profile(), so each
+    ends up with its most recent entered value. Merged records are removed from the
+    list in place. Returns how many were merged.
+    """
+    groups = {}
+    for i, record in enumerate(records):
+        key = patient_key(record)
+        if key is not None:
+            groups.setdefault(key, []).append(i)
+    merged = 0
+    for positions in groups.values():
+        if len(positions) < 2:
+            continue
+        group = [normalize_record(records[i]) for i in positions]
+        target = group[0]
+        for record in sorted(group, key=lambda r: max(map(_visit_date, r["visits"]), default="")):
+            update_profile(target, record)
+        for record in group[1:]:
+            target["visits"].extend(record["visits"])
+        target["visits"].sort(key=_visit_date)
+        for i in positions[1:]:
+            records[i] = None
+        merged += len(positions) - 1
+    if merged:
+        records[:] = [r for r in records if r is not None]
+    return merged
+
+def numeric_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def repair_duplicate_ids(records, next_id):
+    """
+    Gives every record after the first one with an already-used (or empty) id a fresh
+    id. Returns (number of records re-keyed, next free id).
+    """
+    for record in records:
+        number = numeric_id(record.get("id"))
+        if number is not None:
+            next_id = max(next_id, number + 1)
+    seen = set()
+    repaired = 0
+    for record in records:
+        patient_id = record.get("id")
+        if not patient_id or patient_id in seen:
+            patient_id = record["id"] = str(next_id)
+            next_id += 1
+            repaired += 1
+        seen.add(patient_id)
+    return repaired, next_id
+
+def _json_default(obj):
+    if isinstance(obj, CompactRecord):
+        return obj.to_dict()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def write_atomic(path, data, compress=False):
+    """
+    Writes data as JSON (gzipped with compress), or bytes as they are, to a temp file,
+    fsyncs it and renames it over path.
+    """
+    tmp_path = path + ".tmp"
+    raw = isinstance(data, bytes)
+    with open(tmp_path, "wb" if compress or raw else "w") as f:
+        if raw:
+            f.write(data)
+        elif compress:
+            with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                gz.write(json.dumps(data, default=_json_default).encode("utf-8"))
+        else:
+            json.dump(data, f, default=_json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # Directories cannot be opened on every platform
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+# ---------- PATIENT JOURNAL ----------
+class PatientJournal:
+    """
+    Append-only log of inserts, visits and deletes layered on top of the patients.json snapshot.
+    Changes get their sequence number on the UI thread; write_batch() does the file work
+    on the persistence worker. The snapshot stores the last sequence it contains, so
+    replaying snapshot + journal after a crash is always safe.
+    """
+    def __init__(self, snapshot_path=PATIENTS_FILE, journal_path=JOURNAL_FILE,
+                 compact_threshold=JOURNAL_COMPACT_THRESHOLD, summary_path=SUMMARY_FILE):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.summary_path = summary_path
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self.pending = 0
+        self.next_id = 1
+        self.format = SNAPSHOT_FORMAT
+        self._fd = None
+
+    def load(self):
+        """
+        Returns the records of snapshot + journal. Afterwards next_id is at least one past
+        every id the snapshot allocator or any journaled insert has ever used, and format
+        is the snapshot's SNAPSHOT_FORMAT; a journal without a snapshot counts as format 1.
+        """
+        patients, snapshot_seq, next_id = [], 0, 1
+        snapshot_format = 1 if os.path.exists(self.journal_path) else SNAPSHOT_FORMAT
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                patients = data  # Plain list written by older versions
+                snapshot_format = 1
+            else:
+                patients = data.get("patients", [])
+                snapshot_seq = data.get("seq", 0)
+                next_id = data.get("next_id", 1)
+                snapshot_format = data.get("format", 1)
+        self.format = snapshot_format
+        self.seq = snapshot_seq
+        self.pending = 0
+        self.next_id = next_id
+        self._replay(patients)
+        return patients
+
+    def _read_journal(self):
+        """Yields (entry, end offset) for each complete journal line, stopping at a torn one."""
+        if not os.path.exists(self.journal_path):
+            return
+        offset = 0
+        with open(self.journal_path, "rb") as f:
+            for line in iter(f.readline, b""):
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    return  # Torn last line from an interrupted append
+                offset += len(line)
+                yield entry, offset
+
+    @staticmethod
+    def _apply_all(entries, records, make_record=None, apply_visit=merge_visit):
+        """
+        Applies insert/visit/delete entries to records in place. A visit or delete applies
+        to the first record with the entry's id.
+        """
+        positions = None
+        deleted = False
+        for entry in entries:
+            op = entry.get("op")
+            if op == "insert":
+                record = entry["record"]
+                records.append(make_record(record) if make_record else record)
+                if positions is not None:
+                    positions.setdefault(record.get("id"), []).append(len(records) - 1)
+            elif op in ("visit", "delete"):
+                if positions is None:
+                    positions = {}
+                    for i, p in enumerate(records):
+                        positions.setdefault(p.get("id"), []).append(i)
+                slots = positions.get(entry.get("id"))
+                if not slots:
+                    continue
+                if op == "visit":
+                    apply_visit(records[slots[0]], entry["record"])
+                else:
+                    records[slots.pop(0)] = None
+                    deleted = True
+        if deleted:
+            records[:] = [p for p in records if p is not None]
+
+    def _replay(self, patients):
+        good = 0
+        def entries():
+            nonlocal good
+            for entry, good in self._read_journal():
+                seq = entry.get("seq", 0)
+                if seq <= self.seq:
+                    continue  # Already in the snapshot, or repeated by a retried write
+                if entry.get("op") == "insert":
+                    number = numeric_id(entry["record"].get("id"))
+                    if number is not None:
+                        self.next_id = max(self.next_id, number + 1)
+                self.seq = seq
+                self.pending += 1
+                yield entry
+        self._apply_all(entries(), patients)
+        if os.path.exists(self.journal_path) and good < os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good)
+
+    def load_summaries(self):
+        """
+        Summary records (SUMMARY_FIELDS plus "summary": True) from the summary file and the
+        journal, without parsing the full snapshot. Returns None when there is no usable
+        summary. Read-only, so it is safe to call from a loader thread.
+        """
+        if not os.path.exists(self.summary_path):
+            return None
+        with open(self.summary_path, "r") as f:
+            data = json.load(f)
+        seq = data.get("seq", 0)
+        summaries = [dict(zip(SUMMARY_FIELDS, row), summary=True) for row in data.get("rows", [])]
+        make_summary = lambda record: dict({f: stored_value(record, f) for f in SUMMARY_FIELDS}, summary=True)
+        def visit_summary(summary, data):
+            summary["date"] = max(summary.get("date", "") or "", data.get("date", "") or "")
+            update_profile(summary, data, ("name", "mobile_no"))
+        entries = []
+        for entry, _ in self._read_journal():
+            entry_seq = entry.get("seq", 0)
+            if entry_seq <= seq:
+                continue
+            if entry_seq != seq + 1:
+                return None  # Summary is older than the journal covers
+            entries.append(entry)
+            seq = entry_seq
+        self._apply_all(entries, summaries, make_summary, visit_summary)
+        return summaries
+
+    def insert_change(self, record):
+        return self._change({"op": "insert", "record": record})
+
+    def visit_change(self, patient_id, record):
+        return self._change({"op": "visit", "id": patient_id, "record": record})
+
+    def delete_change(self, patient_id):
+        return self._change({"op": "delete", "id": patient_id})
+
+    def _change(self, entry):
+        self.seq += 1
+        entry["seq"] = self.seq
+        self.pending += 1
+        return ("entry", entry)
+
+    def snapshot_change(self, patients, next_id):
+        self.pending = 0
+        return ("snapshot", list(patients), self.seq, next_id)
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_threshold
+
+    def write_batch(self, changes):
+        """Writes only the newest snapshot in changes, then appends the entries after it."""
+        with perf.timer("storage.write"):
+            self._write_batch(changes)
+
+    def _write_batch(self, changes):
+        last_snapshot = -1
+        for i, change in enumerate(changes):
+            if change[0] == "snapshot":
+                last_snapshot = i
+        if last_snapshot >= 0:
+            _, patients, seq, next_id = changes[last_snapshot]
+            self.write_snapshot(patients, seq, next_id)
+            self._truncate()
+        entries = [change[1] for change in changes[last_snapshot + 1:]]
+        if not entries:
+            return
+        data = "".join(json.dumps(e, default=_json_default) + "\n" for e in entries).encode("utf-8")
+        if self._fd is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+            self._fd = os.open(self.journal_path, flags, 0o666)
+        start = os.lseek(self._fd, 0, os.SEEK_END)
+        try:
+            # One unbuffered write: no part of a failed batch can reach the file later
+            if os.write(self._fd, data) != len(data):
+                raise OSError("short write to the journal")
+            os.fsync(self._fd)
+        except Exception:
+            os.ftruncate(self._fd, start)  # Leave no torn line ahead of the retry
+            raise
+
+    def write_snapshot(self, patients, seq=None, next_id=None):
+        seq = self.seq if seq is None else seq
+        next_id = self.next_id if next_id is None else next_id
+        write_atomic(self.snapshot_path, {"format": SNAPSHOT_FORMAT, "seq": seq, "next_id": next_id,
+                                          "patients": patients})
+        rows = [[str(p.get(f, "") or "") for f in SUMMARY_FIELDS] for p in patients]
+        write_atomic(self.summary_path, {"seq": seq, "rows": rows})
+
+    def _truncate(self):
+        self.close()
+        if os.path.exists(self.journal_path):
+            open(self.journal_path, "w").close()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+# ---------- PATIENT ARCHIVE ----------
+class KeyFilter:
+    """
+    Bloom filter of patient_key() values, saved in the manifest as base64. Positions come
+    from blake2b rather than hash(), which changes from run to run. A false positive only
+    costs reading a segment that turns out not to hold the key.
+    """
+    BITS_PER_KEY = 10
+    HASHES = 4
+
+    def __init__(self, bits):
+        self.bits = bits
+
+    @classmethod
+    def build(cls, keys):
+        keys = [key for key in keys if key is not None]
+        key_filter = cls(bytearray(max(8, (len(keys) * cls.BITS_PER_KEY + 7) // 8)))
+        for key in keys:
+            key_filter.add(key)
+        return key_filter
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(bytearray(base64.b64decode(text)))
+
+    def to_text(self):
+        return base64.b64encode(bytes(self.bits)).decode("ascii")
+
+    def _positions(self, key):
+        digest = hashlib.blake2b("\x1f".join(key).encode("utf-8"), digest_size=16).digest()
+        first, step = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        size = len(self.bits) * 8
+        return [(first + i * step) % size for i in range(self.HASHES)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class PatientArchive:
+    """
+    Cold tier: immutable gzip segments of patients whose latest visit is older than
+    ARCHIVE_AFTER_DAYS. manifest.json lists each segment's ids and a small index of it
+    (date range, the trigrams of every searchable field, the FuzzyNameIndex postings
+    keys of its names and a KeyFilter of its patient keys), and the ids removed since,
+    by deletion or by a returning patient moving back to the hot set. Only the ids and
+    those indexes stay in memory; a search reads just the segments its dates, trigrams
+    or keys can match, and TieredCursor does that on a background thread as paging
+    reaches them. The last ARCHIVE_CACHE_SEGMENTS decoded segments are kept. An id
+    archived twice, after a crash or a second trip through the hot set, lives in its
+    newest segment. Each segment has a .vitals file with its VitalsColumns, so reports
+    cover archived visits without reading the segment.
+
+    load() and add() run on the loader thread, before the repository installs the
+    archive; from then on it is only changed on the UI thread, and other threads only
+    read segments.
+    """
+    INDEX_KEYS = ("grams", "fuzzy", "key_filter")
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.segments = []
+        self.removed = set()
+        self.segment_of = {}
+        self.key_filters = {}  # Segment file -> KeyFilter
+        self.upgraded = False
+        self._cache = OrderedDict()  # Segment file -> {id: Patient}, least recently used first
+        self._cache_lock = threading.Lock()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                data = json.load(f)
+            self.segments = data.get("segments", [])
+            self.removed = set(data.get("removed", []))
+        self.upgraded = False
+        for i, segment in enumerate(self.segments):
+            if not all(key in segment for key in self.INDEX_KEYS):
+                # Written by an older version: index it once, dropping what it kept instead
+                self.segments[i] = self._segment_index(segment["file"], self._records(segment))
+                self.upgraded = True
+        self.segment_of = {}
+        self.key_filters = {}
+        for segment in self.segments:
+            self._index(segment)
+
+    def _index(self, segment):
+        self.segment_of.update((pid, segment) for pid in segment["ids"])
+        self.key_filters[segment["file"]] = KeyFilter.from_text(segment["key_filter"])
+
+    def __contains__(self, patient_id):
+        return patient_id in self.segment_of and patient_id not in self.removed
+
+    def count(self):
+        return len(self.segment_of) - len(self.removed)
+
+    def manifest(self):
+        return {"segments": self.segments, "removed": sorted(self.removed)}
+
+    def write_manifest(self, data):
+        write_atomic(self.manifest_path, data)
+
+    def add(self, records):
+        """
+        Writes stored records to new segments, then the manifest. Runs before the hot
+        snapshot drops them: after a crash in between, the hot copy wins on the next load.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        records = sorted(records, key=lambda r: stored_value(r, "date") or "")
+        for i in range(0, len(records), ARCHIVE_SEGMENT_SIZE):
+            chunk = records[i:i + ARCHIVE_SEGMENT_SIZE]
+            name = f"segment-{len(self.segments) + 1:05d}.json.gz"
+            write_atomic(os.path.join(self.directory, name), chunk, compress=True)
+            self._write_vitals(name, chunk)
+            segment = self._segment_index(name, chunk)
+            self.segments.append(segment)
+            self._index(segment)
+            self.removed.difference_update(segment["ids"])
+        self.write_manifest(self.manifest())
+
+    @staticmethod
+    def _segment_index(name, records):
+        n = PatientSearchIndex.GRAM
+        grams = {field: set() for field in SEARCH_FIELDS.values()}
+        fuzzy = FuzzyNameIndex()
+        fuzzy_keys = set()
+        for record in records:
+            for field, found in grams.items():
+                value = str(stored_value(record, field) or "").lower()
+                found.update(value[i:i + n] for i in range(len(value) - n + 1))
+            fuzzy_keys |= fuzzy.name_keys(record.get("name"))
+        dates = [stored_value(record, "date") or "" for record in records]
+        return {"file": name, "count": len(records), "min_date": min(dates), "max_date": max(dates),
+                "ids": [record["id"] for record in records],
+                "grams": {field: sorted(found) for field, found in grams.items()},
+                "fuzzy": sorted(fuzzy_keys),
+                "key_filter": KeyFilter.build(patient_key(record) for record in records).to_text()}
+
+    def _vitals_path(self, name):
+        return os.path.join(self.directory, name.replace(".json.gz", ".vitals"))
+
+    def _write_vitals(self, name, records):
+        # Slots are given in record order, so slot i is the segment's ids[i]
+        vitals = VitalsColumns()
+        vitals.extend(Patient.from_dict(r) for r in records)
+        write_atomic(self._vitals_path(name), vitals.to_bytes())
+
+    def load_vitals(self, vitals):
+        """Adds the vitals of every live archived visit to vitals."""
+        for segment in self.segments:
+            path = self._vitals_path(segment["file"])
+            if not os.path.exists(path):
+                self._write_vitals(segment["file"], self._records(segment))
+            with open(path, "rb") as f:
+                columns = VitalsColumns.from_bytes(f.read())
+            live = [pid in self and self.segment_of[pid] is segment for pid in segment["ids"]]
+            vitals.extend_columns(columns, segment["ids"], live)
+
+    def remove(self, patient_id):
+        """
+        Drops an archived patient, deleted or back in the hot set; returns the manifest
+        change for the persistence worker.
+        """
+        self.removed.add(patient_id)
+        return ("manifest", self.manifest())
+
+    def _records(self, segment):
+        with gzip.open(os.path.join(self.directory, segment["file"]), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read(self, segment):
+        """
+        {id: Patient} of every record in segment, live or not. Thread-safe; the decoded
+        segment is cached, evicting the least recently read beyond ARCHIVE_CACHE_SEGMENTS.
+        """
+        name = segment["file"]
+        with self._cache_lock:
+            patients = self._cache.get(name)
+            if patients is not None:
+                self._cache.move_to_end(name)
+                return patients
+        with perf.timer("archive.read"):
+            patients = {r["id"]: Patient.from_dict(r) for r in self._records(segment)}
+        with self._cache_lock:
+            self._cache[name] = patients
+            while len(self._cache) > ARCHIVE_CACHE_SEGMENTS:
+                self._cache.popitem(last=False)
+        return patients
+
+    def _live(self, segment, removed=None):
+        """The live patients of segment, oldest first. removed defaults to self.removed."""
+        removed = self.removed if removed is None else removed
+        segment_of = self.segment_of
+        return [p for pid, p in self.read(segment).items() if pid not in removed and segment_of[pid] is segment]
+
+    def find(self, patient_id):
+        """The full record of a live archived patient, or None. May read a segment."""
+        if patient_id not in self:
+            return None
+        return self.read(self.segment_of[patient_id]).get(patient_id)
+
+    def fetch(self, patient_id, callback):
+        """Calls callback with find(patient_id) from a background thread that reads the segment."""
+        segment = self.segment_of[patient_id] if patient_id in self else None
+        self._in_background(lambda: self.read(segment).get(patient_id) if segment is not None else None, callback)
+
+    def find_key(self, key, removed=None):
+        """
+        The live archived patient with patient_key() == key, newest first, or None. Reads
+        the segments whose KeyFilter may hold key.
+        """
+        if key is None:
+            return None
+        for segment in reversed(self.segments):
+            if key in self.key_filters[segment["file"]]:
+                for patient in reversed(self._live(segment, removed)):
+                    if patient_key(patient) == key:
+                        return patient
+        return None
+
+    def may_hold_key(self, key):
+        return key is not None and any(key in key_filter for key_filter in self.key_filters.values())
+
+    def fetch_key(self, key, callback):
+        """Calls callback with find_key(key) from a background thread that reads the segments."""
+        removed = frozenset(self.removed)
+        self._in_background(lambda: self.find_key(key, removed), callback)
+
+    @staticmethod
+    def _in_background(read, callback):
+        def run():
+            try:
+                result = read()
+            except (OSError, ValueError):
+                result = None
+            callback(result)
+        threading.Thread(target=run, name="archive-read", daemon=True).start()
+
+    @staticmethod
+    def _has_grams(grams, text):
+        """Whether every trigram of text is in the sorted list grams."""
+        n = PatientSearchIndex.GRAM
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            j = bisect_left(grams, gram)
+            if j == len(grams) or grams[j] != gram:
+                return False
+        return True
+
+    def candidates(self, field, text):
+        """Segments whose index can match search(field, text), newest first."""
+        text = text.lower()
+        segments = sorted(self.segments, key=lambda s: s["max_date"], reverse=True)
+        date_range = parse_date_range(text) if field == "date" else None
+        if date_range:
+            start, end = date_range
+            return [s for s in segments if s["min_date"] <= end and s["max_date"] >= start]
+        if not text or field not in SEARCH_FIELDS or len(text) < PatientSearchIndex.GRAM:
+            return segments
+        return [s for s in segments if self._has_grams(s["grams"][SEARCH_FIELDS[field]], text)]
+
+    def scan(self, segment, field, text, removed=None):
+        """Live patients of segment matching search(field, text), newest first. Reads the segment."""
+        with perf.timer("archive.scan"):
+            text = text.lower()
+            patients = self._live(segment, removed)
+            date_range = parse_date_range(text) if field == "date" else None
+            if date_range:
+                start, end = date_range
+                patients = [p for p in patients if start <= (p.get("date") or "") <= end]
+            elif text and field in SEARCH_FIELDS:
+                key = SEARCH_FIELDS[field]
+                patients = [p for p in patients if text in str(p.get(key, "") or "").lower()]
+            patients.reverse()
+            patients.sort(key=lambda p: p.get("date") or "", reverse=True)
+            return patients
+
+    def search(self, field, text):
+        """Every match of search(field, text), newest segment first. Reads the candidate segments."""
+        return [p for segment in self.candidates(field, text) for p in self.scan(segment, field, text)]
+
+    def search_jobs(self, field, text):
+        """TieredCursor jobs scanning the candidate segments, newest first; which patients are live is fixed now."""
+        removed = frozenset(self.removed)
+        return [partial(self.scan, segment, field, text, removed) for segment in self.candidates(field, text)]
+
+    def fuzzy_ranked(self, text, limit=FUZZY_TOP_K, removed=None):
+        """
+        FuzzyNameIndex.ranked() rows (score, date, patient) over the live patients of the
+        segments sharing a postings key with text. Reads those segments.
+        """
+        fuzzy = FuzzyNameIndex()
+        query_keys = fuzzy.name_keys(text)
+        found = {}
+        for segment in self.segments:
+            if query_keys.intersection(segment["fuzzy"]):
+                for patient in self._live(segment, removed):
+                    found[patient.id] = patient
+                    fuzzy.add(patient.id, patient.get("name"), patient.get("date"))
+        return [(score, date, found[pid]) for score, date, pid in fuzzy.ranked(text, limit)]
+
+    def fuzzy_jobs(self, text, limit=FUZZY_TOP_K):
+        """A TieredCursor job ranking the archived fuzzy matches of text, or none if no segment can match."""
+        query_keys = FuzzyNameIndex().name_keys(text)
+        if not any(query_keys.intersection(segment["fuzzy"]) for segment in self.segments):
+            return []
+        removed = frozenset(self.removed)
+        return [lambda: [patient for _, _, patient in self.fuzzy_ranked(text, limit, removed)]]
+
+    def patients_newest_first(self):
+        """
+        Every live archived patient as a full Patient, newest segment first. Which ones are
+        live is fixed when this is called; the segments are read, past the cache, only as
+        the returned iterator is consumed, so it may be consumed on another thread.
+        """
+        removed = frozenset(self.removed)
+        segments = sorted(self.segments, key=lambda s: s["max_date"], reverse=True)
+        def read_all():
+            for segment in segments:
+                records = [r for r in self._records(segment)
+                           if r.get("id") not in removed and self.segment_of.get(r.get("id")) is segment]
+                records.reverse()
+                records.sort(key=lambda r: stored_value(r, "date") or "", reverse=True)
+                yield from (Patient.from_dict(r) for r in records)
+        return read_all()
+
+# ---------- VITALS ANALYTICS ----------
+VITAL_BIN_WIDTHS = {"weight": 10, "systolic_bp": 10, "diastolic_bp": 10, "pulse_rate": 10}
+BP_CATEGORIES = ("Normal", "Elevated", "Stage 1", "Stage 2")
+_NAN = float("nan")
+
+def bp_category(systolic, diastolic):
+    """The ACC/AHA blood pressure category of one reading, or None if either value is missing."""
+    if systolic != systolic or diastolic != diastolic:
+        return None
+    if systolic >= 140 or diastolic >= 90:
+        return "Stage 2"
+    if systolic >= 130 or diastolic >= 80:
+        return "Stage 1"
+    return "Elevated" if systolic >= 120 else "Normal"
+
+def _vital_number(value):
+    if type(value) in (int, float):
+        return float(value)
+    try:
+        return float(value) if value else _NAN
+    except (TypeError, ValueError):
+        return _NAN
+
+def _day_number(date):
+    """Ordinal of a "YYYY-MM-DD" date; 0 if it is not one."""
+    try:
+        return datetime(int(date[:4]), int(date[5:7]), int(date[8:10])).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+class VitalsColumns:
+    """
+    The vitals of every visit as typed columns, sorted by visit day: day ordinal,
+    patient slot, and one float column per VITAL_FIELDS entry holding NaN where nothing
+    was recorded. Reports bisect out a date range and reduce the column slices with
+    plain loops, so no record dict is touched or string parsed per report. Bulk loading
+    appends unsorted; the columns are sorted once, on first use.
+    """
+    FIELDS = tuple(VITAL_FIELDS)
+    ROW_BYTES = 4 + 4 + 8 * len(FIELDS)
+
+    def __init__(self):
+        self.days = array("i")
+        self.patients = array("i")
+        self.columns = {field: array("d") for field in self.FIELDS}
+        self.slot_of = {}
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.days)
+
+    def _slot(self, patient_id):
+        slot = self.slot_of.get(patient_id)
+        if slot is None:
+            slot = self.slot_of[patient_id] = len(self.slot_of)
+        return slot
+
+    def _arrays(self):
+        return (self.days, self.patients) + tuple(self.columns[field] for field in self.FIELDS)
+
+    def _set_arrays(self, arrays):
+        self.days, self.patients = arrays[0], arrays[1]
+        self.columns = dict(zip(self.FIELDS, arrays[2:]))
+
+    def _row(self, patient_id, visit):
+        return [_day_number(visit.get("date")), self._slot(patient_id)] + [_vital_number(visit.get(f)) for f in self.FIELDS]
+
+    def extend(self, patients):
+        """Appends the visits of patients without keeping the date order (bulk loading)."""
+        self.extend_visits((patient.id, visit) for patient in patients for visit in patient.visits)
+
+    def extend_visits(self, visits):
+        """Appends (patient id, visit) pairs without keeping the date order."""
+        arrays = self._arrays()
+        for patient_id, visit in visits:
+            for column, value in zip(arrays, self._row(patient_id, visit)):
+                column.append(value)
+        self.sorted = False
+
+    def add(self, patient_id, visits):
+        self._sort()
+        arrays = self._arrays()
+        for visit in visits:
+            row = self._row(patient_id, visit)
+            i = bisect_right(self.days, row[0])
+            for column, value in zip(arrays, row):
+                column.insert(i, value)
+
+    def remove(self, patient_id, visits=None):
+        """Removes the patient's rows: one per visit in visits, or all of them."""
+        slot = self.slot_of.get(patient_id)
+        if slot is None:
+            return
+        self._sort()
+        if visits is None:
+            rows = [i for i, s in enumerate(self.patients) if s == slot]
+        else:
+            rows = set()
+            for visit in visits:
+                day = _day_number(visit.get("date"))
+                for i in range(bisect_left(self.days, day), bisect_right(self.days, day)):
+                    if self.patients[i] == slot and i not in rows:
+                        rows.add(i)
+                        break
+        arrays = self._arrays()
+        for i in sorted(rows, reverse=True):
+            for column in arrays:
+                del column[i]
+
+    def drop(self, patient_ids):
+        """Removes every row of patient_ids in one pass."""
+        slots = {self.slot_of[pid] for pid in patient_ids if pid in self.slot_of}
+        if slots:
+            keep = [s not in slots for s in self.patients]
+            self._set_arrays([array(a.typecode, compress(a, keep)) for a in self._arrays()])
+
+    def extend_columns(self, other, ids, live):
+        """Appends other's rows, whose patient slots index ids, for the ids where live is true."""
+        keep = [live[p] for p in other.patients]
+        slots = [self._slot(pid) if alive else -1 for pid, alive in zip(ids, live)]
+        for column, source in zip(self._arrays(), other._arrays()):
+            if source is other.patients:
+                column.extend(map(slots.__getitem__, compress(source, keep)))
+            else:
+                column.extend(compress(source, keep))
+        self.sorted = False
+
+    def _sort(self):
+        if self.sorted:
+            return
+        order = sorted(range(len(self.days)), key=self.days.__getitem__)
+        self._set_arrays([array(a.typecode, map(a.__getitem__, order)) for a in self._arrays()])
+        self.sorted = True
+
+    def to_bytes(self):
+        self._sort()
+        return b"".join(a.tobytes() for a in self._arrays())
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Columns written by to_bytes(); the patient column keeps the writer's slots."""
+        columns = cls()
+        n = len(data) // cls.ROW_BYTES
+        offset = 0
+        for a in columns._arrays():
+            size = n * a.itemsize
+            a.frombytes(data[offset:offset + size])
+            offset += size
+        return columns
+
+    def _bounds(self, start=None, end=None):
+        self._sort()
+        lo = bisect_left(self.days, _day_number(start)) if start else 0
+        hi = bisect_right(self.days, _day_number(end)) if end else len(self.days)
+        return lo, hi
+
+    def distribution(self, field, start=None, end=None):
+        """
+        count, mean, min, p25, median, p75, max and histogram [(bin low, count)] of the
+        recorded values of field on visits dated start..end. Empty bins are left out.
+        """
+        lo, hi = self._bounds(start, end)
+        values = sorted(v for v in self.columns[field][lo:hi] if v == v)
+        n = len(values)
+        if not n:
+            return {"count": 0, "histogram": []}
+        width = VITAL_BIN_WIDTHS[field]
+        histogram = []
+        i = 0
+        while i < n:
+            low = values[i] // width * width
+            j = bisect_left(values, low + width, i)
+            histogram.append((low, j - i))
+            i = j
+        quantile = lambda q: values[int(q * (n - 1))]
+        return {"count": n, "mean": sum(values) / n, "min": values[0], "p25": quantile(0.25),
+                "median": quantile(0.5), "p75": quantile(0.75), "max": values[-1], "histogram": histogram}
+
+    def hypertension(self, start=None, end=None):
+        """
+        Visits dated start..end per BP_CATEGORIES entry (plus "Not recorded"), and the
+        number of patients with at least one Stage 1 or Stage 2 reading.
+        """
+        lo, hi = self._bounds(start, end)
+        categories = list(map(bp_category, self.columns["systolic_bp"][lo:hi], self.columns["diastolic_bp"][lo:hi]))
+        counts = Counter(categories)
+        visits = {category: counts.get(category, 0) for category in BP_CATEGORIES}
+        visits["Not recorded"] = counts.get(None, 0)
+        raised = {"Stage 1", "Stage 2"}
+        patients = len({slot for slot, category in zip(self.patients[lo:hi], categories) if category in raised})
+        return {"visits": visits, "patients": patients}
+
+def vital_trends(visits):
+    """
+    For each vital with at least two readings among visits: first and last value, the
+    change and the least-squares slope per 30 days, as {field: dict}.
+    """
+    visits = sorted(visits, key=lambda v: v.get("date", "") or "")
+    trends = {}
+    for field in VITAL_FIELDS:
+        points = [(_day_number(v.get("date")), _vital_number(v.get(field))) for v in visits]
+        points = [(day, value) for day, value in points if day and value == value]
+        if len(points) < 2:
+            continue
+        n = len(points)
+        mean_day = sum(day for day, _ in points) / n
+        mean_value = sum(value for _, value in points) / n
+        spread = sum((day - mean_day) ** 2 for day, _ in points)
+        slope = sum((day - mean_day) * (value - mean_value) for day, value in points) / spread if spread else 0.0
+        trends[field] = {"readings": n, "first": points[0][1], "last": points[-1][1],
+                         "change": points[-1][1] - points[0][1], "per_30_days": slope * 30}
+    return trends
+
+def vitals_report(vitals, start=None, end=None):
+    """Plain-text report of vitals for visits dated start..end: BP categories and distributions."""
+    hypertension = vitals.hypertension(start, end)
+    lines = ["Blood pressure (visits)"]
+    for category, count in hypertension["visits"].items():
+        lines.append(f"  {category:<16}{count:>8}")
+    lines.append(f"  Patients with Stage 1 or 2 reading: {hypertension['patients']}")
+    labels = {spec.key: spec.label.rstrip(":") for spec in PATIENT_FORM_SCHEMA}
+    for field in VitalsColumns.FIELDS:
+        row = vitals.distribution(field, start, end)
+        lines += ["", f"{labels[field]} ({row['count']} readings)"]
+        if not row["count"]:
+            continue
+        lines.append(f"  mean {row['mean']:.1f}  min {row['min']:g}  p25 {row['p25']:g}  "
+                     f"median {row['median']:g}  p75 {row['p75']:g}  max {row['max']:g}")
+        width = VITAL_BIN_WIDTHS[field]
+        for low, count in row["histogram"]:
+            lines.append(f"  {low:>6g}-{low + width:<6g}{count:>8}")
+    return "\n".join(lines)
+
+# ---------- PERSISTENCE WORKER ----------
+class PersistenceWorker:
+    """
+    Performs storage writes on a background thread. Everything submitted while a write
+    is running is coalesced into the next write(batch) call. The outcome is reported as
+    on_result(change_count, error) through call_soon. A failed batch is kept and retried
+    with the next submit() or flush().
+    """
+    def __init__(self, write, on_result=None, call_soon=call_now):
+        self.write = write
+        self.on_result = on_result
+        self.call_soon = call_soon
+        self._pending = []
+        self._busy = False
+        self._failed = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+        self._thread.start()
+
+    def submit(self, change):
+        self.submit_all((change,))
+
+    def submit_all(self, changes):
+        """Queues changes together, so they land in the same write(batch) call."""
+        with self._cond:
+            self._pending.extend(changes)
+            self._failed = False
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while (not self._pending or self._failed) and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and (not self._pending or self._failed):
+                    return
+                batch, self._pending = self._pending, []
+                self._busy = True
+            error = None
+            try:
+                self.write(batch)
+            except Exception as e:
+                error = e
+            with self._cond:
+                if error is not None:
+                    self._pending[:0] = batch
+                    self._failed = True
+                self._busy = False
+                self._cond.notify_all()
+            if self.on_result is not None:
+                self.call_soon(lambda n=len(batch), e=error: self.on_result(n, e))
+
+    def flush(self, timeout=None):
+        """Blocks until every submitted change is on disk. Returns False if a write failed."""
+        with self._cond:
+            if self._pending:
+                self._failed = False
+                self._cond.notify_all()
+            self._cond.wait_for(lambda: self._failed or (not self._pending and not self._busy), timeout)
+            return not self._pending and not self._busy
+
+    def stop(self):
+        self.flush()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+# ---------- PATIENT REPOSITORIES ----------
+class PatientRepository:
+    """
+    Storage interface used by the app. search() returns matching records newest first;
+    an empty search text matches every record. version is bumped on every write.
+    Loading is split so startup can run it off the UI thread: load_chunks() runs on the
+    loader thread, add_loaded() and finish_load() on the UI thread.
+    """
+    version = 0
+
+    def load(self):
+        for chunk in self.load_chunks():
+            self.add_loaded(chunk)
+        self.finish_load()
+    def load_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        raise NotImplementedError
+    def add_loaded(self, records):
+        pass
+    def finish_load(self):
+        pass
+    def read_summaries(self):
+        return None
+    def count(self):
+        raise NotImplementedError
+    def get(self, patient_id):
+        raise NotImplementedError
+    def fetch(self, patient_id, callback):
+        """
+        Calls callback with get(patient_id) on the UI thread. A record that has to be read
+        from disk first is read on another thread.
+        """
+        callback(self.get(patient_id))
+    def insert(self, record):
+        """Stores record under a newly allocated id and returns that id."""
+        raise NotImplementedError
+    def insert_many(self, records, merge_visits=False, same_patient=None):
+        """
+        Inserts records with a single storage write and returns their ids. With
+        merge_visits, a record matching an existing patient is added to it as a visit.
+        same_patient, if given, names for each record the patient it is another visit
+        of: a stored patient's id, the position of an earlier record in records, or None.
+        """
+        ids = []
+        for i, record in enumerate(records):
+            existing = self._visit_of(record, same_patient[i] if same_patient else None, ids, merge_visits)
+            ids.append(self.add_visit(existing.id, record) if existing else self.insert(record))
+        return ids
+    def _visit_of(self, record, same, ids, merge_visits):
+        """The patient insert_many() adds record to as a visit, or None for a new patient."""
+        if isinstance(same, int):
+            same = ids[same]
+        if same is not None:
+            return self.get(same)
+        return self.find_patient(record) if merge_visits else None
+    def find_patient(self, record):
+        """The stored patient with the same patient_key() as record, or None."""
+        raise NotImplementedError
+    def match_patient(self, record, callback):
+        """
+        Calls callback with find_patient(record) on the UI thread. Stored patients that
+        have to be read from disk first are looked for on another thread.
+        """
+        callback(self.find_patient(record))
+    def add_visit(self, patient_id, record):
+        """Adds the visit fields of record to the patient and returns patient_id."""
+        raise NotImplementedError
+    def visits(self, patient_id):
+        """Every visit of the patient, newest first."""
+        raise NotImplementedError
+    def delete(self, patient_id):
+        raise NotImplementedError
+    def search(self, field, text):
+        raise NotImplementedError
+    def fuzzy_search(self, text, limit=FUZZY_TOP_K):
+        """Up to limit patients whose names best match text by FuzzyNameIndex, best first."""
+        raise NotImplementedError
+    def cursor(self, field, text, matches=None):
+        """
+        A RecordCursor over the results of search(field, text). matches, if given, is a
+        narrowed copy of an earlier cursor's matches for the same query.
+        """
+        return ListCursor(self.search(field, text))
+    def date_range(self, start, end):
+        raise NotImplementedError
+    def appointments(self, start, end):
+        """Patients whose next appointment is dated start..end inclusive, soonest first."""
+        raise NotImplementedError
+    def vitals(self):
+        """The VitalsColumns of every visit, kept up to date by later writes."""
+        raise NotImplementedError
+    def flush(self):
+        return True
+    def visits_on(self, day):
+        return self.date_range(day, day)
+    def todays_visits(self):
+        return self.visits_on(datetime.now().strftime("%Y-%m-%d"))
+    def export_rows(self):
+        """
+        One flat record (EXPORT_FIELDS) per visit, newest patient first. The patients are
+        listed when this is called, on the UI thread; the returned iterator only builds
+        rows from that list, so it may be consumed on another thread.
+        """
+        return self._visit_rows(self.search("name", ""))
+    @staticmethod
+    def _visit_rows(patients):
+        for patient in patients:
+            profile = {key: patient.get(key, "") for key in ("id",) + PROFILE_FIELDS}
+            for visit in patient.visits:
+                yield dict(profile, **{key: visit.get(key, "") for key in VISIT_FIELDS})
+    def close(self):
+        pass
+
+class PatientSearchIndex:
+    """
+    Lowercased values and trigram postings for each searchable field. A query of three
+    or more characters only checks the records listed under its rarest trigram; shorter
+    queries scan the lowercased values. Removed records leave a tombstone until the
+    next rebuild.
+    """
+    GRAM = 3
+
+    def __init__(self, fields=tuple(SEARCH_FIELDS.values())):
+        self.fields = fields
+        self.clear()
+    def clear(self):
+        self.records = []
+        self.slots = {}
+        self.values = {f: [] for f in self.fields}
+        self.postings = {f: {} for f in self.fields}
+        self.removed = 0
+    def build(self, records):
+        self.clear()
+        for record in records:
+            self.add(record)
+    def add(self, record):
+        slot = len(self.records)
+        self.records.append(record)
+        self.slots[id(record)] = slot
+        n = self.GRAM
+        for f in self.fields:
+            value = str(record.get(f, "") or "").lower()
+            self.values[f].append(value)
+            postings = self.postings[f]
+            for gram in {value[i:i + n] for i in range(len(value) - n + 1)}:
+                slots = postings.get(gram)
+                if slots is None:
+                    slots = postings[gram] = array("i")
+                slots.append(slot)
+    def remove(self, record):
+        slot = self.slots.pop(id(record), None)
+        if slot is None:
+            return
+        self.records[slot] = None
+        for f in self.fields:
+            self.values[f][slot] = None
+        self.removed += 1
+        if self.removed > 1024 and self.removed * 2 > len(self.records):
+            self.build([r for r in self.records if r is not None])
+    def search(self, field, text):
+        """Records whose field contains text (case-insensitive), in insertion order."""
+        text = text.lower()
+        values = self.values[field]
+        n = self.GRAM
+        if len(text) < n:
+            candidates = range(len(values))
+        else:
+            postings = self.postings[field]
+            candidates = None
+            for i in range(len(text) - n + 1):
+                slots = postings.get(text[i:i + n])
+                if slots is None:
+                    return []
+                if candidates is None or len(slots) < len(candidates):
+                    candidates = slots
+        records = self.records
+        return [records[s] for s in candidates if values[s] is not None and text in values[s]]
+
+_SOUNDEX_CODES = {ch: str(digit) for digit, letters in enumerate(("", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"))
+                  for ch in letters}
+_VOWELS = frozenset("aeiouy")
+
+def name_tokens(name):
+    """Lowercase words of name with accents stripped and anything but letters dropped."""
+    folded = unicodedata.normalize("NFKD", str(name or "")).lower()
+    return "".join(ch if ch.isalpha() else " " for ch in folded if not unicodedata.combining(ch)).split()
+
+def phonetic_key(token):
+    """American Soundex of one lowercase token: first letter plus three consonant-class digits."""
+    code = ""
+    last = _SOUNDEX_CODES.get(token[0], "")
+    for ch in token[1:]:
+        if ch in "hw":
+            continue  # h and w do not separate letters of the same class
+        digit = _SOUNDEX_CODES.get(ch, "")
+        if digit and digit != last:
+            code += digit
+        last = digit
+    return (token[0].upper() + code + "000")[:4]
+
+def consonant_skeleton(token):
+    """First letter plus the later consonants, repeats collapsed: "mohammed" -> "mhmd"."""
+    skeleton = token[0]
+    for ch in token[1:]:
+        if ch not in _VOWELS and ch != skeleton[-1]:
+            skeleton += ch
+    return skeleton
+
+def _is_subsequence(short, long):
+    letters = iter(long)
+    return all(ch in letters for ch in short)
+
+def _bigrams(token):
+    return {token[i:i + 2] for i in range(len(token) - 1)} or {token}
+
+def token_similarity(query, name):
+    """
+    Similarity in 0..1 of a query token and a name token, each (token, phonetic key,
+    skeleton): exact, prefix, same sound, abbreviation ("mohd" for "mohammed"), or
+    else the bigram overlap.
+    """
+    if query[0] == name[0]:
+        return 1.0
+    if name[0].startswith(query[0]):
+        return 0.9
+    if query[1] == name[1]:
+        return 0.8
+    if query[2][0] == name[2][0] and _is_subsequence(query[2], name[2]):
+        return 0.75
+    a, b = _bigrams(query[0]), _bigrams(name[0])
+    return 0.7 * 2 * len(a & b) / (len(a) + len(b))
+
+class FuzzyNameIndex:
+    """
+    Precomputed (token, phonetic key, skeleton) tuples for every patient's name, keyed
+    by patient id, and postings from each token's phonetic key, first two letters and
+    first two skeleton letters to the ids using it. A query only scores the patients
+    sharing one of those keys with one of its tokens, once per distinct name, and keeps
+    the best with a heap instead of sorting every candidate.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.postings = {}
+        self.tokens = {}  # Token -> its shared key tuple; names repeat a lot
+        self.names = {}   # Name as entered -> its shared tuple of token keys
+
+    def _keys(self, token):
+        keys = self.tokens.get(token)
+        if keys is None:
+            token = sys.intern(token)
+            keys = self.tokens[token] = (token, phonetic_key(token), consonant_skeleton(token))
+        return keys
+
+    @staticmethod
+    def _postings_keys(tokens):
+        return {key for token, phonetic, skeleton in tokens
+                for key in (phonetic, "f" + token[:2], "s" + skeleton[:2])}
+
+    def name_keys(self, name):
+        """The postings keys add() files name under."""
+        return self._postings_keys([self._keys(token) for token in name_tokens(name)])
+
+    def add(self, patient_id, name, date=""):
+        self.remove(patient_id)
+        name = str(name or "")
+        tokens = self.names.get(name)
+        if tokens is None:
+            tokens = self.names[name] = tuple(self._keys(token) for token in name_tokens(name))
+        if not tokens:
+            return
+        self.entries[patient_id] = (tokens, date or "")
+        for key in self._postings_keys(tokens):
+            self.postings.setdefault(key, set()).add(patient_id)
+
+    def remove(self, patient_id):
+        entry = self.entries.pop(patient_id, None)
+        if entry is None:
+            return
+        for key in self._postings_keys(entry[0]):
+            ids = self.postings[key]
+            ids.discard(patient_id)
+            if not ids:
+                del self.postings[key]
+
+    def search(self, text, limit=FUZZY_TOP_K):
+        """Ids of the best limit matches scoring FUZZY_MIN_SCORE or more, best first; ties newest first."""
+        return [patient_id for _, _, patient_id in self.ranked(text, limit)]
+
+    def ranked(self, text, limit=FUZZY_TOP_K):
+        """search() as (score, date, id) rows, so the results of several indexes can be merged."""
+        query = [self._keys(token) for token in name_tokens(text)]
+        if not query:
+            return []
+        candidates = set()
+        for key in self._postings_keys(query):
+            candidates |= self.postings.get(key, set())
+        entries = self.entries
+        scores = {}  # id(shared token tuple) -> score
+        def scored():
+            for patient_id in candidates:
+                tokens, date = entries[patient_id]
+                score = scores.get(id(tokens))
+                if score is None:
+                    score = scores[id(tokens)] = sum(max(token_similarity(q, t) for t in tokens)
+                                                     for q in query) / len(query)
+                if score >= FUZZY_MIN_SCORE:
+                    yield score, date, patient_id
+        return heapq.nlargest(limit, scored(), key=lambda row: row[:2])
+
+class DateIndex:
+    """
+    Records kept sorted by (date, insertion order) with bisect, so the newest-first list
+    and date-range queries need no sort. Equal dates keep insertion order.
+    """
+    field = "date"
+
+    def __init__(self):
+        self.clear()
+    def clear(self):
+        self.keys = []
+        self.records = []
+        self.key_of = {}
+        self.counter = 0
+    def _key(self, record):
+        self.counter += 1
+        key = (str(record.get(self.field, "") or ""), -self.counter)
+        self.key_of[id(record)] = key
+        return key
+    def build(self, records):
+        self.clear()
+        self.extend(records)
+    def extend(self, records):
+        # One merge-sort of the combined runs instead of a list insert per record
+        pairs = list(zip(self.keys, self.records))
+        pairs.extend((self._key(r), r) for r in records)
+        pairs.sort(key=lambda pair: pair[0])
+        self.keys = [key for key, _ in pairs]
+        self.records = [r for _, r in pairs]
+    def add(self, record):
+        key = self._key(record)
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.records.insert(i, record)
+    def remove(self, record):
+        key = self.key_of.pop(id(record), None)
+        if key is None:
+            return
+        i = bisect_left(self.keys, key)
+        del self.keys[i]
+        del self.records[i]
+    def newest_first(self):
+        return self.records[::-1]
+    def between(self, start, end):
+        """Records dated start..end inclusive ("YYYY-MM-DD" strings), newest first."""
+        lo = bisect_left(self.keys, (start, -float("inf")))
+        hi = bisect_right(self.keys, (end, float("inf")))
+        return self.records[lo:hi][::-1]
+    def sort_newest_first(self, records):
+        key_of = self.key_of
+        return sorted(records, key=lambda r: key_of[id(r)], reverse=True)
+
+class AppointmentIndex(DateIndex):
+    """
+    Patients with a next appointment, ordered by its date. Only the latest visit's
+    appointment counts; dates saved as free text before they were validated are parsed
+    when indexed, and are never due if unreadable.
+    """
+    field = "next_appointment_date"
+
+    def _key(self, record):
+        self.counter += 1
+        value = str(record.get(self.field, "") or "")
+        # Saved dates are already ISO; only older free-text values need parsing
+        if not (len(value) == 10 and value[4] == value[7] == "-"):
+            value = parse_appointment_date(value) or ""
+        key = (value, self.counter)
+        self.key_of[id(record)] = key
+        return key
+    def extend(self, records):
+        super().extend(r for r in records if r.get(self.field))
+    def add(self, record):
+        if record.get(self.field):
+            super().add(record)
+    def due(self, start, end):
+        """Patients with an appointment dated start..end inclusive, soonest first."""
+        lo = bisect_left(self.keys, (start, -float("inf")))
+        hi = bisect_right(self.keys, (end, float("inf")))
+        return self.records[lo:hi]
+
+class RecordCursor:
+    """
+    Pages through one query's results, newest first. total is known when the cursor is
+    opened; fetch() returns the next page, or [] once exhausted. A cursor is only valid
+    until the next repository write, except that DateIndexCursor and MatchCursor keep
+    their place: later pages skip deleted records (a DateIndexCursor also includes older
+    inserted ones), and total is corrected as they are fetched. matches, when set, holds
+    every matching record (unordered) so IncrementalSearch can narrow it for a longer
+    query. pending counts the archive scans that may still add to total; on_ready, if
+    set, is called with the cursor on the UI thread each time one finishes.
+    """
+    total = 0
+    matches = None
+    pending = 0
+    on_ready = None
+
+    def __init__(self):
+        self.fetched = 0
+    @property
+    def exhausted(self):
+        return self.fetched >= self.total
+    def fetch(self, limit=RECORDS_PAGE_SIZE):
+        page = [] if self.exhausted else self._fetch(limit)
+        self.fetched += len(page)
+        return page
+    def _fetch(self, limit):
+        raise NotImplementedError
+
+class ListCursor(RecordCursor):
+    """Pages over a list that is already in display order."""
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+        self.total = len(records)
+    def _fetch(self, limit):
+        return self.records[self.fetched:self.fetched + limit]
+
+class DateIndexCursor(RecordCursor):
+    """Walks a DateIndex backwards from the newest record, optionally within start..end."""
+    def __init__(self, dates, start=None, end=None):
+        super().__init__()
+        self.dates = dates
+        self.low = (start, -float("inf")) if start is not None else None
+        self.before = (end, float("inf")) if end is not None else None
+        self.total = self._high() - self._low()
+    def _low(self):
+        return bisect_left(self.dates.keys, self.low) if self.low is not None else 0
+    def _high(self):
+        return bisect_left(self.dates.keys, self.before) if self.before is not None else len(self.dates.keys)
+    @property
+    def exhausted(self):
+        return self._high() <= self._low()
+    def _fetch(self, limit):
+        high = self._high()
+        self.total = self.fetched + high - self._low()
+        low = max(self._low(), high - limit)
+        if low >= high:
+            return []
+        self.before = self.dates.keys[low]
+        return self.dates.records[low:high][::-1]
+
+class MatchCursor(RecordCursor):
+    """
+    Pages through an unordered list of matches. Each page is the newest limit matches
+    older than the previous page, picked with a heap instead of sorting every match.
+    """
+    def __init__(self, matches, key_of):
+        super().__init__()
+        self.matches = matches
+        self.key_of = key_of
+        self.total = len(matches)
+        self.before = None
+    def _fetch(self, limit):
+        key_of = self.key_of
+        before = self.before
+        # Matches deleted since the cursor was opened have left key_of
+        candidates = [r for r in self.matches if id(r) in key_of and (before is None or key_of[id(r)] < before)]
+        self.total = self.fetched + len(candidates)
+        page = heapq.nlargest(limit, candidates, key=lambda r: key_of[id(r)])
+        if page:
+            self.before = key_of[id(page[-1])]
+        return page
+
+class SQLiteCursor(RecordCursor):
+    """Keyset pagination: each page continues after the (date, rowid) of the previous one."""
+    def __init__(self, conn, where="", params=()):
+        super().__init__()
+        self.conn = conn
+        self.where = where
+        self.params = params
+        self.total = conn.execute(f"SELECT COUNT(*) FROM patients{where}", params).fetchone()[0]
+        self.after = None
+    def _fetch(self, limit):
+        where, params = self.where, self.params
+        if self.after is not None:
+            where += (" AND" if where else " WHERE") + " (date < ? OR (date = ? AND rowid > ?))"
+            params = params + (self.after[0], self.after[0], self.after[1])
+        rows = self.conn.execute(f"SELECT rowid AS row_position, * FROM patients{where} "
+                                 "ORDER BY date DESC, rowid LIMIT ?", params + (limit,)).fetchall()
+        if rows:
+            self.after = (rows[-1]["date"], rows[-1]["row_position"])
+        return [Patient.from_row(row) for row in rows]
+
+class TieredCursor(RecordCursor):
+    """
+    Pages through the hot cursor, then the archived matches returned by jobs: functions
+    that each list patients newest first, typically one PatientArchive segment scan. A
+    job runs on a background thread when a fetch() runs out of matches, so that page is
+    short; its result is added on the UI thread through call_soon, growing total, and
+    on_ready then lets the list fetch again. matches are the hot cursor's.
+    """
+    def __init__(self, hot, jobs, call_soon=call_now):
+        super().__init__()
+        self.hot = hot
+        self.jobs = list(jobs)
+        self.call_soon = call_soon
+        self.matches = hot.matches
+        self.total = hot.total
+        self.cold = []
+        self.scanning = False
+    @property
+    def pending(self):
+        return len(self.jobs)
+    @property
+    def exhausted(self):
+        return self.fetched >= self.total and not self.jobs
+    def _fetch(self, limit):
+        page = self.hot.fetch(limit)
+        take = limit - len(page)
+        page += self.cold[:take]
+        del self.cold[:take]
+        if len(page) < limit:
+            self._scan()
+        return page
+    def _scan(self):
+        if self.scanning or not self.jobs:
+            return
+        self.scanning = True
+        job = self.jobs[0]
+        def run():
+            try:
+                found = job()
+            except (OSError, ValueError):
+                found = []  # An unreadable segment lists nothing rather than stalling the cursor
+            self.call_soon(lambda: self._scanned(found))
+        threading.Thread(target=run, name="archive-scan", daemon=True).start()
+    def _scanned(self, found):
+        self.jobs.pop(0)
+        self.scanning = False
+        self.cold.extend(found)
+        self.total += len(found)
+        if self.on_ready is not None:
+            self.on_ready(self)
+
+def search_indexes(index, dates, field, text):
+    """search(field, text) over a PatientSearchIndex and a DateIndex of the same records."""
+    date_range = parse_date_range(text) if field == "date" else None
+    if date_range:
+        return dates.between(*date_range)
+    if text and field in SEARCH_FIELDS:
+        with perf.timer("records.filter"):
+            matches = index.search(SEARCH_FIELDS[field], text)
+        with perf.timer("records.sort"):
+            return dates.sort_newest_first(matches)
+    with perf.timer("records.sort"):
+        return dates.newest_first()
+
+def index_cursor(index, dates, field, text, matches=None):
+    """
+    A cursor over search_indexes(index, dates, field, text). matches, if given, is a
+    narrowed copy of an earlier cursor's matches for the same query.
+    """
+    date_range = parse_date_range(text) if field == "date" else None
+    if date_range:
+        return DateIndexCursor(dates, *date_range)
+    if text and field in SEARCH_FIELDS:
+        if matches is None:
+            with perf.timer("records.filter"):
+                matches = index.search(SEARCH_FIELDS[field], text)
+        return MatchCursor(matches, dates.key_of)
+    return DateIndexCursor(dates)
+
+def parse_date_range(text):
+    """
+    Date search shortcuts: "today" or "YYYY-MM-DD..YYYY-MM-DD" (either end may be left
+    open). Returns (start, end) or None for a plain substring query.
+    """
+    text = text.strip().lower()
+    if text == "today":
+        today = datetime.now().strftime("%Y-%m-%d")
+        return today, today
+    if ".." in text:
+        start, _, end = text.partition("..")
+        return start.strip(), end.strip() or "9999-12-31"
+    return None
+
+class JsonPatientRepository(PatientRepository):
+    """
+    Keeps the hot records in memory, keyed by id, and persists through the patients.json
+    journal/snapshot. Patients not seen for archive_after_days (None: never) move to the
+    PatientArchive at startup; searches page through the hot records before the archive,
+    and a new visit brings an archived patient back. Archived patients are only read
+    when a search, find_patient() or get() asks for them; cursors and match_patient()
+    read them on another thread.
+    """
+    def __init__(self, journaled=True, journal=None, on_persisted=None, archive=None, call_soon=call_now,
+                 archive_after_days=ARCHIVE_AFTER_DAYS):
+        self.journaled = journaled
+        self.journal = journal if journal is not None else PatientJournal()
+        self.archive = archive if archive is not None else PatientArchive()
+        self.archive_after_days = archive_after_days
+        self.call_soon = call_soon
+        self.worker = PersistenceWorker(self._write_batch, on_persisted, call_soon)
+        self.patients = {}
+        self.by_key = {}  # patient_key() -> id of the newest patient with that key
+        self.next_id = 1
+        self.repaired_ids = 0
+        self.merged_patients = 0
+        self.archived = 0
+        self.restored_ids = []
+        self._staged = None
+        self.index = PatientSearchIndex()
+        self.dates = DateIndex()
+        self.appointment_dates = AppointmentIndex()
+        self.vital_columns = VitalsColumns()
+        self.fuzzy = FuzzyNameIndex()
+    def load_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        records = self.journal.load()
+        self.repaired_ids, self.next_id = repair_duplicate_ids(records, self.journal.next_id)
+        self.merged_patients = 0
+        if self.journal.format < SNAPSHOT_FORMAT:
+            # One-time migration: repeat visits used to be saved as separate patients. Later
+            # patients sharing a key were registered separately on purpose and stay apart.
+            self.merged_patients = merge_duplicate_patients(records)
+        records = self._archive_cold(records)
+        for i in range(0, len(records), chunk_size):
+            yield [Patient.from_dict(r) for r in records[i:i + chunk_size]]
+    def add_loaded(self, records):
+        self.version += 1
+        for record in records:
+            self._add(record)
+        self.dates.extend(records)
+        self.appointment_dates.extend(records)
+        self.vital_columns.extend(records)
+    def _archive_cold(self, records):
+        """
+        Returns the hot records, after writing the cold ones to new archive segments. It
+        runs on the loader thread, so the archive and its vitals are built apart from the
+        ones in use; finish_load() installs them on the UI thread.
+        """
+        archive = PatientArchive(self.archive.directory)
+        archive.load()
+        # A patient both hot and archived was restored just before a crash; the hot copy wins
+        self.restored_ids = [r["id"] for r in records if r.get("id") in archive]
+        for patient_id in self.restored_ids:
+            archive.remove(patient_id)
+        self.archived = 0
+        if self.archive_after_days is not None:
+            cutoff = (datetime.now() - timedelta(days=self.archive_after_days)).strftime("%Y-%m-%d")
+            cold = [r for r in records if "" < (stored_value(r, "date") or "") < cutoff]
+            if len(cold) >= ARCHIVE_MIN_PATIENTS:
+                with perf.timer("storage.archive"):
+                    archive.add(cold)
+                self.archived = len(cold)
+                cold_ids = {r["id"] for r in cold}
+                records = [r for r in records if r["id"] not in cold_ids]
+        vitals = VitalsColumns()
+        archive.load_vitals(vitals)
+        self._staged = (archive, vitals)
+        return records
+    def finish_load(self):
+        if self._staged is not None:
+            self.version += 1
+            self.archive, vitals = self._staged
+            self._staged = None
+            # Slots were handed out in slot_of order, so its keys are the ids by slot
+            self.vital_columns.extend_columns(vitals, list(vitals.slot_of), [True] * len(vitals.slot_of))
+        # Re-keyed, merged and archived records only change in memory until a snapshot is written.
+        # The snapshot also records SNAPSHOT_FORMAT, so the duplicate merge never runs again.
+        changes = []
+        if (self.repaired_ids or self.merged_patients or self.archived or self.journal.needs_compaction()
+                or self.journal.format < SNAPSHOT_FORMAT or not os.path.exists(self.journal.snapshot_path)):
+            changes.append(self.journal.snapshot_change(self.patients.values(), self.next_id))
+        if self.restored_ids or self.archive.upgraded:
+            changes.append(("manifest", self.archive.manifest()))
+        if changes:
+            self.worker.submit_all(changes)
+    def read_summaries(self):
+        return self.journal.load_summaries()
+    def _write_batch(self, changes):
+        # The manifest goes last, so a crash part way leaves a patient hot rather than lost
+        manifests = [change[1] for change in changes if change[0] == "manifest"]
+        self.journal.write_batch([change for change in changes if change[0] != "manifest"])
+        if manifests:
+            self.archive.write_manifest(manifests[-1])
+    def _persist(self, *changes):
+        if self.journaled:
+            self.worker.submit_all(changes)
+        if not self.journaled or self.journal.needs_compaction():
+            self.worker.submit(self.journal.snapshot_change(self.patients.values(), self.next_id))
+        if not self.journaled:
+            self.worker.submit_all([change for change in changes if change[0] == "manifest"])
+    def count(self):
+        return len(self.patients) + self.archive.count()
+    def get(self, patient_id):
+        patient = self.patients.get(patient_id)
+        return patient if patient is not None else self.archive.find(patient_id)
+    def fetch(self, patient_id, callback):
+        if patient_id not in self.archive:
+            callback(self.patients.get(patient_id))
+            return
+        def fetched(patient):
+            # Restored or deleted while it was read: the current state wins
+            self.call_soon(lambda: callback(self.patients.get(patient_id)
+                                            or (patient if patient_id in self.archive else None)))
+        self.archive.fetch(patient_id, fetched)
+    def _add(self, record):
+        self.patients[record.id] = record
+        self.index.add(record)
+        self.fuzzy.add(record.id, record.get("name"), record.get("date"))
+        key = patient_key(record)
+        if key is not None:
+            self.by_key[key] = record.id
+    def _dated(self, record):
+        self.dates.add(record)
+        self.appointment_dates.add(record)
+        self.vital_columns.add(record.id, record.visits)
+    def _remove(self, record):
+        self.index.remove(record)
+        self.fuzzy.remove(record.id)
+        self.dates.remove(record)
+        self.appointment_dates.remove(record)
+        self.vital_columns.remove(record.id, record.visits)
+        key = patient_key(record)
+        if key is not None and self.by_key.get(key) == record.id:
+            del self.by_key[key]
+    def _new_patient(self, record):
+        patient = Patient.from_dict(dict(record, id=str(self.next_id)))
+        self.next_id += 1
+        self._add(patient)
+        return patient
+    def _restore(self, patient):
+        """Moves an archived patient back to the hot set and returns the changes recording it."""
+        self.vital_columns.drop([patient.id])
+        self._add(patient)
+        self._dated(patient)
+        return [self.journal.insert_change(patient), self.archive.remove(patient.id)]
+    def _visited(self, patient, record):
+        """Replaces patient by a copy with the visit in record added."""
+        self._remove(patient)
+        patient = Patient.from_dict(merge_visit(patient.to_dict(), record))
+        self._add(patient)
+        return patient
+    def insert(self, record):
+        self.version += 1
+        record = self._new_patient(record)
+        self._dated(record)
+        self._persist(self.journal.insert_change(record))
+        return record.id
+    def insert_many(self, records, merge_visits=False, same_patient=None):
+        self.version += 1
+        added, changes, ids = [], [], []
+        for i, record in enumerate(records):
+            existing = self._visit_of(record, same_patient[i] if same_patient else None, ids, merge_visits)
+            if existing is None:
+                patient = self._new_patient(record)
+                added.append(patient)
+                changes.append(self.journal.insert_change(patient))
+            else:
+                if existing.id not in self.patients:
+                    changes += self._restore(existing)
+                patient = self._visited(existing, record)
+                if existing in added:
+                    added[added.index(existing)] = patient
+                else:
+                    self._dated(patient)
+                changes.append(self.journal.visit_change(patient.id, record))
+            ids.append(patient.id)
+        self.dates.extend(added)
+        self.appointment_dates.extend(added)
+        self.vital_columns.extend(added)
+        self._persist(*changes)
+        return ids
+    def find_patient(self, record):
+        key = patient_key(record)
+        patient = self.patients.get(self.by_key.get(key))
+        return patient if patient is not None else self.archive.find_key(key)
+    def match_patient(self, record, callback):
+        key = patient_key(record)
+        patient = self.patients.get(self.by_key.get(key))
+        if patient is not None or not self.archive.may_hold_key(key):
+            callback(patient)
+            return
+        def found(archived):
+            # Restored, deleted or registered while the segments were read: the current state wins
+            self.call_soon(lambda: callback(self.patients.get(self.by_key.get(key))
+                                            or (archived if archived is not None and archived.id in self.archive
+                                                else None)))
+        self.archive.fetch_key(key, found)
+    def add_visit(self, patient_id, record):
+        patient = self.patients.get(patient_id)
+        changes = []
+        if patient is None:
+            patient = self.archive.find(patient_id)
+            if patient is None:
+                return None
+            changes = self._restore(patient)
+        self.version += 1
+        self._dated(self._visited(patient, record))
+        self._persist(*changes, self.journal.visit_change(patient_id, record))
+        return patient_id
+    def visits(self, patient_id):
+        patient = self.get(patient_id)
+        return patient.visits[::-1] if patient is not None else []
+    def delete(self, patient_id):
+        record = self.patients.pop(patient_id, None)
+        if record is None:
+            if patient_id in self.archive:
+                self.version += 1
+                self.vital_columns.drop([patient_id])
+                self._persist(self.archive.remove(patient_id))
+            return
+        self.version += 1
+        self._remove(record)
+        self._persist(self.journal.delete_change(patient_id))
+    def search(self, field, text):
+        if field == FUZZY_NAME_FIELD and text.strip():
+            return self.fuzzy_search(text)
+        return search_indexes(self.index, self.dates, field, text) + self.archive.search(field, text)
+    def fuzzy_search(self, text, limit=FUZZY_TOP_K):
+        with perf.timer("records.fuzzy"):
+            hot = [(score, date, self.patients[pid]) for score, date, pid in self.fuzzy.ranked(text, limit)]
+            # Both tiers rank by (score, date), so the best of their top lists are the overall best
+            rows = heapq.nlargest(limit, chain(hot, self.archive.fuzzy_ranked(text, limit)), key=lambda row: row[:2])
+        return [patient for _, _, patient in rows]
+    def cursor(self, field, text, matches=None):
+        # Archived matches follow the hot ones; the segments are scanned as paging reaches them
+        if field == FUZZY_NAME_FIELD and text.strip():
+            with perf.timer("records.fuzzy"):
+                cursor = ListCursor([self.patients[pid] for pid in self.fuzzy.search(text)])
+            jobs = self.archive.fuzzy_jobs(text)
+        else:
+            cursor = index_cursor(self.index, self.dates, field, text, matches)
+            jobs = self.archive.search_jobs(field, text)
+        return TieredCursor(cursor, jobs, self.call_soon) if jobs else cursor
+    def date_range(self, start, end):
+        return self.dates.between(start, end)
+    def appointments(self, start, end):
+        # Archived patients were last seen years ago, so none of them are due
+        return self.appointment_dates.due(start, end)
+    def vitals(self):
+        return self.vital_columns
+    def export_rows(self):
+        # Records are replaced, never changed, so the listed ones stay as they are now;
+        # archived patients are read from their segments by the consuming thread
+        return chain(self._visit_rows(self.dates.newest_first()),
+                     self._visit_rows(self.archive.patients_newest_first()))
+    def flush(self):
+        return self.worker.flush()
+    def close(self):
+        self.worker.stop()
+        self.journal.close()
+
+class SQLitePatientRepository(PatientRepository):
+    """
+    Stores one row per patient in SQLite with indexes on the searchable columns, so
+    filtering and newest-first ordering run inside the database. Every visit is a row
+    of the visits table; the patient row repeats only the latest one, for listing.
+    """
+    SCHEMA_VERSION = 4
+    INDEXED_FIELDS = ("name", "date", "mobile_no", "diseases", "next_appointment_date")
+
+    def __init__(self, path=SQLITE_FILE, journal=None):
+        self.path = path
+        self.journal = journal if journal is not None else PatientJournal()
+        self.conn = None
+        self.next_id = 1
+        self.vital_columns = None  # Read from the visits table on the first report
+        self.fuzzy = None  # Built from the patients table on the first fuzzy search
+    def load_chunks(self, chunk_size=LOAD_CHUNK_SIZE):
+        # Nothing is held in memory; opening (and migrating) is the whole load.
+        # The loader thread opens the connection, the UI thread uses it afterwards.
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            # WAL commits append to the log instead of rewriting pages, keeping writes short
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{f} TEXT NOT NULL DEFAULT ''" for f in PATIENT_FIELDS)
+        visit_columns = ", ".join(f"{f} TEXT NOT NULL DEFAULT ''" for f in VISIT_FIELDS)
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS patients (id TEXT, {columns}, "
+                              "visit_count INTEGER NOT NULL DEFAULT 1)")
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS visits (patient_id TEXT NOT NULL, {visit_columns})")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_visits_patient ON visits(patient_id, date)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            for f in self.INDEXED_FIELDS:
+                collate = "" if f.endswith("date") else " COLLATE NOCASE"
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_patients_{f} ON patients({f}{collate})")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self.migrate_from_json()
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 2:
+            self.repair_ids()
+        if version < 3:
+            self.migrate_visits()
+        if version < 4:
+            self.migrate_appointments()
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        self.next_id = int(row[0])
+        return iter(())
+    def migrate_from_json(self):
+        """
+        One-shot import of an existing patients.json (plus journal) into the database.
+        A store already in SNAPSHOT_FORMAT has its duplicates merged, so it skips the
+        id repair and visit migrations; patients it keeps apart must stay apart.
+        """
+        patients = self.journal.load()
+        _, next_id = repair_duplicate_ids(patients, self.journal.next_id)
+        current = self.journal.format >= SNAPSHOT_FORMAT
+        with self.conn:
+            for record in patients:
+                self._insert_patient(Patient.from_dict(record))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('next_id', ?)", (str(next_id),))
+            if current:
+                self.conn.execute("DROP INDEX IF EXISTS idx_patients_id")
+                self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_id_unique ON patients(id)")
+            self.conn.execute(f"PRAGMA user_version = {3 if current else 1}")
+    def repair_ids(self):
+        """Re-keys duplicate ids left by the old count-based allocator and makes id unique."""
+        rows = [{"rowid": rowid, "id": patient_id} for rowid, patient_id
+                in self.conn.execute("SELECT rowid, id FROM patients ORDER BY rowid")]
+        original = [row["id"] for row in rows]
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        _, next_id = repair_duplicate_ids(rows, int(row[0]) if row else 1)
+        with self.conn:
+            self.conn.executemany("UPDATE patients SET id = ? WHERE rowid = ?",
+                                  [(r["id"], r["rowid"]) for r, old in zip(rows, original) if r["id"] != old])
+            self.conn.execute("DROP INDEX IF EXISTS idx_patients_id")
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_patients_id_unique ON patients(id)")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('next_id', ?)", (str(next_id),))
+            self.conn.execute("PRAGMA user_version = 2")
+    def migrate_visits(self):
+        """
+        Moves each patient row's visit into the visits table, then merges patients saved
+        again for a repeat visit (same patient_key()) into the first of them.
+        """
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(patients)")]
+        visit_keys = ", ".join(VISIT_FIELDS)
+        rows = [dict(row) for row in self.conn.execute("SELECT * FROM patients ORDER BY rowid")]
+        survivors = list(rows)
+        merge_duplicate_patients(survivors)
+        kept = {patient_key(r): r for r in survivors}
+        kept_ids = {r["id"] for r in survivors}
+        with self.conn:
+            if "visit_count" not in columns:
+                self.conn.execute("ALTER TABLE patients ADD COLUMN visit_count INTEGER NOT NULL DEFAULT 1")
+            self.conn.execute(f"INSERT INTO visits (patient_id, {visit_keys}) SELECT id, {visit_keys} "
+                              "FROM patients WHERE id NOT IN (SELECT patient_id FROM visits)")
+            merged_into = set()
+            for row in rows:
+                if row["id"] in kept_ids:
+                    continue
+                target = kept[patient_key(row)]
+                self.conn.execute("UPDATE visits SET patient_id = ? WHERE patient_id = ?", (target["id"], row["id"]))
+                self.conn.execute("DELETE FROM patients WHERE id = ?", (row["id"],))
+                merged_into.add(target["id"])
+            for target in survivors:
+                if target["id"] in merged_into:
+                    self.conn.execute(f"UPDATE patients SET {', '.join(f'{k} = ?' for k in PROFILE_FIELDS)} "
+                                      "WHERE id = ?", [target.get(k, "") for k in PROFILE_FIELDS] + [target["id"]])
+                    self._refresh_patient(target["id"])
+            self.conn.execute("PRAGMA user_version = 3")
+    def migrate_appointments(self):
+        """Rewrites appointment dates saved as free text as "YYYY-MM-DD", so they can be ranged over."""
+        with self.conn:
+            for table in ("patients", "visits"):
+                rows = self.conn.execute(f"SELECT rowid, next_appointment_date FROM {table} "
+                                         "WHERE next_appointment_date != ''").fetchall()
+                parsed = [(parse_appointment_date(value), rowid) for rowid, value in rows]
+                self.conn.executemany(f"UPDATE {table} SET next_appointment_date = ? WHERE rowid = ?",
+                                      [(value, rowid) for (value, rowid), row in zip(parsed, rows)
+                                       if value and value != row[1]])
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    def _insert_sql(self):
+        keys = ("id",) + PATIENT_FIELDS + ("visit_count",)
+        return f"INSERT INTO patients ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})"
+    def _row(self, record, visit_count=1):
+        return [str(record.get("id", ""))] + [str(record.get(f, "") or "") for f in PATIENT_FIELDS] + [visit_count]
+    def _visit_sql(self):
+        keys = ("patient_id",) + VISIT_FIELDS
+        return f"INSERT INTO visits ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})"
+    def _insert_patient(self, record):
+        """Inserts a flat record as a one-visit patient, or a Patient with all its visits."""
+        visits = record.visits if isinstance(record, Patient) else [record]
+        self.conn.execute(self._insert_sql(), self._row(record, len(visits)))
+        self.conn.executemany(self._visit_sql(), [[str(record.get("id", ""))] + [str(v.get(f, "") or "")
+                                                  for f in VISIT_FIELDS] for v in visits])
+    def _add_visit(self, patient_id, record):
+        self.conn.execute(self._visit_sql(), [patient_id] + [str(record.get(f, "") or "") for f in VISIT_FIELDS])
+        # The update_profile() rule: entered values replace, form defaults only fill empty fields
+        keys = [k for k in PROFILE_FIELDS if record.get(k)]
+        if keys:
+            assignments = ", ".join(f"{k} = CASE WHEN {k} = '' THEN ? ELSE {k} END"
+                                    if record[k] == PROFILE_DEFAULTS.get(k) else f"{k} = ?" for k in keys)
+            self.conn.execute(f"UPDATE patients SET {assignments} WHERE id = ?",
+                              [record[k] for k in keys] + [patient_id])
+        self._refresh_patient(patient_id)
+    def _refresh_patient(self, patient_id):
+        """Copies the latest visit and the visit count onto the patient row."""
+        latest = self.conn.execute(f"SELECT {', '.join(VISIT_FIELDS)} FROM visits WHERE patient_id = ? "
+                                   "ORDER BY date DESC, rowid DESC LIMIT 1", (patient_id,)).fetchone()
+        count = self.conn.execute("SELECT COUNT(*) FROM visits WHERE patient_id = ?", (patient_id,)).fetchone()[0]
+        if latest is not None:
+            self.conn.execute(f"UPDATE patients SET {', '.join(f'{k} = ?' for k in VISIT_FIELDS)}, visit_count = ? "
+                              "WHERE id = ?", list(latest) + [count, patient_id])
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+    def get(self, patient_id):
+        row = self.conn.execute("SELECT * FROM patients WHERE id = ? LIMIT 1", (patient_id,)).fetchone()
+        return Patient.from_row(row) if row is not None else None
+    def insert(self, record):
+        return self.insert_many([record])[0]
+    def insert_many(self, records, merge_visits=False, same_patient=None):
+        self.version += 1
+        ids = []
+        next_id = self.next_id
+        with perf.timer("storage.write"), self.conn:
+            for i, record in enumerate(records):
+                existing = self._visit_of(record, same_patient[i] if same_patient else None, ids, merge_visits)
+                if existing is not None:
+                    self._add_visit(existing.id, record)
+                    ids.append(existing.id)
+                    continue
+                ids.append(str(next_id))
+                self._insert_patient(dict(record, id=str(next_id)))
+                next_id += 1
+            self.conn.execute("UPDATE meta SET value = ? WHERE key = 'next_id'", (str(next_id),))
+        self.next_id = next_id
+        if self.vital_columns is not None:
+            self.vital_columns.extend_visits(zip(ids, records))
+        if self.fuzzy is not None:
+            for patient_id, record in zip(ids, records):
+                self.fuzzy.add(patient_id, record.get("name"), record.get("date"))
+        return ids
+    def find_patient(self, record):
+        key = patient_key(record)
+        if key is None:
+            return None
+        rows = self.conn.execute("SELECT * FROM patients WHERE mobile_no = ? COLLATE NOCASE "
+                                 "ORDER BY rowid DESC", (key[0],))
+        for row in rows:
+            if patient_key(dict(row)) == key:
+                return Patient.from_row(row)
+        return None
+    def add_visit(self, patient_id, record):
+        if self.conn.execute("SELECT 1 FROM patients WHERE id = ?", (patient_id,)).fetchone() is None:
+            return None
+        self.version += 1
+        with perf.timer("storage.write"), self.conn:
+            self._add_visit(patient_id, record)
+        if self.vital_columns is not None:
+            self.vital_columns.add(patient_id, [record])
+        if self.fuzzy is not None:
+            self.fuzzy.add(patient_id, self.get(patient_id).get("name"), record.get("date"))
+        return patient_id
+    def visits(self, patient_id):
+        rows = self.conn.execute("SELECT * FROM visits WHERE patient_id = ? ORDER BY date DESC, rowid DESC",
+                                 (patient_id,))
+        return [Visit.from_row(row) for row in rows]
+    def delete(self, patient_id):
+        self.version += 1
+        with perf.timer("storage.write"), self.conn:
+            self.conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+            self.conn.execute("DELETE FROM visits WHERE patient_id = ?", (patient_id,))
+        if self.vital_columns is not None:
+            self.vital_columns.drop([patient_id])
+        if self.fuzzy is not None:
+            self.fuzzy.remove(patient_id)
+    def _where(self, field, text):
+        """WHERE clause and parameters for search(field, text)."""
+        date_range = parse_date_range(text) if field == "date" else None
+        if date_range:
+            return " WHERE date BETWEEN ? AND ?", date_range
+        if text and field in SEARCH_FIELDS:
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f" WHERE {SEARCH_FIELDS[field]} LIKE ? ESCAPE '\\'", (f"%{escaped}%",)
+        return "", ()
+    def search(self, field, text):
+        if field == FUZZY_NAME_FIELD and text.strip():
+            return self.fuzzy_search(text)
+        where, params = self._where(field, text)
+        rows = self.conn.execute(f"SELECT * FROM patients{where} ORDER BY date DESC, rowid", params)
+        return [Patient.from_row(row) for row in rows]
+    def fuzzy_search(self, text, limit=FUZZY_TOP_K):
+        if self.fuzzy is None:
+            self.fuzzy = FuzzyNameIndex()
+            for patient_id, name, date in self.conn.execute("SELECT id, name, date FROM patients"):
+                self.fuzzy.add(patient_id, name, date)
+        with perf.timer("records.fuzzy"):
+            ids = self.fuzzy.search(text, limit)
+        rows = self.conn.execute(f"SELECT * FROM patients WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        patients = {row["id"]: Patient.from_row(row) for row in rows}
+        return [patients[pid] for pid in ids if pid in patients]
+    def cursor(self, field, text, matches=None):
+        if field == FUZZY_NAME_FIELD and text.strip():
+            return ListCursor(self.fuzzy_search(text))
+        return SQLiteCursor(self.conn, *self._where(field, text))
+    def date_range(self, start, end):
+        rows = self.conn.execute("SELECT * FROM patients WHERE date BETWEEN ? AND ? "
+                                 "ORDER BY date DESC, rowid", (start, end))
+        return [Patient.from_row(row) for row in rows]
+    def appointments(self, start, end):
+        rows = self.conn.execute("SELECT * FROM patients WHERE next_appointment_date BETWEEN ? AND ? "
+                                 "ORDER BY next_appointment_date, rowid", (start, end))
+        return [Patient.from_row(row) for row in rows]
+    def vitals(self):
+        if self.vital_columns is None:
+            keys = ("date",) + VitalsColumns.FIELDS
+            rows = self.conn.execute(f"SELECT patient_id, {', '.join(keys)} FROM visits")
+            self.vital_columns = VitalsColumns()
+            self.vital_columns.extend_visits((row[0], dict(zip(keys, row[1:]))) for row in rows)
+        return self.vital_columns
+    def export_rows(self):
+        # Own connection, opened on the consuming thread; WAL lets it read alongside the UI's writes
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        columns = ", ".join([f"p.{k} AS {k}" for k in ("id",) + PROFILE_FIELDS] +
+                            [f"v.{k} AS {k}" for k in VISIT_FIELDS])
+        try:
+            for row in conn.execute(f"SELECT {columns} FROM patients p JOIN visits v ON v.patient_id = p.id "
+                                    "ORDER BY p.date DESC, p.rowid, v.date, v.rowid"):
+                yield dict(row)
+        finally:
+            conn.close()
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class IncrementalSearch:
+    """
+    Remembers the last query's matches. A query that extends it on the same field only
+    narrows those matches; a shorter query, another field or a repository write rescans.
+    Repositories whose cursors carry no matches (SQLite) always query storage.
+    """
+    def __init__(self, repository):
+        self.repository = repository
+        self.reset()
+    def reset(self):
+        self.field = None
+        self.text = None
+        self.version = None
+        self.matches = None
+    def cursor(self, field, text):
+        text = text.lower()
+        cached = (self.matches is not None and field == self.field
+                  and self.version == self.repository.version)
+        ranged = field == "date" and (parse_date_range(text) or parse_date_range(self.text or ""))
+        matches = None
+        if cached and text == self.text:
+            matches = self.matches
+        elif cached and self.text and text.startswith(self.text) and field in SEARCH_FIELDS and not ranged:
+            key = SEARCH_FIELDS[field]
+            matches = [p for p in self.matches if text in p.get(key, "").lower()]
+        cursor = self.repository.cursor(field, text, matches)
+        self.field = field
+        self.text = text
+        self.version = self.repository.version
+        self.matches = cursor.matches
+        return cursor
+
+def create_repository(mode=STORAGE_MODE, on_persisted=None, call_soon=call_now, archive_after_days=ARCHIVE_AFTER_DAYS):
+    if mode == "sqlite":
+        return SQLitePatientRepository()
+    return JsonPatientRepository(journaled=(mode == "journal"), on_persisted=on_persisted, call_soon=call_soon,
+                                 archive_after_days=archive_after_days)
+
+# ---------- IMPORT / EXPORT ----------
+IMPORT_BATCH_SIZE = 500           # Rows inserted, and persisted with one write, per UI-thread step
+EXPORT_FILE = "patients_export.csv"
+EXPORT_FIELDS = ("id",) + PATIENT_FIELDS
+
+def _column_key(header):
+    return "".join(ch for ch in header.lower() if ch.isalnum())
+
+# Normalised column name -> record key; a column may be named by key ("mobile_no") or label ("Mobile No:")
+IMPORT_COLUMNS = {_column_key(name): spec.key for spec in PATIENT_FORM_SCHEMA for name in (spec.key, spec.label)}
+
+def file_format(path):
+    """"csv" or "jsonl" from the file extension; raises ValueError for anything else."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError("Use a .csv or .jsonl file")
+
+def validate_import_row(row):
+    """
+    Maps one imported row (column -> value) onto the get_patient_data() keys. Unknown
+    columns, including "id", are dropped and empty fields get the form defaults.
+    Returns (record, None), or (None, reason) for a row that cannot be imported.
+    """
+    if not isinstance(row, dict):
+        return None, "not a JSON object"
+    record = {}
+    for column, value in row.items():
+        key = IMPORT_COLUMNS.get(_column_key(str(column or "")))
+        if key is not None and value is not None:
+            record[key] = str(value).strip()
+    if not record.get("name"):
+        return None, "missing name"
+    for spec in PATIENT_FORM_SCHEMA:
+        value = record.get(spec.key, "")
+        if not value:
+            record[spec.key] = spec.default() if callable(spec.default) else spec.default
+        elif spec.choices:
+            match = [choice for choice in spec.choices if choice.lower() == value.lower()]
+            if not match:
+                return None, f"{spec.key} must be one of {', '.join(spec.choices)}"
+            record[spec.key] = match[0]
+        elif spec.input_filter:
+            try:
+                number = float(value)
+            except ValueError:
+                return None, f"{spec.key} is not a number"
+            if spec.input_filter == "int":
+                if not number.is_integer():
+                    return None, f"{spec.key} is not a whole number"
+                record[spec.key] = str(int(number)) if not value.isdigit() else value
+    try:
+        datetime.strptime(record["date"], "%Y-%m-%d")
+    except ValueError:
+        return None, "date must be YYYY-MM-DD"
+    appointment = parse_appointment_date(record["next_appointment_date"])
+    if appointment is None:
+        return None, "next_appointment_date must be YYYY-MM-DD or DD/MM/YYYY"
+    record["next_appointment_date"] = appointment
+    return record, None
+
+def source_id(row):
+    """The "id" column of an imported row, as the exporter writes it, or "" if it has none."""
+    for column, value in row.items():
+        if _column_key(str(column or "")) == "id":
+            return str(value or "").strip()
+    return ""
+
+class PatientImporter:
+    """
+    Streams a .csv or .jsonl file into the repository. A background thread parses and
+    validates one row at a time; each batch of valid rows is inserted on the UI thread
+    with one persistence write, and the parser waits for it, so only one batch is held
+    in memory. Rows sharing an "id" column value, as an export writes a patient's
+    visits, become one patient; otherwise a row matching a known patient (patient_key())
+    is added as a visit. The inserts, on_progress(fraction, imported, skipped) and on_done(imported, skipped,
+    error) go through call_soon, which runs them on the UI thread.
+    """
+    MAX_REPORTED = 5  # Rejected rows remembered for the summary
+
+    def __init__(self, repository, path, on_progress=None, on_done=None, batch_size=IMPORT_BATCH_SIZE,
+                 call_soon=call_now):
+        self.repository = repository
+        self.call_soon = call_soon
+        self.path = path
+        self.format = file_format(path)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.batch_size = batch_size
+        self.imported = 0
+        self.skipped = 0
+        self.rejected = []  # (line number, reason)
+        self.error = None
+        self.cancelled = False
+        self.patient_ids = {}  # "id" column value -> id of the patient imported for it
+        self._applied = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="import", daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+        self._applied.set()
+
+    def _rows(self, f):
+        """Yields (line number, row) from the binary file f."""
+        lines = (line.decode("utf-8-sig") for line in f)
+        if self.format == "csv":
+            reader = csv.DictReader(lines)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+
+    def _run(self):
+        try:
+            size = os.path.getsize(self.path) or 1
+            with open(self.path, "rb") as f:
+                batch, sources = [], []
+                for number, row in self._rows(f):
+                    if self.cancelled:
+                        break
+                    record, reason = validate_import_row(row)
+                    if record is None:
+                        self.skipped += 1
+                        if len(self.rejected) < self.MAX_REPORTED:
+                            self.rejected.append((number, reason))
+                        continue
+                    batch.append(record)
+                    sources.append(source_id(row))
+                    if len(batch) >= self.batch_size:
+                        self._apply(batch, sources, f.tell() / size)
+                        batch, sources = [], []
+                if batch and not self.cancelled:
+                    self._apply(batch, sources, 1.0)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            self.error = e
+        self.call_soon(self._finish)
+
+    def _apply(self, batch, sources, fraction):
+        self._applied.clear()
+        self.call_soon(lambda: self._insert(batch, sources, fraction))
+        self._applied.wait()
+
+    def _insert(self, batch, sources, fraction):
+        try:
+            if self.cancelled:
+                return
+            same_patient, first = [], {}
+            for i, source in enumerate(sources):
+                same = first.get(source, self.patient_ids.get(source)) if source else None
+                if source and same is None:
+                    first[source] = i
+                same_patient.append(same)
+            ids = self.repository.insert_many(batch, merge_visits=True, same_patient=same_patient)
+            self.patient_ids.update((source, ids[i]) for source, i in first.items())
+            self.imported += len(batch)
+            if self.on_progress is not None:
+                self.on_progress(fraction, self.imported, self.skipped)
+        except Exception as e:
+            self.error = e
+            self.cancelled = True
+        finally:
+            self._applied.set()
+
+    def _finish(self):
+        if self.on_done is not None:
+            self.on_done(self.imported, self.skipped, self.error)
+
+class PatientExporter:
+    """
+    Streams repository.export_rows(), one row per visit, to a .csv or .jsonl file on a
+    background thread. Rows go to a temporary file that replaces path only once complete.
+    on_progress(fraction, written) and on_done(written, error) go through call_soon.
+    """
+    def __init__(self, repository, path, on_progress=None, on_done=None, call_soon=call_now):
+        self.repository = repository
+        self.call_soon = call_soon
+        self.path = path
+        self.format = file_format(path)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.cancelled = False
+
+    def start(self):
+        # export_rows() lists the patients now, on the UI thread; the rows are built and
+        # written on the export thread (SQLite reads them through its own connection there)
+        total = self.repository.count()
+        rows = self.repository.export_rows()
+        threading.Thread(target=self._run, args=(rows, total), name="export", daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _run(self, rows, total):
+        written, patients, last_id, error = 0, 0, None, None
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f) if self.format == "csv" else None
+                if writer is not None:
+                    writer.writerow(EXPORT_FIELDS)
+                for row in rows:
+                    if self.cancelled:
+                        raise OSError("export cancelled")
+                    if writer is not None:
+                        writer.writerow([str(row.get(key, "") or "") for key in EXPORT_FIELDS])
+                    else:
+                        f.write(json.dumps(row) + "\n")
+                    written += 1
+                    if row["id"] != last_id:
+                        patients, last_id = patients + 1, row["id"]
+                    if written % IMPORT_BATCH_SIZE == 0 and self.on_progress is not None:
+                        self.call_soon(lambda n=written, p=patients: self.on_progress(p / max(total, 1), n))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except (OSError, sqlite3.Error) as e:
+            error = e
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if self.on_done is not None:
+            self.call_soon(lambda: self.on_done(written, error))
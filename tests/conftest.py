@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+def make_record(name="Aisha Khan", mobile_no="9876543210", date="2024-03-01", **fields):
+    """A flat record as PatientMedicalForm.get_patient_data() returns it."""
+    record = {spec.key: spec.default() if callable(spec.default) else spec.default
+              for spec in storage.PATIENT_FORM_SCHEMA}
+    record.update(name=name, mobile_no=mobile_no, date=date, **fields)
+    return record
+
+@pytest.fixture
+def journal(tmp_path):
+    return storage.PatientJournal(snapshot_path=str(tmp_path / storage.PATIENTS_FILE),
+                                  journal_path=str(tmp_path / storage.JOURNAL_FILE),
+                                  summary_path=str(tmp_path / storage.SUMMARY_FILE))
+
+@pytest.fixture
+def open_repository(tmp_path):
+    """Opens and loads a JSON repository on the files in tmp_path; closes every one opened."""
+    opened = []
+    def open_repository(journaled=True, call_soon=storage.call_now):
+        journal = storage.PatientJournal(snapshot_path=str(tmp_path / storage.PATIENTS_FILE),
+                                         journal_path=str(tmp_path / storage.JOURNAL_FILE),
+                                         summary_path=str(tmp_path / storage.SUMMARY_FILE))
+        archive = storage.PatientArchive(str(tmp_path / storage.ARCHIVE_DIR))
+        repository = storage.JsonPatientRepository(journaled=journaled, journal=journal, archive=archive,
+                                                   call_soon=call_soon)
+        opened.append(repository)
+        repository.load()
+        return repository
+    yield open_repository
+    for repository in opened:
+        repository.close()
@@ -0,0 +1,90 @@
+from datetime import date
+
+import pytest
+
+import storage
+from conftest import make_record
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-03-05", "2024-03-05"),
+    ("05/03/2024", "2024-03-05"),
+    ("05-03-2024", "2024-03-05"),
+    ("  29/02/2024 ", "2024-02-29"),
+    ("2024-3-5", "2024-03-05"),
+])
+def test_parse_appointment_date_reads_every_accepted_format(text, expected):
+    assert storage.parse_appointment_date(text) == expected
+
+@pytest.mark.parametrize("text", ["2024-13-01", "31/02/2024", "29/02/2023", "2024/03/05", "next week", "05.03.2024",
+                                  "2024-03-05T10:00"])
+def test_parse_appointment_date_rejects_malformed_dates(text):
+    assert storage.parse_appointment_date(text) is None
+
+@pytest.mark.parametrize("text", ["", "   ", None])
+def test_parse_appointment_date_keeps_a_blank_date_blank(text):
+    assert storage.parse_appointment_date(text) == ""
+
+WEDNESDAY = date(2024, 2, 28)
+
+@pytest.mark.parametrize("period, today, expected", [
+    ("Today", WEDNESDAY, ("2024-02-28", "2024-02-28")),
+    ("Tomorrow", WEDNESDAY, ("2024-02-29", "2024-02-29")),
+    ("Tomorrow", date(2024, 12, 31), ("2025-01-01", "2025-01-01")),
+    ("This Week", WEDNESDAY, ("2024-02-26", "2024-03-03")),
+    ("This Week", date(2024, 2, 26), ("2024-02-26", "2024-03-03")),  # Monday
+    ("This Week", date(2024, 3, 3), ("2024-02-26", "2024-03-03")),   # Sunday
+    ("Next 7 Days", WEDNESDAY, ("2024-02-28", "2024-03-05")),
+    ("Unknown", WEDNESDAY, ("2024-02-28", "2024-02-28")),
+])
+def test_appointment_range(period, today, expected):
+    assert storage.appointment_range(period, today) == expected
+
+def dated(pid, appointment):
+    return {"id": pid, "next_appointment_date": appointment}
+
+def test_due_includes_both_ends_soonest_first():
+    index = storage.AppointmentIndex()
+    index.build([dated("a", "2024-03-05"), dated("b", "2024-03-01"), dated("c", "2024-03-10"),
+                 dated("d", "2024-03-01"), dated("e", "2024-02-29"), dated("f", "2024-03-11")])
+    assert [r["id"] for r in index.due("2024-03-01", "2024-03-10")] == ["b", "d", "a", "c"]
+    assert [r["id"] for r in index.due("2024-03-05", "2024-03-05")] == ["a"]
+    assert index.due("2024-03-06", "2024-03-09") == []
+    assert index.due("2024-03-10", "2024-03-01") == []
+
+def test_due_parses_free_text_dates_and_skips_blank_or_unreadable_ones():
+    index = storage.AppointmentIndex()
+    index.extend([dated("typed", "02/03/2024"), dated("blank", ""), dated("garbled", "soon"),
+                  {"id": "missing"}])
+    index.add(dated("added", "2024-03-02"))
+    assert [r["id"] for r in index.due("2024-03-01", "2024-03-31")] == ["typed", "added"]
+    assert [r["id"] for r in index.due("0001-01-01", "9999-12-31")] == ["typed", "added"]
+
+@pytest.fixture(params=["journal", "sqlite"])
+def repository(request, open_repository, tmp_path, journal):
+    if request.param == "journal":
+        return open_repository()
+    repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+    repository.load()
+    request.addfinalizer(repository.close)
+    return repository
+
+def due_names(repository, period, today=WEDNESDAY):
+    return [p.get("name") for p in repository.appointments(*storage.appointment_range(period, today))]
+
+def test_appointments_follow_a_reschedule(repository):
+    first = repository.insert(make_record("Aisha Khan", date="2024-02-20", next_appointment_date="2024-02-28"))
+    repository.insert(make_record("Ravi Sharma", mobile_no="9123456780", date="2024-02-21",
+                                  next_appointment_date="2024-03-01"))
+    assert due_names(repository, "Today") == ["Aisha Khan"]
+    # A new visit moves the appointment; only the latest visit's appointment counts
+    repository.add_visit(first, make_record("Aisha Khan", date="2024-02-28", next_appointment_date="2024-03-04"))
+    assert due_names(repository, "Today") == []
+    assert due_names(repository, "This Week") == ["Ravi Sharma"]
+    assert due_names(repository, "Next 7 Days") == ["Ravi Sharma", "Aisha Khan"]
+
+def test_appointments_leave_out_deleted_patients(repository):
+    kept = repository.insert(make_record("Aisha Khan", next_appointment_date="2024-02-29"))
+    deleted = repository.insert(make_record("Ravi Sharma", mobile_no="9123456780", next_appointment_date="2024-02-29"))
+    assert due_names(repository, "Tomorrow") == ["Aisha Khan", "Ravi Sharma"]
+    repository.delete(deleted)
+    assert [p.id for p in repository.appointments(*storage.appointment_range("Tomorrow", WEDNESDAY))] == [kept]
@@ -0,0 +1,212 @@
+import json
+import os
+import queue
+import threading
+from datetime import date
+
+import pytest
+
+import storage
+from conftest import make_record
+
+TODAY = date.today().isoformat()
+
+@pytest.fixture
+def archived(open_repository, monkeypatch):
+    """open_repository on a store with six archived patients in three segments and two hot ones."""
+    monkeypatch.setattr(storage, "ARCHIVE_MIN_PATIENTS", 2)
+    monkeypatch.setattr(storage, "ARCHIVE_SEGMENT_SIZE", 2)
+    repository = open_repository()
+    for i in range(6):
+        repository.insert(make_record(f"Cold Patient {i}", mobile_no=f"900000000{i}", date=f"2016-0{i + 1}-10",
+                                      diseases="asthma" if i % 2 else "diabetes", weight="60"))
+    repository.insert(make_record("Hot Khan", mobile_no="9111111111", date=TODAY))
+    repository.insert(make_record("Warm Khan", mobile_no="9222222222", date=TODAY))
+    repository.close()
+    repository = open_repository()
+    assert repository.archived == 6
+    repository.close()  # Writes the snapshot without the archived patients
+    return open_repository
+
+@pytest.fixture
+def segment_reads(monkeypatch):
+    """(segment file, reading thread) of every segment decoded."""
+    reads = []
+    records = storage.PatientArchive._records
+    def counted(archive, segment):
+        reads.append((segment["file"], threading.current_thread().name))
+        return records(archive, segment)
+    monkeypatch.setattr(storage.PatientArchive, "_records", counted)
+    return reads
+
+def files(reads):
+    return [name for name, _ in reads]
+
+class UiThread:
+    """A call_soon that queues callbacks until the test runs them, as the Kivy clock would."""
+    def __init__(self):
+        self.calls = queue.Queue()
+    def call_soon(self, callback):
+        self.calls.put(callback)
+    def run_next(self):
+        self.calls.get(timeout=5)()
+
+def wait_for(event):
+    assert event.wait(5), "archived patient was not read"
+
+def test_opening_reads_no_segment_and_keeps_only_segment_indexes(archived, segment_reads):
+    repository = archived()
+    assert repository.count() == 8 and "1" in repository.archive
+    assert set(repository.archive.segments[0]) == {"file", "count", "min_date", "max_date", "ids",
+                                                   "grams", "fuzzy", "key_filter"}
+    assert segment_reads == []
+
+def test_cursor_scans_archive_segments_in_the_background(archived, segment_reads):
+    ui = UiThread()
+    repository = archived(call_soon=ui.call_soon)
+    cursor = repository.cursor("name", "")
+    assert (cursor.total, cursor.pending) == (2, 3)
+    ready = []
+    cursor.on_ready = ready.append
+    assert sorted(p.get("name") for p in cursor.fetch(3)) == ["Hot Khan", "Warm Khan"]
+    dates = []
+    while cursor.pending:
+        ui.run_next()  # A segment scan finished; its matches are added here, on the "UI thread"
+        page = cursor.fetch(3)
+        dates.append([p.get("date") for p in page])
+    assert len(ready) == 3 and cursor.total == 8 and cursor.exhausted
+    assert dates == [["2016-06-10", "2016-05-10"], ["2016-04-10", "2016-03-10"], ["2016-02-10", "2016-01-10"]]
+    assert segment_reads == [(f"segment-0000{i}.json.gz", "archive-scan") for i in (3, 2, 1)]
+
+def test_fuzzy_cursor_ranks_archived_matches_in_the_background(archived, segment_reads):
+    ui = UiThread()
+    repository = archived(call_soon=ui.call_soon)
+    cursor = repository.cursor("fuzzy name", "cold patint")
+    assert cursor.fetch() == [] and cursor.pending == 1
+    ui.run_next()
+    assert [p.get("date") for p in cursor.fetch()] == [f"2016-0{i}-10" for i in range(6, 0, -1)]
+    assert cursor.exhausted and {thread for _, thread in segment_reads} == {"archive-scan"}
+
+def test_searches_read_only_segments_that_can_match(archived, segment_reads):
+    repository = archived()
+    assert [s["file"] for s in repository.archive.candidates("name", "cold patient 3")] == ["segment-00002.json.gz"]
+    assert [p.get("name") for p in repository.search("name", "cold patient 3")] == ["Cold Patient 3"]
+    assert repository.search("name", "nobody at all") == [] and repository.cursor("name", "nobody").pending == 0
+    assert files(segment_reads) == ["segment-00002.json.gz"]
+    assert [p.get("name") for p in repository.search("date", "2016-02-01..2016-03-31")] == \
+        ["Cold Patient 2", "Cold Patient 1"]
+    assert files(segment_reads) == ["segment-00002.json.gz", "segment-00001.json.gz"]
+    names = [p.get("name") for p in repository.search("name", "")]
+    assert sorted(names[:2]) == ["Hot Khan", "Warm Khan"] and names[2:] == [f"Cold Patient {i}" for i in range(5, -1, -1)]
+    assert len(repository.search("disease", "asthma")) == 3
+    # Hot and archived matches are ranked together; equal scores put the newest first
+    assert [p.get("date") for p in repository.fuzzy_search("cold patint")] == \
+        [f"2016-0{i}-10" for i in range(6, 0, -1)]
+    assert repository.fuzzy_search("hot kahn")[0].get("name") == "Hot Khan"
+
+def test_match_patient_reads_archived_patients_in_the_background(archived, segment_reads):
+    ui = UiThread()
+    repository = archived(call_soon=ui.call_soon)
+    found = []
+    repository.match_patient(make_record("Hot Khan", mobile_no="9111111111"), found.append)
+    repository.match_patient(make_record("Nobody Here", mobile_no="9333333333"), found.append)
+    assert found[0].get("name") == "Hot Khan" and found[1] is None  # At once: hot, or in no KeyFilter
+    repository.match_patient(make_record("cold  patient 2", mobile_no="9000000002"), found.append)
+    assert len(found) == 2
+    ui.run_next()
+    assert (found[2].get("name"), found[2].get("weight")) == ("Cold Patient 2", "60")
+    assert segment_reads == [("segment-00002.json.gz", "archive-read")]
+
+def test_fetch_reads_an_archived_patient_in_the_background(archived, segment_reads):
+    repository = archived()
+    patient_id = repository.search("name", "cold patient 3")[0].id
+    done = threading.Event()
+    fetched = []
+    def callback(patient):
+        fetched.append((patient, threading.current_thread().name))
+        done.set()
+    repository.fetch(patient_id, callback)  # call_now: the callback runs on the reading thread
+    wait_for(done)
+    patient, thread = fetched[0]
+    assert thread == "archive-read"
+    assert (patient.get("weight"), patient.get("diseases")) == ("60", "asthma")
+    assert repository.get(patient_id).get("name") == "Cold Patient 3"
+    assert len(segment_reads) == 1  # The later reads came from the cache
+
+def test_decoded_segments_are_cached_up_to_the_limit(archived, segment_reads):
+    archive = archived().archive
+    for patient_id in list(archive.segment_of):
+        archive.find(patient_id)
+    assert len(segment_reads) == 3
+    assert len(archive._cache) == storage.ARCHIVE_CACHE_SEGMENTS
+
+def test_key_filter_has_no_false_negatives_and_few_false_positives():
+    keys = [(f"98{i:08d}", f"patient {i}") for i in range(1000)]
+    key_filter = storage.KeyFilter.from_text(storage.KeyFilter.build(keys + [None]).to_text())
+    assert all(key in key_filter for key in keys)
+    assert sum((f"97{i:08d}", f"other {i}") in key_filter for i in range(1000)) < 30
+
+def test_returning_archived_patient_moves_back_to_the_hot_set(archived):
+    repository = archived()
+    visit = make_record("Cold Patient 2", mobile_no="9000000002", date=TODAY, diseases="diabetes, anemia")
+    existing = repository.find_patient(visit)
+    assert existing.id in repository.archive and existing.visit_count == 1
+    repository.add_visit(existing.id, visit)
+    repository.close()
+    reopened = archived()
+    patient = reopened.get(existing.id)
+    assert existing.id in reopened.patients and existing.id not in reopened.archive
+    assert (patient.visit_count, patient.get("diseases")) == (2, "diabetes, anemia")
+    assert patient.visits[0].get("weight") == "60"
+    assert reopened.count() == 8 and len(reopened.search("name", "cold patient 2")) == 1
+
+def test_deleting_an_archived_patient(archived):
+    repository = archived()
+    patient_id = repository.search("name", "cold patient 0")[0].id
+    repository.delete(patient_id)
+    assert repository.count() == 7 and repository.get(patient_id) is None
+    repository.close()
+    reopened = archived()
+    assert reopened.count() == 7 and reopened.search("name", "cold patient 0") == []
+    assert len(reopened.vitals()) == 7
+
+def test_loading_builds_the_archive_apart_until_finish_load(archived, tmp_path):
+    archived().close()
+    journal = storage.PatientJournal(snapshot_path=str(tmp_path / storage.PATIENTS_FILE),
+                                     journal_path=str(tmp_path / storage.JOURNAL_FILE),
+                                     summary_path=str(tmp_path / storage.SUMMARY_FILE))
+    repository = storage.JsonPatientRepository(journal=journal,
+                                               archive=storage.PatientArchive(str(tmp_path / storage.ARCHIVE_DIR)))
+    try:
+        chunks = list(repository.load_chunks())  # What the loader thread does
+        assert repository.archive.count() == 0 and len(repository.vital_columns) == 0
+        for chunk in chunks:
+            repository.add_loaded(chunk)
+        repository.finish_load()
+        assert repository.archive.count() == 6 and len(repository.vital_columns) == 8
+    finally:
+        repository.close()
+
+def test_segments_written_by_older_versions_are_indexed_once(archived, tmp_path, segment_reads):
+    archived().close()
+    manifest_path = tmp_path / storage.ARCHIVE_DIR / "manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+    for segment in manifest["segments"]:
+        for key in storage.PatientArchive.INDEX_KEYS:
+            del segment[key]
+        segment["summaries"] = [["", "", "", "", 1]] * segment["count"]  # As the previous version kept them
+    manifest_path.write_text(json.dumps(manifest))
+
+    repository = archived()
+    assert len(segment_reads) == 3
+    assert [p.get("name") for p in repository.search("disease", "asthma")] == \
+        ["Cold Patient 5", "Cold Patient 3", "Cold Patient 1"]
+    assert repository.flush()
+    upgraded = json.loads(manifest_path.read_text())["segments"]
+    assert all(set(storage.PatientArchive.INDEX_KEYS) <= set(s) and "summaries" not in s for s in upgraded)
+
+def test_export_lists_archived_patients(archived, tmp_path):
+    rows = list(archived().export_rows())
+    assert len(rows) == 8
+    assert {row["weight"] for row in rows if row["name"].startswith("Cold")} == {"60"}
+    assert os.path.exists(tmp_path / storage.ARCHIVE_DIR / "segment-00003.json.gz")
@@ -0,0 +1,51 @@
+import pytest
+
+import storage
+from conftest import make_record
+
+PAGE = 4
+
+@pytest.fixture(params=["journal", "sqlite"])
+def repository(request, open_repository, tmp_path, journal):
+    if request.param == "journal":
+        repository = open_repository()
+    else:
+        repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+        repository.load()
+        request.addfinalizer(repository.close)
+    # Ten patients over seven dates, so pages split runs of equal dates
+    for i, day in enumerate((3, 1, 3, 7, 2, 3, 5, 1, 6, 3)):
+        repository.insert(make_record(f"Patient {i}", mobile_no=f"90000000{i:02d}", date=f"2024-05-0{day}",
+                                      diseases="asthma" if i % 3 else "diabetes"))
+    return repository
+
+def page_through(cursor):
+    """The pages the records list shows: the first page, then one more per scroll to the end."""
+    pages = [cursor.fetch(PAGE)]
+    while not cursor.exhausted:
+        pages.append(cursor.fetch(PAGE))
+    return pages
+
+@pytest.mark.parametrize("field, text", [("name", ""), ("name", "patient"), ("disease", "asthma"),
+                                         ("date", "2024-05-02..2024-05-06"), ("date", "05-0")])
+def test_pages_list_every_result_once_newest_first(repository, field, text):
+    expected = [p.id for p in repository.search(field, text)]
+    cursor = repository.cursor(field, text)
+    assert cursor.total == len(expected)
+    pages = page_through(cursor)
+    assert [len(page) for page in pages[:-1]] == [PAGE] * (len(pages) - 1)
+    assert len(pages) == max(1, -(-len(expected) // PAGE))  # No extra, empty page was fetched
+    ids = [p.id for page in pages for p in page]
+    assert ids == expected
+    dates = [repository.get(pid).get("date") for pid in ids]
+    assert dates == sorted(dates, reverse=True)
+
+def test_fetching_past_the_end_returns_nothing(repository):
+    cursor = repository.cursor("name", "")
+    page_through(cursor)
+    fetched = cursor.fetched
+    assert cursor.fetch(PAGE) == [] and cursor.fetched == fetched == 10
+
+def test_a_query_without_matches_is_exhausted_at_once(repository):
+    cursor = repository.cursor("name", "nobody")
+    assert cursor.total == 0 and cursor.exhausted and cursor.fetch(PAGE) == []
@@ -0,0 +1,98 @@
+import pytest
+
+import storage
+
+DATES = ("2024-03-02", "2024-01-15", "2024-03-02", "2023-12-31", "2024-02-29", "2024-01-15", "2024-03-02",
+         "2024-02-01", "", "2024-01-01")
+
+def make_records(dates=DATES):
+    return [{"id": str(i), "date": date} for i, date in enumerate(dates)]
+
+def newest_first(records):
+    """Reference order: newest date first, equal dates in insertion order."""
+    order = {id(r): i for i, r in enumerate(records)}
+    return sorted(records, key=lambda r: (r["date"], -order[id(r)]), reverse=True)
+
+def pages(cursor, size):
+    result = []
+    while not cursor.exhausted:
+        page = cursor.fetch(size)
+        assert page, "a cursor that is not exhausted returned an empty page"
+        assert len(page) <= size
+        result.append(page)
+    assert cursor.fetch(size) == []
+    return result
+
+@pytest.fixture
+def dates():
+    index = storage.DateIndex()
+    index.build(make_records())
+    return index
+
+def test_newest_first_orders_by_date_then_insertion(dates):
+    assert [r["id"] for r in dates.newest_first()] == [r["id"] for r in newest_first(make_records())]
+    assert [r["id"] for r in dates.newest_first()] == ["0", "2", "6", "4", "7", "1", "5", "9", "3", "8"]
+
+def test_add_and_extend_keep_the_same_order():
+    records = make_records()
+    added = storage.DateIndex()
+    for record in records:
+        added.add(record)
+    extended = storage.DateIndex()
+    extended.extend(records[:4])
+    extended.extend(records[4:])
+    assert added.newest_first() == extended.newest_first() == newest_first(records)
+
+def test_between_includes_both_ends(dates):
+    assert [r["id"] for r in dates.between("2024-01-15", "2024-03-02")] == ["0", "2", "6", "4", "7", "1", "5"]
+    assert [r["id"] for r in dates.between("2024-02-29", "2024-02-29")] == ["4"]
+    assert dates.between("2024-03-03", "2024-12-31") == []
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 10, 50])
+def test_date_cursor_pages_newest_first(dates, size):
+    cursor = storage.DateIndexCursor(dates)
+    result = pages(cursor, size)
+    assert cursor.total == len(DATES)
+    assert [len(page) for page in result[:-1]] == [size] * (len(result) - 1)
+    assert sum(result, []) == dates.newest_first()
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_date_cursor_range_includes_both_ends(dates, size):
+    cursor = storage.DateIndexCursor(dates, "2024-01-15", "2024-03-02")
+    assert cursor.total == 7
+    assert sum(pages(cursor, size), []) == dates.between("2024-01-15", "2024-03-02")
+
+def test_date_cursor_after_insert_and_delete(dates):
+    cursor = storage.DateIndexCursor(dates)
+    first = cursor.fetch(3)
+    newer = {"id": "new", "date": "2024-12-01"}
+    dates.add(newer)
+    for i in range(2):
+        dates.add({"id": f"old {i}", "date": "2023-06-01"})
+    unseen = dates.newest_first()[6]
+    dates.remove(unseen)
+    rest = sum(pages(cursor, 1), [])
+    assert newer not in rest and unseen not in rest
+    assert first + rest == [r for r in dates.newest_first() if r is not newer]
+    assert cursor.total == len(first + rest)
+
+@pytest.mark.parametrize("size", [1, 2, 4, 50])
+def test_match_cursor_pages_newest_first(dates, size):
+    matches = [r for r in make_records() if r["date"].startswith("2024")]
+    index = storage.DateIndex()
+    index.build(matches)
+    shuffled = matches[3:] + matches[:3]  # Matches arrive unordered
+    cursor = storage.MatchCursor(shuffled, index.key_of)
+    assert cursor.total == len(matches)
+    assert sum(pages(cursor, size), []) == index.newest_first()
+
+def test_match_cursor_after_insert_and_delete(dates):
+    matches = [r for r in dates.records if r["date"].startswith("2024-0")]
+    cursor = storage.MatchCursor(list(matches), dates.key_of)
+    first = cursor.fetch(2)
+    dates.add({"id": "new", "date": "2024-01-20"})
+    deleted = dates.sort_newest_first(matches)[4]
+    dates.remove(deleted)
+    rest = sum(pages(cursor, 1), [])
+    assert first + rest == dates.sort_newest_first([m for m in matches if m is not deleted])
+    assert cursor.total == len(matches) - 1
@@ -0,0 +1,86 @@
+import pytest
+
+import storage
+from conftest import make_record
+
+def indexed(names):
+    """A FuzzyNameIndex of {id: (name, date)}."""
+    index = storage.FuzzyNameIndex()
+    for patient_id, (name, date) in names.items():
+        index.add(patient_id, name, date)
+    return index
+
+@pytest.mark.parametrize("query, name", [
+    ("jhon", "John Smith"),          # Same Soundex code
+    ("kahn", "Aisha Khan"),
+    ("smyth", "John Smith"),
+    ("mohamad", "Mohammed Rafi"),
+    ("mohd", "Mohammed Rafi"),       # Abbreviation: its skeleton is part of the name's
+    ("mhmd rafi", "Mohammed Rafi"),
+    ("joh smi", "John Smith"),       # Prefixes
+    ("ÁISHA", "Aisha Khan"),         # Case and accents are ignored
+])
+def test_misspellings_find_the_name(query, name):
+    names = {"1": ("John Smith", "2024-01-01"), "2": ("Aisha Khan", "2024-01-02"),
+             "3": ("Mohammed Rafi", "2024-01-03"), "4": ("Priya Iyer", "2024-01-04")}
+    index = indexed(names)
+    assert [names[pid][0] for pid in index.search(query)][:1] == [name]
+
+def test_unrelated_names_score_too_low_to_be_listed():
+    index = indexed({"1": ("John Smith", "2024-01-01"), "2": ("Priya Iyer", "2024-01-02")})
+    assert index.search("zara qureshi") == []
+    assert index.search("") == index.search("  --  ") == []
+
+def test_results_rank_by_score_then_newest_first():
+    index = indexed({"exact old": ("Mohammed Khan", "2023-05-01"), "skeleton": ("Mhmd Khan", "2024-06-01"),
+                     "sound": ("Mohamad Khan", "2024-06-01"), "prefix": ("Mohammedali Khan", "2024-06-01"),
+                     "exact new": ("Mohammed Khan", "2024-02-01"), "other": ("Imran Sheikh", "2024-06-01")})
+    assert index.search("mohammed khan") == ["exact new", "exact old", "prefix", "sound", "skeleton"]
+    scores = [score for score, _, _ in index.ranked("mohammed khan")]
+    assert scores == sorted(scores, reverse=True) and scores[0] == 1.0
+    assert all(score >= storage.FUZZY_MIN_SCORE for score in scores)
+
+def test_only_the_top_k_newest_of_equal_scores_are_kept():
+    dates = [f"2024-{month:02d}-{day:02d}" for month in range(1, 13) for day in range(1, 15)]
+    index = indexed({str(i): ("Aisha Khan", date) for i, date in enumerate(dates)})
+    index.add("near", "Ayesha Khan", "2025-01-01")
+    best = index.search("aisha khan")
+    assert len(dates) > storage.FUZZY_TOP_K == len(best)
+    assert best == [str(i) for i in range(len(dates) - 1, len(dates) - 1 - storage.FUZZY_TOP_K, -1)]
+    assert index.search("aisha khan", limit=3) == best[:3]
+    assert "near" in index.search("ayesha", limit=1)
+
+def test_removed_and_renamed_patients_leave_the_index():
+    index = indexed({"1": ("Mohammed Rafi", "2024-01-01"), "2": ("Mohammed Khan", "2024-01-02"),
+                     "3": ("John Smith", "2024-01-03")})
+    index.remove("2")
+    index.remove("never added")
+    assert index.search("mohd") == ["1"]
+    index.add("1", "Ravi Shankar", "2024-02-01")  # A rename replaces the entry
+    assert index.search("mohd") == [] and index.search("ravi") == ["1"]
+    index.remove("3")
+    index.remove("1")
+    assert index.entries == {} and index.postings == {}
+
+@pytest.fixture(params=["journal", "sqlite"])
+def repository(request, open_repository, tmp_path, journal):
+    if request.param == "journal":
+        return open_repository()
+    repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+    repository.load()
+    request.addfinalizer(repository.close)
+    return repository
+
+def fuzzy_names(repository, text):
+    return [p.get("name") for p in repository.search(storage.FUZZY_NAME_FIELD, text)]
+
+def test_repository_fuzzy_search_follows_deletes_and_renames(repository):
+    rafi = repository.insert(make_record("Mohammed Rafi", mobile_no="9000000001", date="2024-01-01"))
+    khan = repository.insert(make_record("Mohammed Khan", mobile_no="9000000002", date="2024-01-02"))
+    assert fuzzy_names(repository, "mohd") == ["Mohammed Khan", "Mohammed Rafi"]
+    repository.delete(khan)
+    assert fuzzy_names(repository, "mohd") == ["Mohammed Rafi"]
+    # A visit entered under another name renames the patient
+    repository.add_visit(rafi, make_record("Ravi Shankar", mobile_no="9000000001", date="2024-02-01"))
+    assert fuzzy_names(repository, "mohd") == []
+    assert fuzzy_names(repository, "ravee shankar") == ["Ravi Shankar"]
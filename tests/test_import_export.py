@@ -0,0 +1,100 @@
+import json
+import time
+
+import pytest
+
+import storage
+from conftest import make_record
+
+def export(repository, path):
+    done = []
+    storage.PatientExporter(repository, path, on_done=lambda written, error: done.append((written, error))).start()
+    return done
+
+def run_import(repository, path):
+    done = []
+    importer = storage.PatientImporter(repository, path,
+                                       on_done=lambda imported, skipped, error: done.append((imported, skipped, error)))
+    importer._run()  # On this thread; call_now runs the inserts inline
+    return done[0], importer
+
+def wait_for(done):
+    for _ in range(500):
+        if done:
+            return done[0]
+        time.sleep(0.01)
+    raise AssertionError("export did not finish")
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl"])
+def test_export_then_import_round_trips(open_repository, tmp_path, extension):
+    source = open_repository()
+    aisha = source.insert(make_record("Aisha Khan", diseases="asthma", weight="61.5"))
+    source.add_visit(aisha, make_record("Aisha Khan", date="2024-04-02", weight="60.0"))
+    source.insert(make_record("Ravi Sharma", mobile_no="9123456780", surgery="Yes",
+                              surgery_description="appendectomy", next_appointment_date="2024-03-15"))
+    path = str(tmp_path / f"export{extension}")
+    assert wait_for(export(source, path)) == (3, None)
+
+    target = storage.JsonPatientRepository(journal=storage.PatientJournal(
+        snapshot_path=str(tmp_path / "copy.json"), journal_path=str(tmp_path / "copy.journal"),
+        summary_path=str(tmp_path / "copy.summary.json")), archive=storage.PatientArchive(str(tmp_path / "copy")))
+    target.load()
+    try:
+        (imported, skipped, error), _ = run_import(target, path)
+        assert (imported, skipped, error) == (3, 0, None)
+        assert target.count() == 2
+        for patient in source.search("name", ""):
+            copy = target.find_patient(patient)
+            assert [v.to_dict() for v in copy.visits] == [v.to_dict() for v in patient.visits]
+            assert {k: copy.get(k) for k in storage.PROFILE_FIELDS} == {k: patient.get(k) for k in storage.PROFILE_FIELDS}
+    finally:
+        target.close()
+
+def test_import_reports_rejected_rows(open_repository, tmp_path):
+    path = tmp_path / "patients.jsonl"
+    path.write_text("\n".join([json.dumps(make_record("Aisha Khan")), "not json",
+                               json.dumps(make_record("")), json.dumps(make_record("Ravi", gender="robot"))]) + "\n")
+    repository = open_repository()
+    (imported, skipped, error), importer = run_import(repository, str(path))
+    assert (imported, skipped, error) == (1, 3, None)
+    assert importer.rejected == [(2, "not a JSON object"), (3, "missing name"),
+                                 (4, "gender must be one of Male, Female, Other")]
+
+@pytest.mark.parametrize("batch_size", [500, 2])
+def test_reimport_keeps_visits_of_patients_without_a_mobile(open_repository, tmp_path, batch_size):
+    source = open_repository()
+    first = source.insert(make_record("Aisha Khan", mobile_no=""))
+    source.add_visit(first, make_record("Aisha Khan", mobile_no="", date="2024-04-02"))
+    source.add_visit(first, make_record("Aisha Khan", mobile_no="", date="2024-05-09"))
+    # Same name, no mobile, but registered separately: must stay separate
+    second = source.insert(make_record("Aisha Khan", mobile_no="", date="2024-02-11"))
+    path = str(tmp_path / "export.csv")
+    assert wait_for(export(source, path)) == (4, None)
+    source.close()
+
+    target = storage.JsonPatientRepository(journal=storage.PatientJournal(
+        snapshot_path=str(tmp_path / "copy.json"), journal_path=str(tmp_path / "copy.journal"),
+        summary_path=str(tmp_path / "copy.summary.json")), archive=storage.PatientArchive(str(tmp_path / "copy")))
+    target.load()
+    try:
+        done = []
+        importer = storage.PatientImporter(target, path, batch_size=batch_size,
+                                           on_done=lambda *result: done.append(result))
+        importer._run()
+        assert done == [(4, 0, None)]
+        assert sorted(p.visit_count for p in target.search("name", "")) == [1, 3]
+        assert set(importer.patient_ids) == {first, second}
+    finally:
+        target.close()
+
+def test_rows_of_one_id_become_visits_in_any_order(tmp_path, open_repository):
+    rows = [dict(make_record("Ravi Sharma", mobile_no="", date=date), id=source)
+            for source, date in (("7", "2024-01-01"), ("8", "2024-01-02"), ("7", "2024-03-01"))]
+    path = tmp_path / "patients.jsonl"
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    repository = open_repository()
+    (imported, skipped, error), importer = run_import(repository, str(path))
+    assert (imported, skipped, error) == (3, 0, None)
+    patient = repository.get(importer.patient_ids["7"])
+    assert [v.get("date") for v in patient.visits] == ["2024-01-01", "2024-03-01"]
+    assert repository.count() == 2
@@ -0,0 +1,67 @@
+import pytest
+
+import storage
+from conftest import make_record
+
+NAMES = ("Aisha Khan", "Imran Khan", "Khalid Rahman", "Sana Sheikh", "Mohd Khanna", "Ravi Shankar")
+
+@pytest.fixture
+def repository(open_repository):
+    repository = open_repository()
+    for i, name in enumerate(NAMES):
+        repository.insert(make_record(name, mobile_no=f"98765{i:05d}", date=f"2024-03-0{i + 1}",
+                                      diseases="diabetes" if i % 2 else "asthma"))
+    return repository
+
+@pytest.fixture
+def narrowed(repository, monkeypatch):
+    """The matches each repository.cursor() call was given: None for a full search."""
+    calls = []
+    cursor = repository.cursor
+    def spied(field, text, matches=None):
+        calls.append(None if matches is None else sorted(p.id for p in matches))
+        return cursor(field, text, matches)
+    monkeypatch.setattr(repository, "cursor", spied)
+    return calls
+
+def ids(cursor):
+    return [p.id for p in cursor.fetch(len(NAMES) + 1)]
+
+def test_extending_the_query_narrows_the_previous_matches(repository, narrowed):
+    search = storage.IncrementalSearch(repository)
+    first = search.cursor("name", "Kh")
+    previous = sorted(p.id for p in first.matches)
+    search.cursor("name", "Kha")
+    assert narrowed[0] is None
+    assert narrowed[1] == sorted(p.id for p in repository.search("name", "kha"))
+    assert set(narrowed[1]) <= set(previous)
+    search.cursor("name", "Khan")
+    assert set(narrowed[2]) <= set(narrowed[1])
+
+def test_deleting_characters_or_changing_field_rescans(repository, narrowed):
+    search = storage.IncrementalSearch(repository)
+    search.cursor("name", "khan")
+    search.cursor("name", "kha")
+    search.cursor("disease", "khan")
+    assert narrowed == [None, None, None]
+
+def test_repository_writes_invalidate_the_cache(repository, narrowed):
+    search = storage.IncrementalSearch(repository)
+    search.cursor("name", "kha")
+    new_id = repository.insert(make_record("Zara Khatun", mobile_no="9000000001", date="2024-04-01"))
+    assert new_id in ids(search.cursor("name", "khat"))
+    assert narrowed[-1] is None
+    repository.delete(new_id)
+    assert new_id not in ids(search.cursor("name", "khatu"))
+    assert narrowed[-1] is None
+
+@pytest.mark.parametrize("field, queries", [
+    ("name", ("", "k", "kh", "kha", "khan", "khann", "kha", "s", "sh", "sha", "shank")),
+    ("disease", ("d", "di", "dia", "diab", "a", "as", "ast", "asthmatic")),
+    ("mob no.", ("9", "98", "987", "98765", "9876500003", "98765")),
+    ("date", ("2024", "2024-03", "2024-03-0", "2024-03-02..2024-03-04", "2024-03-0")),
+])
+def test_results_always_equal_a_fresh_search(repository, field, queries):
+    search = storage.IncrementalSearch(repository)
+    for text in queries:
+        assert ids(search.cursor(field, text)) == [p.id for p in repository.search(field, text)], text
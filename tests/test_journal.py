@@ -0,0 +1,132 @@
+import json
+import os
+
+from conftest import make_record
+
+def test_replay_restores_inserts_visits_and_deletes(open_repository):
+    repository = open_repository()
+    kept = repository.insert(make_record("Aisha Khan"))
+    removed = repository.insert(make_record("Ravi Sharma", mobile_no="9123456780"))
+    repository.add_visit(kept, make_record("Aisha Khan", date="2024-04-01", weight="61.5"))
+    repository.delete(removed)
+    repository.close()
+
+    reopened = open_repository()
+    assert reopened.count() == 1
+    patient = reopened.get(kept)
+    assert [visit.get("date") for visit in patient.visits] == ["2024-03-01", "2024-04-01"]
+    assert patient.get("weight") == "61.5"
+    assert reopened.get(removed) is None
+    # Ids are never handed out twice, even for a deleted patient
+    assert reopened.insert(make_record("Neha Das", mobile_no="9000000001")) == "3"
+
+def test_entries_already_in_the_snapshot_are_skipped(journal):
+    journal.write_snapshot([dict(make_record(), id="1")], seq=2, next_id=2)
+    with open(journal.journal_path, "w") as f:
+        f.write(json.dumps({"op": "insert", "seq": 2, "record": dict(make_record("Old"), id="1")}) + "\n")
+        f.write(json.dumps({"op": "insert", "seq": 3, "record": dict(make_record("New"), id="2")}) + "\n")
+    records = journal.load()
+    assert [r["name"] for r in records] == ["Aisha Khan", "New"]
+    assert journal.seq == 3
+    assert journal.next_id == 3
+
+def test_compaction_folds_the_journal_into_the_snapshot(open_repository, tmp_path):
+    repository = open_repository()
+    repository.journal.compact_threshold = 3
+    for i in range(4):
+        repository.insert(make_record(f"Patient {i}", mobile_no=f"90000000{i:02d}"))
+    assert repository.flush()
+    with open(repository.journal.snapshot_path) as f:
+        assert len(json.load(f)["patients"]) >= 3
+    repository.close()
+    assert open_repository().count() == 4
+
+def test_summaries_follow_the_journal(journal, open_repository):
+    repository = open_repository()
+    patient_id = repository.insert(make_record("Aisha Khan"))
+    repository.close()
+    repository = open_repository()
+    repository.journal.write_snapshot(list(repository.patients.values()))
+    repository.add_visit(patient_id, make_record("Aisha Khan", date="2024-05-02"))
+    repository.insert(make_record("Ravi Sharma", mobile_no="9123456780"))
+    assert repository.flush()
+    summaries = journal.load_summaries()
+    assert sorted((s["name"], s["date"]) for s in summaries) == [("Aisha Khan", "2024-05-02"),
+                                                                 ("Ravi Sharma", "2024-03-01")]
+    assert all(s["summary"] for s in summaries)
+
+def test_replay_drops_a_torn_tail(open_repository):
+    repository = open_repository()
+    first = repository.insert(make_record("Aisha Khan"))
+    repository.close()
+    journal_path = repository.journal.journal_path
+    with open(journal_path, "rb") as f:
+        good = f.read()
+    # An append cut short by a crash: half an entry, no newline
+    with open(journal_path, "ab") as f:
+        f.write(b'{"op": "insert", "seq": 2, "record": {"id": "2", "na')
+
+    reopened = open_repository()
+    assert [p.id for p in reopened.search("name", "")] == [first]
+    with open(journal_path, "rb") as f:
+        assert f.read() == good
+    # Appends after the repair land on a clean line
+    second = reopened.insert(make_record("Ravi Sharma", mobile_no="9123456780"))
+    reopened.close()
+    assert sorted(p.id for p in open_repository().search("name", "")) == [first, second]
+
+def test_failed_append_leaves_no_partial_batch(open_repository, monkeypatch):
+    repository = open_repository()
+    repository.insert(make_record("Aisha Khan"))
+    assert repository.flush()
+    journal_path = repository.journal.journal_path
+    with open(journal_path, "rb") as f:
+        before = f.read()
+    fsync = os.fsync
+    def failing_fsync(fd):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    repository.insert(make_record("Ravi Sharma", mobile_no="9123456780"))
+    assert not repository.flush()
+    with open(journal_path, "rb") as f:
+        assert f.read() == before
+    monkeypatch.setattr(os, "fsync", fsync)
+    assert repository.flush()  # The kept batch is retried, and written once
+    with open(journal_path, "rb") as f:
+        assert len(f.read().splitlines()) == len(before.splitlines()) + 1
+    repository.close()
+    assert open_repository().count() == 2
+
+def test_duplicates_are_merged_once_when_upgrading(journal, open_repository):
+    # A version 1 snapshot: one record per visit, no format
+    with open(journal.snapshot_path, "w") as f:
+        json.dump({"seq": 0, "next_id": 3, "patients": [dict(make_record(date="2023-01-01"), id="1"),
+                                                       dict(make_record(date="2024-01-01"), id="2")]}, f)
+    repository = open_repository()
+    assert repository.merged_patients == 1
+    assert repository.get("1").visit_count == 2
+    # Father and son sharing a phone, registered apart on purpose with "New patient"
+    son = repository.insert(make_record(date="2024-06-01"))
+    repository.close()
+
+    reopened = open_repository()
+    assert reopened.merged_patients == 0
+    assert sorted(p.id for p in reopened.search("name", "")) == ["1", son]
+    reopened.close()
+    with open(journal.snapshot_path) as f:
+        assert json.load(f)["format"] == 2
+
+def test_a_new_store_is_never_merged(open_repository):
+    repository = open_repository()
+    first = repository.insert(make_record())
+    second = repository.insert(make_record())
+    repository.close()
+    assert sorted(p.id for p in open_repository().search("name", "")) == [first, second]
+
+def test_visit_entries_replay_profile_edits(open_repository):
+    repository = open_repository()
+    patient_id = repository.insert(make_record(diseases="asthma", gender="Female"))
+    repository.add_visit(patient_id, make_record(date="2024-04-01", diseases="asthma, diabetes"))
+    repository.close()
+    patient = open_repository().get(patient_id)
+    assert (patient.get("diseases"), patient.get("gender")) == ("asthma, diabetes", "Female")
@@ -0,0 +1,73 @@
+import storage
+from conftest import make_record
+
+def test_repair_duplicate_ids_rekeys_later_duplicates_and_blanks():
+    records = [{"id": "1"}, {"id": "2"}, {"id": "1"}, {"id": ""}, {"id": "7"}, {}]
+    repaired, next_id = storage.repair_duplicate_ids(records, 1)
+    assert [r["id"] for r in records] == ["1", "2", "8", "9", "7", "10"]
+    assert (repaired, next_id) == (3, 11)
+
+def test_repair_duplicate_ids_never_goes_below_next_id():
+    records = [{"id": "1"}, {"id": "1"}]
+    assert storage.repair_duplicate_ids(records, 50) == (1, 51)
+    assert records[1]["id"] == "50"
+
+def test_repair_duplicate_ids_keeps_unique_ids():
+    records = [{"id": "3"}, {"id": "a"}, {"id": "1"}]
+    assert storage.repair_duplicate_ids(records, 1) == (0, 4)
+    assert [r["id"] for r in records] == ["3", "a", "1"]
+
+def test_patient_round_trips_through_to_dict():
+    record = storage.normalize_record(dict(make_record(weight="61.50", systolic_bp="120"), id="1"))
+    patient = storage.Patient.from_dict(record)
+    assert patient.to_dict() == record
+    assert patient.get("weight") == "61.50"
+    assert patient.vital("systolic_bp") == 120
+
+def test_flat_records_load_as_one_visit():
+    patient = storage.Patient.from_dict(dict(make_record(medicines="metformin"), id="1"))
+    assert patient.visit_count == 1
+    assert patient.get("medicines") == "metformin"
+    assert "medicines" not in patient.to_dict()
+    assert patient.to_dict()["visits"][0]["medicines"] == "metformin"
+
+def stored(**fields):
+    return storage.normalize_record(dict(make_record(**fields), id="1"))
+
+def test_merge_visit_adds_visits_in_date_order():
+    record = stored(date="2024-03-01")
+    storage.merge_visit(record, make_record(date="2024-01-15", weight="70"))
+    storage.merge_visit(record, make_record(date="2024-05-20"))
+    assert [v["date"] for v in record["visits"]] == ["2024-01-15", "2024-03-01", "2024-05-20"]
+    assert record["visits"][0]["weight"] == "70"
+
+def test_merge_visit_applies_profile_edits():
+    record = stored(diseases="asthma", adress="12 Street 4", medical_history="Smoker")
+    storage.merge_visit(record, make_record(diseases="asthma, diabetes", adress="7 Park Road",
+                                            medical_history="Smoker, quit 2023"))
+    assert (record["diseases"], record["adress"], record["medical_history"]) == \
+        ("asthma, diabetes", "7 Park Road", "Smoker, quit 2023")
+
+def test_merge_visit_keeps_profile_when_the_form_only_has_defaults():
+    record = stored(gender="Female", surgery="Yes", surgery_description="appendectomy", diseases="asthma")
+    # The spinners start at "Male" and "No"; blank fields are not an edit either
+    storage.merge_visit(record, make_record(gender="Male", surgery="No", diseases=""))
+    assert (record["gender"], record["surgery"], record["diseases"]) == ("Female", "Yes", "asthma")
+    storage.merge_visit(record, make_record(gender="Other"))
+    assert record["gender"] == "Other"
+
+def test_merge_visit_defaults_fill_empty_fields():
+    record = stored(gender="", surgery="")
+    storage.merge_visit(record, make_record())
+    assert (record["gender"], record["surgery"]) == ("Male", "No")
+
+def test_merge_duplicate_patients_keeps_the_latest_entered_profile():
+    records = [dict(make_record(date="2023-01-01", gender="Female", diseases="asthma"), id="1"),
+               dict(make_record("Ravi Sharma", mobile_no="9123456780"), id="2"),
+               dict(make_record(date="2024-01-01", gender="Male", diseases="asthma, diabetes"), id="3"),
+               dict(make_record(mobile_no=""), id="4")]
+    assert storage.merge_duplicate_patients(records) == 1
+    assert [r["id"] for r in records] == ["1", "2", "4"]
+    merged = records[0]
+    assert [v["date"] for v in merged["visits"]] == ["2023-01-01", "2024-01-01"]
+    assert (merged["gender"], merged["diseases"]) == ("Female", "asthma, diabetes")
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+import storage
+
+FIRST = ("Aisha", "Imran", "Khalid", "Sana", "Mohd", "Ravi", "Priya", "Anil", "Zara", "Fatima")
+LAST = ("Khan", "Rahman", "Sheikh", "Khanna", "Shankar", "Patel", "Iyer", "Qureshi")
+QUERIES = ("", "a", "k", "kh", "an", "kha", "khan", "han", "sheikh", "ima", "fatima khan", "zzz", "xa",
+           "98", "987", "00012", "diab", "tes", "2024-0", "-1")
+
+def make_records(n, seed=7):
+    rng = random.Random(seed)
+    return [{"name": f"{rng.choice(FIRST)} {rng.choice(LAST)}", "mobile_no": f"98{rng.randrange(10 ** 8):08d}",
+             "diseases": rng.choice(("diabetes", "asthma", "hypertension, diabetes", "")),
+             "date": f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}"} for _ in range(n)]
+
+def linear_scan(records, field, text):
+    text = text.lower()
+    return [r for r in records if text in str(r.get(field, "") or "").lower()]
+
+def assert_matches_scan(index, records):
+    for field in index.fields:
+        for text in QUERIES:
+            assert index.search(field, text) == linear_scan(records, field, text), (field, text)
+
+@pytest.fixture
+def indexed():
+    records = make_records(300)
+    index = storage.PatientSearchIndex()
+    index.build(records)
+    return index, records
+
+def test_search_equals_a_linear_scan(indexed):
+    assert_matches_scan(*indexed)
+
+def test_short_queries_scan_every_value(indexed):
+    index, records = indexed
+    for text in ("", "k", "kh", "KH"):
+        assert index.search("name", text) == linear_scan(records, "name", text)
+    assert index.search("name", "") == records
+
+def test_search_after_insert(indexed):
+    index, records = indexed
+    added = [{"name": "Kharim Sheikh", "mobile_no": "9800000012", "diseases": "diabetes", "date": "2024-01-01"},
+             {"name": "Ka", "mobile_no": "", "diseases": "", "date": ""}]
+    for record in added:
+        index.add(record)
+    records += added
+    assert_matches_scan(index, records)
+    assert index.search("name", "ka")[-1] is added[1]
+
+def test_search_after_delete(indexed):
+    index, records = indexed
+    for record in records[::3]:
+        index.remove(record)
+    index.remove({"name": "never indexed"})
+    assert_matches_scan(index, [r for i, r in enumerate(records) if i % 3])
+
+def test_search_after_rename(indexed):
+    # A rename replaces the record, as repository writes do
+    index, records = indexed
+    old = records[10]
+    renamed = dict(old, name="Qadir Khanzada")
+    index.remove(old)
+    index.add(renamed)
+    records = [r for r in records if r is not old] + [renamed]
+    assert_matches_scan(index, records)
+    assert renamed in index.search("name", "khanz") and old not in index.search("name", old["name"])
+
+def test_search_after_the_tombstones_are_rebuilt():
+    records = make_records(2500, seed=11)
+    index = storage.PatientSearchIndex()
+    index.build(records)
+    for record in records[:1300]:
+        index.remove(record)
+    assert len(index.records) < 2500  # Rebuilt without the removed slots
+    assert_matches_scan(index, records[1300:])
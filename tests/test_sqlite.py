@@ -0,0 +1,87 @@
+import sqlite3
+
+import storage
+from conftest import make_record
+
+def create_v1_database(path, records, next_id):
+    """A database as the first SQLite version wrote it: one row per visit, no visits table."""
+    conn = sqlite3.connect(path)
+    columns = ", ".join(f"{f} TEXT NOT NULL DEFAULT ''" for f in storage.PATIENT_FIELDS)
+    keys = ("id",) + storage.PATIENT_FIELDS
+    with conn:
+        conn.execute(f"CREATE TABLE patients (id TEXT, {columns})")
+        conn.execute("CREATE INDEX idx_patients_id ON patients(id)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(f"INSERT INTO patients ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))})",
+                         [[r.get(k, "") for k in keys] for r in records])
+        conn.execute("INSERT INTO meta VALUES ('next_id', ?)", (str(next_id),))
+        conn.execute("PRAGMA user_version = 1")
+    conn.close()
+
+def test_migrates_a_version_1_database(tmp_path, journal):
+    path = str(tmp_path / storage.SQLITE_FILE)
+    create_v1_database(path, [
+        dict(make_record("Aisha Khan", date="2023-01-05", diseases="asthma",
+                         next_appointment_date="12/01/2023"), id="1"),
+        dict(make_record("Ravi Sharma", mobile_no="9123456780", date="2023-02-01"), id="2"),
+        # A repeat visit saved as a new patient, under an id the old allocator reused
+        dict(make_record("aisha  khan", date="2023-03-09", diseases="asthma, diabetes"), id="2"),
+    ], next_id=3)
+    repository = storage.SQLitePatientRepository(path, journal=journal)
+    repository.load()
+    try:
+        assert repository.conn.execute("PRAGMA user_version").fetchone()[0] == storage.SQLitePatientRepository.SCHEMA_VERSION
+        assert repository.count() == 2
+        aisha = repository.find_patient(make_record("Aisha Khan"))
+        assert aisha.visit_count == 2
+        assert aisha.get("date") == "2023-03-09"
+        assert aisha.get("diseases") == "asthma, diabetes"
+        assert [v.get("date") for v in repository.visits(aisha.id)] == ["2023-03-09", "2023-01-05"]
+        assert repository.visits(aisha.id)[1].get("next_appointment_date") == "2023-01-12"
+        assert repository.get("2").get("name") == "Ravi Sharma"
+        # The duplicate id was re-keyed, and new ids continue after it
+        assert repository.next_id == 4
+        assert repository.insert(make_record("Neha Das", mobile_no="9000000001")) == "4"
+    finally:
+        repository.close()
+
+def test_migration_imports_patients_json_once(tmp_path, journal):
+    journal.write_snapshot([dict(make_record("Aisha Khan"), id="1"),
+                            dict(make_record("Ravi Sharma", mobile_no="9123456780"), id="1")], seq=0, next_id=2)
+    path = str(tmp_path / storage.SQLITE_FILE)
+    repository = storage.SQLitePatientRepository(path, journal=journal)
+    repository.load()
+    repository.close()
+    reopened = storage.SQLitePatientRepository(path, journal=journal)
+    reopened.load()
+    try:
+        assert reopened.count() == 2
+        assert sorted(p.id for p in reopened.search("name", "")) == ["1", "2"]
+    finally:
+        reopened.close()
+
+def test_add_visit_follows_the_profile_rule(tmp_path, journal):
+    repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+    repository.load()
+    try:
+        patient_id = repository.insert(make_record(gender="Female", diseases="asthma", adress=""))
+        repository.add_visit(patient_id, make_record(date="2024-04-01", gender="Male", diseases="asthma, diabetes",
+                                                     adress="7 Park Road"))
+        patient = repository.get(patient_id)
+        assert (patient.get("gender"), patient.get("diseases"), patient.get("adress")) == \
+            ("Female", "asthma, diabetes", "7 Park Road")
+        assert patient.visit_count == 2
+    finally:
+        repository.close()
+
+def test_migrating_a_current_json_store_keeps_separate_patients(tmp_path, journal):
+    # Same patient_key, kept apart in the JSON store on purpose
+    journal.write_snapshot([dict(make_record(), id="1"), dict(make_record(date="2024-06-01"), id="2")],
+                           seq=0, next_id=3)
+    repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+    repository.load()
+    try:
+        assert repository.count() == 2
+        assert repository.conn.execute("PRAGMA user_version").fetchone()[0] == storage.SQLitePatientRepository.SCHEMA_VERSION
+    finally:
+        repository.close()
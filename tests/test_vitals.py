@@ -0,0 +1,134 @@
+import random
+from collections import Counter
+
+import pytest
+
+import storage
+from conftest import make_record
+
+RANGES = ((None, None), ("2024-02-01", "2024-04-30"), ("2024-03-10", "2024-03-10"), ("2024-03-11", None),
+          (None, "2024-01-31"), ("2025-01-01", "2025-12-31"))
+
+def make_visits(n, seed=3):
+    """(patient id, visit) pairs with some vitals blank or unreadable, as typed into the form."""
+    rng = random.Random(seed)
+    def reading(low, high):
+        return rng.choice([str(rng.randrange(low, high))] * 8 + [rng.randrange(low, high), "", "n/a"])
+    return [(f"p{rng.randrange(n // 3)}", {
+        "date": rng.choice([f"2024-{rng.randrange(1, 7):02d}-{rng.randrange(1, 29):02d}"] * 20 + [""]),
+        "weight": rng.choice([f"{rng.uniform(40, 110):.1f}", ""]), "systolic_bp": reading(95, 175),
+        "diastolic_bp": reading(60, 110), "pulse_rate": reading(50, 120)}) for _ in range(n)]
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def in_range(visits, start, end):
+    # A visit without a date counts as older than any date
+    return [(pid, v) for pid, v in visits
+            if (not start or v.get("date", "") >= start) and (not end or v.get("date", "") <= end)]
+
+def reference_distribution(visits, field, start, end):
+    values = sorted(x for x in (number(v.get(field)) for _, v in in_range(visits, start, end)) if x is not None)
+    if not values:
+        return {"count": 0, "histogram": []}
+    n, width = len(values), storage.VITAL_BIN_WIDTHS[field]
+    rank = lambda q: values[int(q * (n - 1))]
+    return {"count": n, "mean": pytest.approx(sum(values) / n), "min": min(values), "p25": rank(0.25),
+            "median": rank(0.5), "p75": rank(0.75), "max": max(values),
+            "histogram": sorted(Counter(x // width * width for x in values).items())}
+
+def reference_hypertension(visits, start, end):
+    visits = in_range(visits, start, end)
+    categories = Counter()
+    raised = set()
+    for pid, visit in visits:
+        systolic, diastolic = number(visit.get("systolic_bp")), number(visit.get("diastolic_bp"))
+        if systolic is None or diastolic is None:
+            category = "Not recorded"
+        elif systolic >= 140 or diastolic >= 90:
+            category = "Stage 2"
+        elif systolic >= 130 or diastolic >= 80:
+            category = "Stage 1"
+        else:
+            category = "Elevated" if systolic >= 120 else "Normal"
+        categories[category] += 1
+        if category in ("Stage 1", "Stage 2"):
+            raised.add(pid)
+    return {"visits": {c: categories[c] for c in storage.BP_CATEGORIES + ("Not recorded",)}, "patients": len(raised)}
+
+def assert_matches_reference(columns, visits):
+    assert len(columns) == len(visits)
+    for start, end in RANGES:
+        assert columns.hypertension(start, end) == reference_hypertension(visits, start, end), (start, end)
+        for field in storage.VitalsColumns.FIELDS:
+            assert columns.distribution(field, start, end) == reference_distribution(visits, field, start, end), \
+                (field, start, end)
+
+@pytest.fixture
+def visits():
+    return make_visits(600)
+
+@pytest.fixture
+def columns(visits):
+    columns = storage.VitalsColumns()
+    columns.extend_visits(visits)
+    return columns
+
+def test_reports_equal_a_reference_computed_from_the_visits(columns, visits):
+    assert_matches_reference(columns, visits)
+
+def test_no_readings_gives_an_empty_distribution():
+    columns = storage.VitalsColumns()
+    columns.extend_visits([("p", {"date": "2024-03-01", "weight": ""})])
+    assert columns.distribution("weight") == {"count": 0, "histogram": []}
+    assert columns.hypertension()["visits"]["Not recorded"] == 1
+
+def test_add_and_remove_keep_the_reports_consistent(columns, visits):
+    rng = random.Random(5)
+    for pid, visit in make_visits(60, seed=9):
+        columns.add(pid, [visit])
+        visits.append((pid, visit))
+    # Remove single visits, then every visit of some patients
+    for pid, visit in rng.sample(visits, 40):
+        columns.remove(pid, [visit])
+        visits.remove((pid, visit))
+    gone = {pid for pid, _ in rng.sample(visits, 10)}
+    for pid in sorted(gone)[:5]:
+        columns.remove(pid)
+    columns.drop(sorted(gone)[5:])
+    columns.remove("never stored")
+    visits = [(pid, v) for pid, v in visits if pid not in gone]
+    assert_matches_reference(columns, visits)
+
+def test_columns_survive_a_round_trip_through_bytes(columns, visits):
+    assert_matches_reference(storage.VitalsColumns.from_bytes(columns.to_bytes()), visits)
+
+@pytest.fixture(params=["journal", "sqlite"])
+def repository(request, open_repository, tmp_path, journal):
+    if request.param == "journal":
+        return open_repository()
+    repository = storage.SQLitePatientRepository(str(tmp_path / storage.SQLITE_FILE), journal=journal)
+    repository.load()
+    request.addfinalizer(repository.close)
+    return repository
+
+def stored_visits(repository, ids):
+    return [(pid, {f: visit.get(f) for f in ("date",) + storage.VitalsColumns.FIELDS})
+            for pid in ids for visit in repository.visits(pid)]
+
+def test_repository_vitals_follow_inserts_visits_and_deletes(repository):
+    ids = []
+    for i, (_, visit) in enumerate(make_visits(30, seed=13)):
+        ids.append(repository.insert(make_record(f"Patient {i}", mobile_no=f"90000000{i:02d}", **visit)))
+    vitals = repository.vitals()
+    assert_matches_reference(vitals, stored_visits(repository, ids))
+    for pid, (_, visit) in zip(ids[::2], make_visits(30, seed=17)):
+        repository.add_visit(pid, make_record(**visit))
+    deleted = set(ids[1::3])
+    for pid in deleted:
+        repository.delete(pid)
+    ids = [pid for pid in ids if pid not in deleted]
+    assert_matches_reference(repository.vitals(), stored_visits(repository, ids))